@@ -0,0 +1,214 @@
+# ========================================================================= #
+# Queries over the boxes of a COCO annotation file.                         #
+#                                                                           #
+# BoxIndex precomputes one array per annotation attribute and sorts each    #
+# of them once:                                                             #
+# width, height, area, aspect (w / h), cx, cy (centre normalized by the     #
+# image size), category, source (coco or lisa) and clip (LISA clip name,    #
+# e.g. nightClip3, empty for COCO images).                                  #
+#                                                                           #
+# Range and equality predicates are answered by binary search on the        #
+# sorted arrays and combined as boolean masks. count filters the images     #
+# with matching annotations by their number. Queries are written as terms,  #
+# e.g.                                                                      #
+#                                                                           #
+#   category=92 width<8 clip=night*                                         #
+#   category=10,92,93,94 count>5                                            #
+#                                                                           #
+# Results are sets of annotation or image ids. subset_dataset turns them    #
+# into a COCO dataset for the builders and exporters, the labeller takes    #
+# the annotation ids as its review queue.                                   #
+# ========================================================================= #
+
+import re
+
+import numpy as np
+
+SOURCES = {'coco': 0, 'lisa': 1}
+NUMERIC = ('width', 'height', 'area', 'aspect', 'cx', 'cy', 'category', 'source')
+ATTRIBUTES = NUMERIC + ('clip', 'count')
+
+_TERM = re.compile(r'^(\w+)\s*(<=|>=|!=|=|<|>)\s*(\S+)$')
+
+
+def _clip(img):
+    # LISA file names have the form <clip>--<frame>.jpg, COCO file names are numbers
+    clip, sep, _ = img.get('file_name', '').partition('--')
+    return clip if sep else ''
+
+
+def parse_query(text):
+    """
+    Parses a query into a list of (attribute, operator, value) terms.
+    Terms are separated by whitespace or "and". Values of = and != may be
+    comma separated lists, clip values may end with * for a prefix.
+    """
+    terms = []
+    for token in re.split(r'\s+(?:and\s+)?', text.strip()):
+        if not token:
+            continue
+        match = _TERM.match(token)
+        if match is None:
+            raise ValueError("Cannot parse query term '{}'.".format(token))
+        attr, op, value = match.groups()
+        if attr not in ATTRIBUTES:
+            raise ValueError("Unknown attribute '{}', expected one of {}.".format(attr, ATTRIBUTES))
+        if attr == 'clip':
+            if op not in ('=', '!='):
+                raise ValueError("clip only supports = and !=.")
+            value = value.split(',')
+        elif attr == 'source':
+            value = [SOURCES[v.lower()] for v in value.split(',')]
+        elif op in ('=', '!='):
+            value = [float(v) for v in value.split(',')]
+        else:
+            value = float(value)
+        terms.append((attr, op, value))
+    return terms
+
+
+class BoxIndex:
+    """
+    Sorted attribute arrays over the annotations of a COCO dataset.
+    """
+    def __init__(self, dataset):
+        images = dataset['images']
+        img_rows = {img['id']: i for i, img in enumerate(images)}
+        anns = [ann for ann in dataset['annotations'] if ann['image_id'] in img_rows]
+        if len(anns) < len(dataset['annotations']):
+            print("Skipped {} annotations without image.".format(len(dataset['annotations']) - len(anns)))
+
+        self.image_ids = np.array([img['id'] for img in images], dtype=object)
+        self.ann_ids = np.array([ann['id'] for ann in anns], dtype=object)
+        self.ann_images = np.array([img_rows[ann['image_id']] for ann in anns], dtype=np.int64)
+
+        img_w = np.array([img['width'] for img in images], dtype=np.float64)
+        img_h = np.array([img['height'] for img in images], dtype=np.float64)
+        img_clip = np.array([_clip(img) for img in images], dtype=str)
+        img_source = np.where(img_clip != '', SOURCES['lisa'], SOURCES['coco']).astype(np.int64)
+
+        boxes = np.array([ann['bbox'] for ann in anns], dtype=np.float64).reshape(-1, 4)
+        rows = self.ann_images
+        w, h = boxes[:, 2], boxes[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aspect = np.where(h > 0, w / h, np.inf)
+        self.values = {
+            'width': w,
+            'height': h,
+            'area': w * h,
+            'aspect': aspect,
+            'cx': (boxes[:, 0] + 0.5 * w) / img_w[rows],
+            'cy': (boxes[:, 1] + 0.5 * h) / img_h[rows],
+            'category': np.array([ann['category_id'] for ann in anns], dtype=np.int64),
+            'source': img_source[rows],
+            'clip': img_clip[rows] if len(images) else np.array([], dtype=str),
+        }
+        self._sorted = dict()
+
+    def __len__(self):
+        return len(self.ann_ids)
+
+    def _sorted_values(self, attr):
+        # Sorts an attribute on first use
+        if attr not in self._sorted:
+            order = np.argsort(self.values[attr], kind='stable')
+            self._sorted[attr] = (order, self.values[attr][order])
+        return self._sorted[attr]
+
+    def _mask(self, order, start, end):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    def range(self, attr, lo=None, hi=None, lo_inclusive=True, hi_inclusive=True):
+        """
+        Returns the mask of annotations with lo <= attr <= hi. Bounds which
+        are None are open.
+        """
+        order, values = self._sorted_values(attr)
+        start = 0 if lo is None else np.searchsorted(values, lo, side='left' if lo_inclusive else 'right')
+        end = len(values) if hi is None else np.searchsorted(values, hi, side='right' if hi_inclusive else 'left')
+        return self._mask(order, start, max(start, end))
+
+    def isin(self, attr, values):
+        """
+        Returns the mask of annotations whose attr equals one of values. For
+        clip, values ending with * match as prefix.
+        """
+        order, sorted_values = self._sorted_values(attr)
+        mask = np.zeros(len(self), dtype=bool)
+        for value in values:
+            if attr == 'clip' and value.endswith('*'):
+                prefix = value[:-1]
+                start = np.searchsorted(sorted_values, prefix, side='left')
+                end = np.searchsorted(sorted_values, prefix + '\U0010ffff', side='left')
+            else:
+                start = np.searchsorted(sorted_values, value, side='left')
+                end = np.searchsorted(sorted_values, value, side='right')
+            mask[order[start:end]] = True
+        return mask
+
+    def image_counts(self, mask):
+        # Number of annotations in mask per image row
+        return np.bincount(self.ann_images[mask], minlength=len(self.image_ids))
+
+    def select(self, terms):
+        """
+        Evaluates parsed terms. Returns the masks of matching annotations and
+        matching image rows.
+        """
+        ann_mask = np.ones(len(self), dtype=bool)
+        counts = []
+        for attr, op, value in terms:
+            if attr == 'count':
+                counts.append((op, value))
+            elif op == '=':
+                ann_mask &= self.isin(attr, value)
+            elif op == '!=':
+                ann_mask &= ~self.isin(attr, value)
+            elif op in ('<', '<='):
+                ann_mask &= self.range(attr, hi=value, hi_inclusive=op == '<=')
+            else:
+                ann_mask &= self.range(attr, lo=value, lo_inclusive=op == '>=')
+
+        # Images match if they have matching annotations, as many as counts asks for
+        img_counts = self.image_counts(ann_mask)
+        img_mask = img_counts > 0
+        if counts:
+            for op, value in counts:
+                value = np.asarray(value)
+                img_mask &= {
+                    '<': lambda: img_counts < value,
+                    '<=': lambda: img_counts <= value,
+                    '>': lambda: img_counts > value,
+                    '>=': lambda: img_counts >= value,
+                    '=': lambda: np.isin(img_counts, value),
+                    '!=': lambda: ~np.isin(img_counts, value),
+                }[op]()
+            ann_mask &= img_mask[self.ann_images]
+        return ann_mask, img_mask
+
+    def query(self, text):
+        """
+        Returns the sets of annotation ids and image ids matching a query.
+        """
+        ann_mask, img_mask = self.select(parse_query(text))
+        return set(self.ann_ids[ann_mask].tolist()), set(self.image_ids[img_mask].tolist())
+
+
+def subset_dataset(dataset, ann_ids=None, image_ids=None):
+    """
+    Returns a COCO dataset with the given annotations, or all annotations of
+    the given images. Images without annotations in the result are dropped
+    unless they are listed in image_ids.
+    """
+    if ann_ids is None:
+        anns = [ann for ann in dataset['annotations'] if ann['image_id'] in image_ids]
+    else:
+        anns = [ann for ann in dataset['annotations'] if ann['id'] in ann_ids]
+    keep = set(ann['image_id'] for ann in anns) | set(image_ids or ())
+
+    dataset_out = dict(dataset)
+    dataset_out['images'] = [img for img in dataset['images'] if img['id'] in keep]
+    dataset_out['annotations'] = anns
+    return dataset_out
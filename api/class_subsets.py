@@ -0,0 +1,155 @@
+# ========================================================================= #
+# Class subsets of the COCO Traffic datasets.                               #
+#                                                                           #
+# A subset is declared by the names of its classes and how category ids    #
+# are assigned in the output:                                               #
+# - keep  - COCO category ids are kept                                      #
+# - dense - Classes are numbered 0, 1, ... in the order given               #
+#                                                                           #
+# derive_subset filters the images and annotations of any loaded COCO       #
+# dataset to a subset and remaps the category ids through a lookup array,   #
+# in one vectorized pass. The yolo class ids (COCO_TO_YOLO) are the dense   #
+# "yolo" subset.                                                            #
+# ========================================================================= #
+
+import numpy as np
+
+# Categories of the traffic datasets
+CATEGORIES = [
+    {'supercategory': 'person', 'id': 1, 'name': 'person'},
+    {'supercategory': 'vehicle', 'id': 2, 'name': 'bicycle'},
+    {'supercategory': 'vehicle', 'id': 3, 'name': 'car'},
+    {'supercategory': 'vehicle', 'id': 4, 'name': 'motorcycle'},
+    {'supercategory': 'vehicle', 'id': 6, 'name': 'bus'},
+    {'supercategory': 'vehicle', 'id': 7, 'name': 'train'},
+    {'supercategory': 'vehicle', 'id': 8, 'name': 'truck'},
+    {'supercategory': 'outdoor', 'id': 10, 'name': 'traffic light'},
+    {'supercategory': 'outdoor', 'id': 11, 'name': 'fire hydrant'},
+    {'supercategory': 'outdoor', 'id': 13, 'name': 'stop sign'},
+    {'supercategory': 'animal', 'id': 17, 'name': 'cat'},
+    {'supercategory': 'animal', 'id': 18, 'name': 'dog'},
+    {'supercategory': 'outdoor', 'id': 92, 'name': 'traffic_light_red'},
+    {'supercategory': 'outdoor', 'id': 93, 'name': 'traffic_light_green'},
+    {'supercategory': 'outdoor', 'id': 94, 'name': 'traffic_light_na'}]
+
+CATEGORY_IDS = {cat['name']: cat['id'] for cat in CATEGORIES}
+
+TRAFFIC_LIGHTS = ['traffic light', 'traffic_light_red', 'traffic_light_green', 'traffic_light_na']
+
+SUBSETS = {
+    # All 15 classes of COCO Traffic
+    'traffic': {'classes': [cat['name'] for cat in CATEGORIES], 'ids': 'keep'},
+    # Traffic lights, including the not relabelled class 10
+    'traffic_lights': {'classes': TRAFFIC_LIGHTS, 'ids': 'keep'},
+    # Relabelled traffic lights only
+    'traffic_lights_refined': {'classes': TRAFFIC_LIGHTS[1:], 'ids': 'keep'},
+    # yolov5 classes, class 10 has no yolo class
+    'yolo': {'classes': [cat['name'] for cat in CATEGORIES if cat['id'] != 10], 'ids': 'dense'},
+}
+
+
+def get_subset(subset):
+    """
+    Returns the spec of a subset, given by name or as spec dictionary.
+    """
+    if isinstance(subset, str):
+        if subset not in SUBSETS:
+            raise KeyError("Unknown subset {}, expected one of {}.".format(subset, sorted(SUBSETS)))
+        return SUBSETS[subset]
+    if subset.get('ids', 'keep') not in ('keep', 'dense'):
+        raise ValueError("ids must be 'keep' or 'dense', got {}.".format(subset['ids']))
+    return subset
+
+
+def class_map(subset, categories=CATEGORIES):
+    """
+    Returns the dictionary source category id -> output category id.
+
+    Inputs:
+    subset     - Subset name or spec.
+    categories - Categories to resolve the class names with.
+    """
+    spec = get_subset(subset)
+    ids = {cat['name']: int(cat['id']) for cat in categories}
+    missing = [name for name in spec['classes'] if name not in ids]
+    if missing:
+        raise KeyError("Classes {} not found in the categories.".format(missing))
+    if spec.get('ids', 'keep') == 'dense':
+        return {ids[name]: i for i, name in enumerate(spec['classes'])}
+    return {ids[name]: ids[name] for name in spec['classes']}
+
+
+def lookup_table(mapping, size=None):
+    """
+    Returns an array with lut[source id] = output id and -1 for dropped ids.
+    """
+    size = max(size or 0, max(mapping) + 1)
+    lut = np.full(size, -1, dtype=np.int64)
+    lut[np.fromiter(mapping.keys(), dtype=np.int64)] = np.fromiter(mapping.values(), dtype=np.int64)
+    return lut
+
+
+def derive_subset(dataset, subset, keep_empty_images=False, keep_categories=False):
+    """
+    Derives a subset from a COCO dataset.
+
+    Inputs:
+    dataset           - COCO annotation file object. It is not modified.
+    subset            - Subset name or spec.
+    keep_empty_images - Keep images without annotations of the subset.
+    keep_categories   - Keep the category list of dataset, only valid if
+                        the ids are kept.
+
+    Returns:
+    dataset_out       - COCO annotation file object. Images are ordered by
+                        their first annotation and annotations are grouped
+                        by image. Other keys are shared with dataset.
+    """
+    spec = get_subset(subset)
+    mapping = class_map(spec, dataset['categories'])
+    dense = spec.get('ids', 'keep') == 'dense'
+    if keep_categories and dense:
+        raise ValueError("keep_categories requires a subset which keeps the category ids.")
+
+    images = dataset['images']
+    anns = dataset['annotations']
+
+    # Category and image row of each annotation, one pass over the annotations
+    img_rows = {img['id']: i for i, img in enumerate(images)}
+    cat_ids = np.fromiter((ann['category_id'] for ann in anns), dtype=np.int64, count=len(anns))
+    ann_rows = np.fromiter((img_rows.get(ann['image_id'], -1) for ann in anns), dtype=np.int64, count=len(anns))
+
+    lut = lookup_table(mapping, int(cat_ids.max()) + 1 if len(cat_ids) else 0)
+    new_ids = np.where((cat_ids >= 0) & (cat_ids < len(lut)), lut[np.clip(cat_ids, 0, len(lut) - 1)], -1)
+    keep = np.flatnonzero((new_ids >= 0) & (ann_rows >= 0))
+
+    # Images in the order of their first annotation, annotations grouped by image
+    rows, first = np.unique(ann_rows[keep], return_index=True)
+    img_order = rows[np.argsort(first, kind='stable')]
+    rank = np.empty(len(images), dtype=np.int64)
+    rank[img_order] = np.arange(len(img_order))
+    keep = keep[np.argsort(rank[ann_rows[keep]], kind='stable')]
+    if keep_empty_images:
+        empty = np.ones(len(images), dtype=bool)
+        empty[img_order] = False
+        img_order = np.concatenate([img_order, np.flatnonzero(empty)])
+
+    changed = new_ids != cat_ids
+    anns_out = [dict(anns[i], category_id=int(new_ids[i])) if changed[i] else anns[i] for i in keep.tolist()]
+
+    if keep_categories:
+        categories = dataset['categories']
+    else:
+        categories = [dict(cat, id=mapping[int(cat['id'])]) for cat in dataset['categories'] if int(cat['id']) in mapping]
+        categories.sort(key=lambda cat: cat['id'])
+
+    dataset_out = dict(dataset)
+    dataset_out['images'] = [images[i] for i in img_order.tolist()]
+    dataset_out['annotations'] = anns_out
+    dataset_out['categories'] = categories
+
+    print("Subset {}: kept {} / {} images and {} / {} annotations.".format(
+        subset if isinstance(subset, str) else spec['classes'],
+        len(dataset_out['images']), len(images), len(anns_out), len(anns)))
+
+    return dataset_out
@@ -0,0 +1,265 @@
+# ========================================================================= #
+# On-disk annotation store in SQLite.                                       #
+#                                                                           #
+# Tables images, annotations, categories and licenses hold every record as  #
+# its JSON text plus the columns needed for queries (image_id, category_id, #
+# file name and sizes, box). annotations is indexed on image_id and         #
+# category_id. Ids keep their type, so LISA string ids work as well.        #
+#                                                                           #
+# import_coco streams a COCO file into the store in batched transactions,   #
+# update_categories changes labels in one transaction and export streams    #
+# the store back to a COCO file without parsing the records. Editing a      #
+# hundred labels thus touches a hundred rows instead of rewriting the file. #
+# ========================================================================= #
+
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+
+from merge_coco import iter_records
+from instrument import timed
+
+SECTIONS = ('licenses', 'categories', 'images', 'annotations')
+KEYS = ('info', 'licenses', 'images', 'annotations', 'categories')
+
+# Columns without a declared type keep the type of their values
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS licenses (id PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS categories (id PRIMARY KEY, name TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS images (
+    pos INTEGER PRIMARY KEY, id UNIQUE NOT NULL, file_name TEXT, width INTEGER, height INTEGER,
+    data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS annotations (
+    pos INTEGER PRIMARY KEY, id UNIQUE NOT NULL, image_id, category_id INTEGER,
+    x REAL, y REAL, w REAL, h REAL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS annotations_image_id ON annotations (image_id);
+CREATE INDEX IF NOT EXISTS annotations_category_id ON annotations (category_id);
+"""
+
+
+def _box(ann):
+    bbox = ann.get('bbox')
+    if isinstance(bbox, list) and len(bbox) == 4:
+        return bbox
+    return [None] * 4
+
+
+def _row(key, record):
+    # Table row of a record
+    data = json.dumps(record, ensure_ascii=False)
+    if key == 'annotations':
+        return (record['id'], record.get('image_id'), record.get('category_id')) + tuple(_box(record)) + (data,)
+    if key == 'images':
+        return (record['id'], record.get('file_name'), record.get('width'), record.get('height'), data)
+    if key == 'categories':
+        return (record['id'], record.get('name'), data)
+    return (record['id'], data)
+
+
+_INSERT = {
+    'licenses': "INSERT INTO licenses (id, data) VALUES (?, ?)",
+    'categories': "INSERT INTO categories (id, name, data) VALUES (?, ?, ?)",
+    'images': "INSERT INTO images (id, file_name, width, height, data) VALUES (?, ?, ?, ?, ?)",
+    'annotations': "INSERT INTO annotations (id, image_id, category_id, x, y, w, h, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+
+class CocoStore:
+    """
+    COCO annotations in an SQLite database.
+
+    Inputs:
+    path - Database file, created if it does not exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups changes into one transaction, rolled back on errors.
+        """
+        with self.conn:
+            yield self.conn
+
+    def is_empty(self):
+        return self.conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0] == 0
+
+    def counts(self):
+        # Number of rows per table
+        return {key: self.conn.execute("SELECT COUNT(*) FROM {}".format(key)).fetchone()[0] for key in SECTIONS}
+
+    @timed()
+    def import_coco(self, source, batch_size=10000):
+        """
+        Replaces the content of the store with a COCO annotation file or
+        loaded dataset. The file is read once and its records are inserted
+        in batches of batch_size. Top level keys other than info and the
+        four sections are dropped.
+        """
+        # Order of the top level keys in the export
+        if isinstance(source, dict):
+            keys = [key for key in source if key == 'info' or key in SECTIONS]
+        else:
+            keys = list(KEYS)
+
+        with self.transaction() as conn:
+            for key in SECTIONS:
+                conn.execute("DELETE FROM {}".format(key))
+            conn.execute("DELETE FROM meta")
+            conn.execute("INSERT INTO meta VALUES ('keys', ?)", (json.dumps(keys),))
+
+            info = None
+            batch = {key: [] for key in SECTIONS}
+            for key, record in iter_records(source, ('info',) + SECTIONS):
+                if key == 'info':
+                    info = record
+                    continue
+                batch[key].append(_row(key, record))
+                if len(batch[key]) >= batch_size:
+                    conn.executemany(_INSERT[key], batch[key])
+                    batch[key] = []
+            for key in SECTIONS:
+                if batch[key]:
+                    conn.executemany(_INSERT[key], batch[key])
+            conn.execute("INSERT INTO meta VALUES ('info', ?)", (json.dumps(info, ensure_ascii=False),))
+
+        print("Imported {} into {}: {}".format(source if isinstance(source, str) else "dataset", self.path, self.counts()))
+
+    def _keys(self):
+        # Top level keys of the imported file, in their order
+        if self.is_empty():
+            raise ValueError("Store {} is empty, import a COCO file first.".format(self.path))
+        return json.loads(self.conn.execute("SELECT value FROM meta WHERE key = 'keys'").fetchone()[0])
+
+    def _records(self, query, args=()):
+        for (data,) in self.conn.execute(query, args):
+            yield json.loads(data)
+
+    def info(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'info'").fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def categories(self):
+        return list(self._records("SELECT data FROM categories"))
+
+    def licenses(self):
+        return list(self._records("SELECT data FROM licenses"))
+
+    def images(self, image_ids=None):
+        """
+        Yields all images or the images with the given ids.
+        """
+        if image_ids is None:
+            yield from self._records("SELECT data FROM images ORDER BY pos")
+            return
+        for image_id in image_ids:
+            yield from self._records("SELECT data FROM images WHERE id = ?", (image_id,))
+
+    def annotations(self, image_id=None, category_ids=None):
+        """
+        Yields annotations, optionally of one image and / or some categories.
+        Both filters use an index.
+        """
+        where = []
+        args = []
+        if image_id is not None:
+            where.append("image_id = ?")
+            args.append(image_id)
+        if category_ids is not None:
+            category_ids = list(category_ids)
+            where.append("category_id IN ({})".format(", ".join("?" * len(category_ids))))
+            args += category_ids
+        query = "SELECT data FROM annotations"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        yield from self._records(query + " ORDER BY pos", args)
+
+    def image_ids(self, category_ids):
+        """
+        Returns the ids of images with annotations of the given categories.
+        """
+        category_ids = list(category_ids)
+        query = "SELECT DISTINCT image_id FROM annotations WHERE category_id IN ({})".format(
+            ", ".join("?" * len(category_ids)))
+        return [row[0] for row in self.conn.execute(query, category_ids)]
+
+    def update_categories(self, changes):
+        """
+        Sets the category of annotations in one transaction.
+
+        Inputs:
+        changes - Iterable of (annotation id, category id).
+
+        Returns:
+        count   - Number of changed annotations.
+        """
+        count = 0
+        with self.transaction() as conn:
+            for ann_id, category_id in changes:
+                row = conn.execute("SELECT data FROM annotations WHERE id = ?", (ann_id,)).fetchone()
+                if row is None:
+                    continue
+                ann = json.loads(row[0])
+                ann['category_id'] = category_id
+                conn.execute("UPDATE annotations SET category_id = ?, data = ? WHERE id = ?",
+                             (category_id, json.dumps(ann, ensure_ascii=False), ann_id))
+                count += 1
+        return count
+
+    def upsert_categories(self, categories):
+        """
+        Adds categories or updates those with the same id in place, so the
+        order of the categories is kept.
+        """
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO categories (id, name, data) VALUES (?, ?, ?) "
+                             "ON CONFLICT(id) DO UPDATE SET name = excluded.name, data = excluded.data",
+                             [_row('categories', cat) for cat in categories])
+
+    def to_dataset(self):
+        """
+        Returns the content as COCO annotation file object. Raises a
+        ValueError if nothing was imported yet.
+        """
+        dataset = dict()
+        for key in self._keys():
+            if key == 'info':
+                dataset[key] = self.info()
+            else:
+                dataset[key] = list(self._records("SELECT data FROM {} ORDER BY rowid".format(key)))
+        return dataset
+
+    @timed()
+    def export(self, filename):
+        """
+        Writes the store as COCO annotation file. Records are copied as
+        stored, without parsing them. The file is replaced atomically.
+        Raises a ValueError if nothing was imported yet.
+        """
+        keys = self._keys()
+        with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('{')
+            for i, key in enumerate(keys):
+                f.write('{}{}: '.format(', ' if i else '', json.dumps(key)))
+                if key == 'info':
+                    f.write(json.dumps(self.info(), ensure_ascii=False))
+                    continue
+                f.write('[')
+                for j, (data,) in enumerate(self.conn.execute("SELECT data FROM {} ORDER BY rowid".format(key))):
+                    if j:
+                        f.write(', ')
+                    f.write(data)
+                f.write(']')
+            f.write('}')
+        os.replace(filename + '.tmp', filename)
+        print("Exported {} to {}.".format(self.path, filename))
@@ -0,0 +1,207 @@
+# ========================================================================= #
+# Compares two COCO annotation files record by record.                      #
+#                                                                           #
+# Images, annotations, categories and licenses are matched by id and        #
+# reported as added, removed or changed. For changed records the report     #
+# lists the changed fields, with old and new values for the fields in       #
+# DETAIL_FIELDS, e.g. category changes, and the delta of changed boxes.     #
+#                                                                           #
+# Each record is hashed once as a whole, with binary floats instead of      #
+# their text, so segmentations are cheap to hash. Of the first file only    #
+# these digests are kept. Records whose digests differ are compared field   #
+# by field in a second pass over the sections of the first file which       #
+# have changes. With ijson installed the sections are streamed by the C     #
+# parser (ijson.items), otherwise each file is loaded once per pass.        #
+# ========================================================================= #
+
+import json
+import marshal
+import hashlib
+from operator import itemgetter
+
+import merge_coco
+from merge_coco import iter_records, iter_section
+from instrument import timed
+
+SECTIONS = ('images', 'annotations', 'categories', 'licenses')
+SMALL_SECTIONS = ('categories', 'licenses')  # Read as one list, the pass ends with them
+
+# Fields whose old and new values are reported
+DETAIL_FIELDS = {
+    'images': ('file_name', 'width', 'height'),
+    'annotations': ('image_id', 'category_id', 'bbox', 'area', 'iscrowd'),
+    'categories': ('name', 'supercategory'),
+    'licenses': ('name', 'url'),
+}
+
+
+def _canonical(value):
+    # Dictionaries as sorted item tuples, also within lists of dictionaries,
+    # so key order does not matter
+    if type(value) is dict:
+        return tuple(sorted([(k, _canonical(v)) for k, v in value.items()]))
+    if type(value) is list and value and type(value[0]) is dict:
+        return [_canonical(v) for v in value]
+    return value
+
+
+def _digest(value, size=8):
+    # BLAKE2b digest of a value. marshal version 2 writes floats as binary
+    # and has no references, so equal JSON values give equal bytes.
+    return hashlib.blake2b(marshal.dumps(_canonical(value), 2), digest_size=size).digest()
+
+
+class _RecordHasher:
+    """
+    Hashes whole records. Records share the sorted keys and the getter of
+    their key order.
+    """
+    def __init__(self):
+        self.key_cache = dict()
+
+    def __call__(self, record):
+        order = tuple(record)
+        entry = self.key_cache.get(order)
+        if entry is None:
+            keys = tuple(sorted(order))
+            getter = itemgetter(*keys) if len(keys) > 1 else (lambda r, k=keys[0]: (r[k],))
+            entry = self.key_cache[order] = (keys, getter)
+        keys, getter = entry
+        values = getter(record)
+        for value in values:
+            if type(value) is dict or (type(value) is list and value and type(value[0]) is dict):
+                values = [_canonical(v) for v in values]
+                break
+        return hashlib.blake2b(marshal.dumps((keys, values), 2), digest_size=16).digest()
+
+
+def _field_digests(record):
+    return {k: _digest(v) for k, v in record.items() if k != 'id'}
+
+
+def _iter_sections(source, sections):
+    # Yields (key, record) section by section. ijson.items builds the records
+    # in C, several times faster than from parse events (iter_records).
+    if isinstance(source, dict) or merge_coco.ijson is None:
+        yield from iter_records(source, sections)
+        return
+    for key in sections:
+        if key in SMALL_SECTIONS:
+            with open(source, 'rb') as f:
+                for records in merge_coco.ijson.items(f, key, use_float=True):
+                    for record in records or []:
+                        yield key, record
+                    break
+        else:
+            for record in iter_section(source, key):
+                yield key, record
+
+
+def _change(old, new_fields, new_details, detail_fields):
+    # Field level description of a changed record
+    old_fields = _field_digests(old)
+    fields = sorted(k for k in set(old_fields) | set(new_fields) if old_fields.get(k) != new_fields.get(k))
+    change = dict()
+    for field in fields:
+        if field not in detail_fields:
+            change[field] = None
+            continue
+        entry = {'old': old.get(field), 'new': new_details[detail_fields.index(field)]}
+        if field == 'bbox' and isinstance(entry['old'], list) and isinstance(entry['new'], list) \
+                and len(entry['old']) == len(entry['new']):
+            entry['delta'] = [round(b - a, 6) for a, b in zip(entry['old'], entry['new'])]
+        change[field] = entry
+    return change
+
+
+@timed()
+def diff_coco(source_a, source_b, sections=SECTIONS):
+    """
+    Compares two COCO annotation files or loaded datasets.
+
+    Returns:
+    report - Dictionary section -> diff with the lists added and removed
+             (ids) and changed ({id, fields}) and the number of unchanged
+             records.
+    """
+    hasher = _RecordHasher()
+
+    digests = {key: dict() for key in sections}
+    for key, record in _iter_sections(source_a, sections):
+        digests[key][record['id']] = hasher(record)
+
+    # Records of source_b with another digest keep their field digests and
+    # detail values, in the order of source_b
+    report = {key: {'added': [], 'removed': [], 'changed': [], 'unchanged': 0} for key in sections}
+    changed = {key: dict() for key in sections}
+    for key, record in _iter_sections(source_b, sections):
+        old = digests[key].pop(record['id'], None)
+        if old is None:
+            report[key]['added'].append(record['id'])
+        elif old == hasher(record):
+            report[key]['unchanged'] += 1
+        else:
+            changed[key][record['id']] = (_field_digests(record),
+                                          tuple(record.get(k) for k in DETAIL_FIELDS.get(key, ())))
+
+    for key in sections:
+        report[key]['removed'] = list(digests[key])
+    del digests
+
+    # Second pass over the sections of source_a with changed records
+    changed_sections = tuple(key for key in sections if changed[key])
+    if changed_sections:
+        for key, record in _iter_sections(source_a, changed_sections):
+            new = changed[key].get(record['id'])
+            if isinstance(new, tuple):
+                changed[key][record['id']] = {'id': record['id'], 'fields': _change(
+                    record, new[0], new[1], DETAIL_FIELDS.get(key, ()))}
+    for key in changed_sections:
+        report[key]['changed'] = list(changed[key].values())
+
+    return report
+
+
+def num_differences(report):
+    return sum(len(d['added']) + len(d['removed']) + len(d['changed']) for d in report.values())
+
+
+def category_changes(report):
+    """
+    Counts the category changes of annotations as (old, new) -> count.
+    """
+    counts = dict()
+    for change in report.get('annotations', {}).get('changed', []):
+        entry = change['fields'].get('category_id')
+        if entry is not None:
+            pair = (entry['old'], entry['new'])
+            counts[pair] = counts.get(pair, 0) + 1
+    return counts
+
+
+def print_diff(report, limit=10):
+    """
+    Prints a summary of a report with up to limit examples per list.
+    """
+    for key, diff in report.items():
+        print("{}: {} added, {} removed, {} changed, {} unchanged".format(
+            key, len(diff['added']), len(diff['removed']), len(diff['changed']), diff['unchanged']))
+        for name in ('added', 'removed'):
+            if diff[name]:
+                print("  {}: {}".format(name, diff[name][:limit]))
+        for change in diff['changed'][:limit]:
+            fields = ", ".join(
+                field if entry is None else
+                "{} {} -> {}".format(field, entry['old'], entry['new']) if 'delta' not in entry else
+                "bbox delta {}".format(entry['delta'])
+                for field, entry in change['fields'].items())
+            print("  changed {}: {}".format(change['id'], fields))
+
+    for (old, new), count in sorted(category_changes(report).items(), key=lambda x: -x[1]):
+        print("category {} -> {}: {}".format(old, new, count))
+
+
+if __name__ == "__main__":
+    # Changes of COCO Refined against the original train2017
+    report = diff_coco("../annotations/instances_train2017.json", "../annotations/instances_train2017refined.json")
+    print_diff(report)
@@ -0,0 +1,141 @@
+# ========================================================================= #
+# Reads image dimensions from the JPEG/PNG file header without decoding     #
+# the image.                                                                #
+#                                                                           #
+# Sizes of whole folders are probed on a thread pool and can be cached in   #
+# a .json file keyed by path and modification time, so that repeated runs  #
+# only touch new or changed files.                                          #
+# ========================================================================= #
+
+import os
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# JPEG start of frame markers which carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    # Walks the JPEG markers up to the first start of frame segment
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            raise ValueError("No start of frame marker found.")
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def get_image_size(path):
+    """
+    Returns the size of a JPEG or PNG image by reading its header only.
+
+    Inputs:
+    path            - Path to the image file.
+
+    Returns:
+    (width, height) - Image size in pixels.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(24)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return width, height
+        if head[:2] == b'\xff\xd8':
+            return _jpeg_size(f)
+    raise ValueError("{} is not a JPEG or PNG image.".format(path))
+
+
+def load_size_cache(cache_file):
+    # Loads the size cache, {path: [mtime_ns, width, height]}
+    if cache_file is None or not os.path.isfile(cache_file):
+        return dict()
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+
+def save_size_cache(cache, cache_file):
+    # Saves the size cache
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+
+
+def probe_images(paths, num_workers=8, cache_file=None):
+    """
+    Probes the sizes of the given images in parallel.
+    Entries in cache_file are reused if the modification time of the
+    file did not change. Files which cannot be read are skipped.
+
+    Inputs:
+    paths       - List of image paths.
+    num_workers - Number of threads.
+    cache_file  - Optional .json file to cache the sizes in.
+
+    Returns:
+    sizes       - Dictionary path -> (width, height).
+    """
+    cache = load_size_cache(cache_file)
+
+    def probe(path):
+        key = os.path.abspath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entry = cache.get(key)
+            if entry is not None and entry[0] == mtime:
+                return path, key, mtime, (entry[1], entry[2]), False
+            return path, key, mtime, get_image_size(path), True
+        except (OSError, ValueError, struct.error) as e:
+            return path, key, None, e, False
+
+    sizes = dict()
+    failed = []
+    changed = False
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for path, key, mtime, size, new in executor.map(probe, paths):
+            if mtime is None:
+                failed.append((path, str(size)))
+                continue
+            sizes[path] = size
+            if new:
+                cache[key] = [mtime, size[0], size[1]]
+                changed = True
+
+    if failed:
+        print("Unable to read the size of {} images, e.g. {}".format(len(failed), failed[:5]))
+    if cache_file is not None and changed:
+        save_size_cache(cache, cache_file)
+
+    return sizes
+
+
+def probe_directory(img_dir, num_workers=8, cache_file=None):
+    """
+    Probes the sizes of all images in a folder. A missing folder gives no
+    sizes, so callers fall back to their default sizes.
+
+    Returns:
+    sizes - Dictionary filename -> (width, height).
+    """
+    if not os.path.isdir(img_dir):
+        print("Image folder {} not found, using the default image sizes.".format(img_dir))
+        return dict()
+    with os.scandir(img_dir) as entries:
+        paths = [entry.path for entry in entries
+                 if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+    sizes = probe_images(paths, num_workers, cache_file)
+    print("Probed the size of {} images in {}.".format(len(sizes), img_dir))
+
+    return {os.path.basename(path): size for path, size in sizes.items()}
@@ -0,0 +1,183 @@
+# ========================================================================= #
+# Lightweight timing and memory instrumentation for the dataset tools.      #
+#                                                                           #
+# Wrap a stage with `with stage("name"):` or decorate a function with       #
+# `@timed()`. When enabled, every stage records wall time, CPU time, peak   #
+# RSS and the tracemalloc delta and peak. The records are written to a      #
+# JSON trace and optionally to a Chrome trace file (chrome://tracing,       #
+# Perfetto) on exit.                                                        #
+#                                                                           #
+# Instrumentation is off by default and then costs one flag check per       #
+# stage. Enable it with enable() or the environment variable                #
+# COCOTRAFFIC_TRACE=<trace.json>.                                           #
+# ========================================================================= #
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_state = {
+    'enabled': False,
+    'trace_file': None,
+    'chrome_trace_file': None,
+    'records': [],
+    'registered': False,
+}
+_local = threading.local()
+_lock = threading.Lock()
+_NULL = nullcontext()
+
+
+def peak_rss():
+    # Peak resident set size of the process in bytes, None if unavailable
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def enable(trace_file="trace.json", chrome_trace_file=None, trace_memory=True):
+    """
+    Enables the instrumentation. Records are written to trace_file, and to
+    chrome_trace_file if given, when the program exits.
+    trace_memory starts tracemalloc, which slows down allocations.
+    """
+    _state['enabled'] = True
+    _state['trace_file'] = trace_file
+    _state['chrome_trace_file'] = chrome_trace_file
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if not _state['registered']:
+        atexit.register(write_trace)
+        _state['registered'] = True
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def records():
+    # Returns the recorded stages
+    return list(_state['records'])
+
+
+@contextmanager
+def _stage(name, args):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    entry = {'peak': 0}
+    stack.append(entry)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_ts = time.time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        stack.pop()
+
+        record = {
+            'name': name,
+            'start': start_ts,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_rss_bytes': peak_rss(),
+            'thread': threading.get_ident(),
+            'depth': len(stack),
+        }
+        if tracing and tracemalloc.is_tracing():
+            current_after, peak_after = tracemalloc.get_traced_memory()
+            peak_after = max(peak_after, entry['peak'])
+            record['tracemalloc_delta_bytes'] = current_after - current
+            record['tracemalloc_peak_bytes'] = peak_after - current
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak_after)
+        if args:
+            record['args'] = args
+
+        with _lock:
+            _state['records'].append(record)
+
+
+def stage(name, **args):
+    """
+    Context manager which records the enclosed block as stage name.
+    Keyword arguments are stored with the record.
+    """
+    if not _state['enabled']:
+        return _NULL
+    return _stage(name, args)
+
+
+def timed(name=None):
+    """
+    Decorator which records each call of a function as a stage.
+    The stage name defaults to the qualified function name.
+    """
+    def decorator(fn):
+        stage_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return fn(*args, **kwargs)
+            with _stage(stage_name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_trace():
+    """
+    Writes the records to the trace files.
+    """
+    if not _state['enabled'] or not _state['records']:
+        return
+
+    with _lock:
+        recs = list(_state['records'])
+
+    if _state['trace_file'] is not None:
+        with open(_state['trace_file'], 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'argv': sys.argv, 'stages': recs}, f, indent=1)
+        print("Wrote {} stage records to {}.".format(len(recs), _state['trace_file']))
+
+    if _state['chrome_trace_file'] is not None:
+        t0 = min(r['start'] for r in recs)
+        events = [{
+            'name': r['name'],
+            'ph': 'X',
+            'ts': (r['start'] - t0) * 1e6,
+            'dur': r['wall_s'] * 1e6,
+            'pid': os.getpid(),
+            'tid': r['thread'],
+            'args': {k: v for k, v in r.items() if k not in ('name', 'start', 'thread')}
+        } for r in recs]
+        with open(_state['chrome_trace_file'], 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events}, f)
+        print("Wrote Chrome trace to {}.".format(_state['chrome_trace_file']))
+
+
+if os.environ.get('COCOTRAFFIC_TRACE'):
+    enable(os.environ['COCOTRAFFIC_TRACE'], os.environ.get('COCOTRAFFIC_CHROME_TRACE'))
@@ -23,8 +23,11 @@ import json
 import random
 from shutil import copyfile
 from collections import defaultdict
+from merge_coco import merge_coco
+from instrument import timed, stage
 
 
+@timed()
 def load_anns(path, filename): 
     # Loads an annotation file
     f = open(path+filename)
@@ -32,9 +35,9 @@ def load_anns(path, filename):
 
     return anns
 
-def save_dataset(dataset, filename):
+@timed()
+def save_dataset(dataset, filename, path="../annotations/"):
     # Saves an annotation file
-    path = "../annotations/"
     with open(path+filename, 'w', encoding='utf-8') as f:
         json.dump(dataset, f, indent=0)
     print("Saved dataset to disk as {}!".format(filename))
@@ -44,59 +47,25 @@ def get_diff(l1, l2):
     diff = list( list(set(l1) - set(l2)) + list(set(l2) - set(l1)) )
     return diff
 
-def filter_classes(dataset):
+@timed()
+def filter_classes(dataset, subset="traffic_lights"):
     """
-    Filters classes from the dataset based on class_names.
+    Filters classes from the dataset based on a class subset.
     Inputs:
     dataset - COCO annotation file object
+    subset  - Subset name or spec, see class_subsets.SUBSETS.
 
     Returns:
     dataset - COCO annotation file objecct with specified classes only.
     """
-    class_names = ['traffic light', 'car', 'truck', 'bus', 'motorcycle', 
-                    'bicycle', 'person', 'dog', 'cat', 'stop sign', 
-                    'fire hydrant', 'train', 'traffic_light_red', 
-                    'traffic_light_green', 'traffic_light_na']
-    class_names = ['traffic light', 'traffic_light_red', 
-                    'traffic_light_green', 'traffic_light_na']
-    
-    # Get category ids
-    keep = []
-    for cat in dataset['categories']:
-        if cat['name'] in class_names:
-            keep.append(int(cat['id']))
-    assert(len(keep) == len(class_names))
-  
-    # Map img_ids to image objects
-    images_table = {x['id']:x for x in dataset['images']}
-
-    # Map img_ids to annotation objects
-    img_id_table = defaultdict(list)
-
-    for ann in dataset['annotations']:
-        if ann['category_id'] in keep:
-            img_id_table[ann['image_id']].append(ann)
-    
-    print("Removed {} / {} images by category.".format(len(dataset['images']) - len(img_id_table.keys()), len(dataset['images']) ))
-
-    imgs_out = []
-    imgs_ids_out = []
-    anns_out = []
-
-    for img_id in img_id_table:
-        imgs_ids_out.append(int(img_id))
-        anns_out += img_id_table[img_id]
-
-    for img_id in imgs_ids_out:
-        imgs_out.append(images_table[img_id])
-
-    dataset['images'] = imgs_out
-    dataset['annotations'] = anns_out
+    # Imported here so that loading this module does not need NumPy
+    from class_subsets import derive_subset
+    dataset_out = derive_subset(dataset, subset, keep_categories=True)
 
     # Check output
-    assert(len(dataset['images']) == len(set(ann['image_id'] for ann in dataset['annotations'])))
+    assert(len(dataset_out['images']) == len(set(ann['image_id'] for ann in dataset_out['annotations'])))
 
-    return dataset
+    return dataset_out
 
 def copy_image_files(img_ids, foldername):
     """
@@ -124,6 +93,7 @@ def copy_image_files(img_ids, foldername):
 
     print('Copied {} images to {}'.format(count, path+foldername))
 
+@timed()
 def make_base_dataset(anns_train1, anns_train2, anns_val):
     """
     Returns all labelled traffic light annotations from the three annotation files.
@@ -171,6 +141,7 @@ def make_base_dataset(anns_train1, anns_train2, anns_val):
 
     return anns
 
+@timed()
 def make_coco_refined(dataset_in, dataset_relabelled):
     """
     Replaces traffic light annotations with the relabelled ones.
@@ -216,6 +187,7 @@ def make_coco_refined(dataset_in, dataset_relabelled):
     
     return dataset
 
+@timed()
 def make_coco_traffic(dataset_train, dataset_val, dataset_add):
     """
     Takes the new datast dataset_add, splits it into train/val 80/20
@@ -270,19 +242,15 @@ def make_coco_traffic(dataset_train, dataset_val, dataset_add):
 
     return dataset_train, dataset_val, imgs_train, imgs_val
     
-def make_coco_traffic_extended(dataset_in, dataset_append):
+@timed()
+def make_coco_traffic_extended(dataset_in, dataset_append, remap="keep"):
     """
-    Appends the traffic light annotations from val2017 to dataset_in.
+    Appends the annotations of dataset_append, e.g. LISA, to dataset_in.
+    Licenses are united by content and categories by name. Image and
+    annotation ids are kept and checked for collisions unless remap is
+    "dense" or "namespace" (see merge_coco.iter_merged).
     """
-    keys = ['info', 'licenses', 'images', 'annotations', 'categories']
-    dataset_out = dict.fromkeys(keys)
-
-    dataset_out['info'] = dataset_in['info']
-    dataset_out['licenses'] = dataset_in['licenses'] + dataset_append['licenses']
-    assert(len(dataset_out['licenses']) == 9)
-    dataset_out['categories'] = dataset_in['categories']
-    dataset_out['images'] = dataset_in['images'] + dataset_append['images']
-    dataset_out['annotations'] = dataset_in['annotations'] + dataset_append['annotations']
+    dataset_out = merge_coco([dataset_in, dataset_append], remap=remap)
 
     assert(len(dataset_out['images']) == (len(dataset_in['images']) + len(dataset_append['images'])))
     assert(len(dataset_out['annotations']) == (len(dataset_in['annotations']) + len(dataset_append['annotations'])))
@@ -339,41 +307,76 @@ def print_stats(dataset):
     print(anns_per_class)     
 
 
-if __name__ == "__main__":
+def fill_missing_area(dataset, name):
+    """
+    Sets the area of annotations without a numeric area to their box area.
+    LISA files written before the area was computed have area ''.
+    """
+    count = 0
+    for ann in dataset['annotations']:
+        area = ann.get('area')
+        if isinstance(area, bool) or not isinstance(area, (int, float)):
+            ann['area'] = ann['bbox'][2] * ann['bbox'][3]
+            count += 1
+    if count > 0:
+        print("{}: set the missing area of {} annotations from their boxes. "
+              "Regenerate the file with 'cocotraffic.py lisa-import --save' to fix it on disk.".format(name, count))
+    return count
+
+
+def build_datasets(ann_dir="../annotations/", save=False, validate=True, num_workers=None):
+    """
+    Builds the datasets 0 - 3 from the annotation files in ann_dir.
+    Saves them to ann_dir if save=True. With validate=True each dataset is
+    checked before it is saved and errors raise a ValueError.
+    The input files are loaded concurrently in num_workers processes.
+    """
+    # Imported here so that loading this module does not need NumPy
+    from validate import check_dataset
+    from parallel_load import load_many
+
+    # Load all input files at once. Stage 2 reads the stage 0 files again,
+    # it gets shallow copies since make_coco_traffic replaces their lists.
+    path_traffic = ann_dir + "21_coco_sub_all_traffic/"
+    path_lisa = ann_dir + "30_lisa_sub/"
+    input_files = [
+        path_traffic + "instances_trainTraffic.json",
+        path_traffic + "instances_valTraffic.json",
+        path_traffic + "instances_val2017Relabelled.json",
+        ann_dir + "instances_train2017.json",
+        ann_dir + "instances_val2017.json",
+        path_lisa + "instances_trainTrafficLISA.json",
+        path_lisa + "instances_valTrafficLISA.json"]
+    with stage("load_anns", files=len(input_files)):
+        (anns_train1, anns_train2, anns_val_relabelled, anns_train2017, anns_val2017,
+            train_append, val_append) = load_many(input_files, num_workers)
+    fill_missing_area(train_append, "instances_trainTrafficLISA.json")
+    fill_missing_area(val_append, "instances_valTrafficLISA.json")
+
     # 0. Dataset: COCO Traffic Lights
-    path = "../annotations/21_coco_sub_all_traffic/"
-    file_train1 = "instances_trainTraffic.json"
-    file_train2 = "instances_valTraffic.json"
-    file_val = "instances_val2017Relabelled.json"
-    anns_train1 = load_anns(path, file_train1)
-    anns_train2 = load_anns(path, file_train2)
-    anns_val = load_anns(path, file_val)
-    dataset1 = make_base_dataset(anns_train1, anns_train2, anns_val)
-    #save_dataset(dataset1, "instances_traffic_lights.json")
+    dataset1 = make_base_dataset(anns_train1, anns_train2, anns_val_relabelled)
+    if validate:
+        check_dataset(dataset1, "traffic_lights")
+    if save:
+        save_dataset(dataset1, "instances_traffic_lights.json", path=ann_dir)
 
     # 1. Dataset: COCO Refined
     print("----------\nDataset 1")
-    path = "../annotations/"
     anns_relabelled = dataset1
-    file_train = "instances_train2017.json"
-    file_val = "instances_val2017.json"
-    anns_train = load_anns(path, file_train)
-    anns_val = load_anns(path, file_val)
-    dataset2train = make_coco_refined(anns_train, anns_relabelled)
-    dataset2val = make_coco_refined(anns_val, anns_relabelled)
-    #save_dataset(dataset2train, "instances_train2017refined.json")
-    #save_dataset(dataset2val, "instances_val2017refined.json")
+    dataset2train = make_coco_refined(anns_train2017, anns_relabelled)
+    dataset2val = make_coco_refined(anns_val2017, anns_relabelled)
+    if validate:
+        check_dataset(dataset2train, "train2017refined")
+        check_dataset(dataset2val, "val2017refined")
+    if save:
+        save_dataset(dataset2train, "instances_train2017refined.json", path=ann_dir)
+        save_dataset(dataset2val, "instances_val2017refined.json", path=ann_dir)
 
     # 2. Dataset: COCO Traffic
     print("----------\nDataset 2")
-    path = "../annotations/21_coco_sub_all_traffic/"
-    file_train = "instances_trainTraffic.json"
-    file_val = "instances_valTraffic.json"
-    anns_train = load_anns(path, file_train)
-    anns_val = load_anns(path, file_val)
-    path_add = "../annotations/21_coco_sub_all_traffic/"
-    file_val_add = "instances_val2017Relabelled.json"
-    anns_add = load_anns(path_add, file_val_add)
+    anns_train = dict(anns_train1)
+    anns_val = dict(anns_train2)
+    anns_add = dict(anns_val_relabelled)
     print(len(anns_add['annotations']))
     anns_add = filter_classes(anns_add)
     print(len(anns_add['annotations']))
@@ -382,28 +385,35 @@ if __name__ == "__main__":
     print_stats(anns_add)
     train_out, val_out, imgs_train, imgs_val = make_coco_traffic(anns_train, anns_val, anns_add)
     dataset_train, dataset_val = make_new_images(anns_add, imgs_train, imgs_val)
-    #save_dataset(dataset_train, "instances_train_new_images.json")
-    #save_dataset(dataset_val, "instances_val_new_images.json")
+    if save:
+        save_dataset(dataset_train, "instances_train_new_images.json", path=ann_dir)
+        save_dataset(dataset_val, "instances_val_new_images.json", path=ann_dir)
 
     print("\n############## Modified dataset 2 ##############")
     print_stats(train_out)
     print_stats(val_out)
-    #save_dataset(train_out, "instances_train_traffic.json")
-    #save_dataset(val_out, "instances_val_traffic.json")
+    if validate:
+        check_dataset(train_out, "train_traffic")
+        check_dataset(val_out, "val_traffic")
+    if save:
+        save_dataset(train_out, "instances_train_traffic.json", path=ann_dir)
+        save_dataset(val_out, "instances_val_traffic.json", path=ann_dir)
     #copy_image_files(imgs_train, "trainTraffic")
     #copy_image_files(imgs_val, "valTraffic")
 
     # 3. Dataset: COCO Traffic Extended
     print("----------\nDataset 3")
-    path = "../annotations/30_lisa_sub/"
-    file_train = "instances_trainTrafficLISA.json"
-    file_val = "instances_valTrafficLISA.json"
-    train_append = load_anns(path, file_train)
-    val_append = load_anns(path, file_val)
     dataset_train = make_coco_traffic_extended(train_out, train_append)
     dataset_val = make_coco_traffic_extended(val_out, val_append)
     print_stats(dataset_train)
     print_stats(dataset_val)
-    #save_dataset(dataset_train, "instances_train_traffic_extended.json")
-    #save_dataset(dataset_val, "instances_val_traffic_extended.json")
-    
\ No newline at end of file
+    if validate:
+        check_dataset(dataset_train, "train_traffic_extended")
+        check_dataset(dataset_val, "val_traffic_extended")
+    if save:
+        save_dataset(dataset_train, "instances_train_traffic_extended.json", path=ann_dir)
+        save_dataset(dataset_val, "instances_val_traffic_extended.json", path=ann_dir)
+
+
+if __name__ == "__main__":
+    build_datasets()
@@ -0,0 +1,289 @@
+# ========================================================================= #
+# Builds a cache of letterboxed images for yolov5 training.                 #
+#                                                                           #
+# Every image of a dataset split is resized to fit target x target pixels,  #
+# padded to a square, JPEG-encoded and appended to one of a few large       #
+# shard files. An index .json holds the shard, offset and length of each    #
+# image together with its yolo labels, adjusted to the letterboxed image.   #
+#                                                                           #
+# Images are processed in a process pool. A rerun only processes images     #
+# whose source file changed, their new versions go into a new shard. The    #
+# labels of all images are rebuilt from the annotations on every run, and   #
+# images no longer in the split are dropped from the index. Shards whose    #
+# unreferenced bytes exceed max_dead_fraction are copied into new shards.   #
+# ========================================================================= #
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+
+import numpy as np
+import cv2 as cv
+
+from make_yolo_labels import COCO_TO_YOLO, box_coco_to_yolo
+from instrument import timed
+
+PAD_VALUE = 114  # Gray padding as used by yolov5
+
+
+def letterbox(image, target):
+    """
+    Resizes an image to fit into target x target and pads it to a square.
+
+    Returns:
+    image - Letterboxed image.
+    ratio - Scale factor applied to the image.
+    pad   - (left, top) padding in pixels.
+    """
+    h, w = image.shape[:2]
+    ratio = target / max(h, w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    if (new_w, new_h) != (w, h):
+        interpolation = cv.INTER_AREA if ratio < 1 else cv.INTER_LINEAR
+        image = cv.resize(image, (new_w, new_h), interpolation=interpolation)
+    left, top = (target - new_w) // 2, (target - new_h) // 2
+    image = cv.copyMakeBorder(image, top, target - new_h - top, left, target - new_w - left,
+                              cv.BORDER_CONSTANT, value=(PAD_VALUE, PAD_VALUE, PAD_VALUE))
+    return image, ratio, (left, top)
+
+
+def letterbox_boxes(boxes, width, height, ratio, pad, target):
+    """
+    Maps normalized yolo boxes (cx, cy, w, h) of a width x height image to
+    the letterboxed target x target image.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    out = np.empty_like(boxes)
+    out[:, 0] = (boxes[:, 0] * width * ratio + pad[0]) / target
+    out[:, 1] = (boxes[:, 1] * height * ratio + pad[1]) / target
+    out[:, 2] = boxes[:, 2] * width * ratio / target
+    out[:, 3] = boxes[:, 3] * height * ratio / target
+    return out
+
+
+def _process_image(args):
+    # Worker: decodes, letterboxes and encodes one image
+    path, target, quality = args
+    image = cv.imread(path)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    image, ratio, pad = letterbox(image, target)
+    ok, data = cv.imencode('.jpg', image, [cv.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None
+    return data.tobytes(), width, height, ratio, pad
+
+
+def _load_index(index_file, target):
+    if os.path.isfile(index_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index.get('target') == target:
+            return index
+        print("Target size changed, rebuilding all shards.")
+    return {'target': target, 'shards': [], 'images': {}}
+
+
+def _new_shard(index, out_dir):
+    # Opens the next shard file and adds it to the index
+    number = max([int(name[6:-4]) for name in index['shards']], default=-1) + 1
+    name = "shard_{:05d}.bin".format(number)
+    index['shards'].append(name)
+    return name, open(os.path.join(out_dir, name), 'wb')
+
+
+def _make_labels(anns, entry, target):
+    # Yolo labels of the annotations, adjusted to the letterboxed image
+    size = {'width': entry['width'], 'height': entry['height']}
+    boxes = letterbox_boxes([box_coco_to_yolo(ann['bbox'], size) for ann in anns],
+                            entry['width'], entry['height'], entry['ratio'], entry['pad'], target)
+    return [[int(COCO_TO_YOLO[str(ann['category_id'])])] + box.tolist() for ann, box in zip(anns, boxes)]
+
+
+def _compact(index, out_dir, max_shard_bytes, max_dead_fraction):
+    # Copies the images of shards with too many unreferenced bytes into new
+    # shards. Returns the replaced shards, to be deleted once the index is saved.
+    live = defaultdict(list)
+    for entry in index['images'].values():
+        live[entry['shard']].append(entry)
+
+    stale = []
+    for name in index['shards']:
+        path = os.path.join(out_dir, name)
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        dead = size - sum(entry['length'] for entry in live[name])
+        if not live[name] or dead > max_dead_fraction * size:
+            stale.append(name)
+    if not stale:
+        return stale
+
+    moved = 0
+    shard = None
+    for name in stale:
+        entries = sorted(live[name], key=lambda entry: entry['offset'])
+        if not entries:
+            continue
+        with open(os.path.join(out_dir, name), 'rb') as src:
+            for entry in entries:
+                if shard is None or shard.tell() >= max_shard_bytes:
+                    if shard is not None:
+                        shard.close()
+                    shard_name, shard = _new_shard(index, out_dir)
+                src.seek(entry['offset'])
+                data = src.read(entry['length'])
+                entry['shard'] = shard_name
+                entry['offset'] = shard.tell()
+                shard.write(data)
+                moved += 1
+    if shard is not None:
+        shard.close()
+
+    index['shards'] = [name for name in index['shards'] if name not in stale]
+    print("Compacted {} shards, moved {} images.".format(len(stale), moved))
+    return stale
+
+
+@timed()
+def make_image_shards(ann_file, img_dirs, out_dir, target=640, quality=95,
+                      max_shard_bytes=1 << 30, num_workers=None, max_dead_fraction=0.5):
+    """
+    Letterboxes all images of a split and packs them into shards.
+
+    Inputs:
+    ann_file          - COCO annotation file of the split.
+    img_dirs          - Image folder or list of folders, searched in order.
+    out_dir           - Output folder for the shards and index.json.
+    target            - Side length of the letterboxed images.
+    quality           - JPEG quality.
+    max_shard_bytes   - Shards are closed once they exceed this size.
+    num_workers       - Number of processes, defaults to the number of CPUs.
+    max_dead_fraction - Shards with a larger fraction of replaced or removed
+                        images are rewritten.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    index_file = os.path.join(out_dir, 'index.json')
+    index = _load_index(index_file, target)
+    img_dirs = [img_dirs] if isinstance(img_dirs, str) else list(img_dirs)
+
+    with open(ann_file, 'r') as f:
+        dataset = json.load(f)
+    anns_per_image = defaultdict(list)
+    for ann in dataset['annotations']:
+        if str(ann['category_id']) in COCO_TO_YOLO:
+            anns_per_image[ann['image_id']].append(ann)
+
+    # Find sources and skip images which are up to date
+    found = []
+    jobs = []
+    for img in dataset['images']:
+        path = next((os.path.join(d, img['file_name']) for d in img_dirs
+                     if os.path.isfile(os.path.join(d, img['file_name']))), None)
+        if path is None:
+            continue
+        found.append(img)
+        stat = os.stat(path)
+        entry = index['images'].get(img['file_name'])
+        if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['bytes'] == stat.st_size \
+                and 'ratio' in entry:
+            continue
+        jobs.append((img, path, stat))
+    print("{} images up to date, {} to process, {} not found.".format(
+        len(found) - len(jobs), len(jobs), len(dataset['images']) - len(found)))
+
+    # Drop images which are no longer in the split or not found
+    in_split = set(img['file_name'] for img in found)
+    removed = [name for name in index['images'] if name not in in_split]
+    for name in removed:
+        del index['images'][name]
+
+    shard = None
+    shard_name = None
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(_process_image, [(path, target, quality) for _, path, _ in jobs], chunksize=16)
+        for (img, path, stat), result in zip(jobs, results):
+            if result is None:
+                print("Unable to read {}.".format(path))
+                index['images'].pop(img['file_name'], None)
+                continue
+            data, width, height, ratio, pad = result
+
+            if shard is None or shard.tell() >= max_shard_bytes:
+                if shard is not None:
+                    shard.close()
+                shard_name, shard = _new_shard(index, out_dir)
+
+            index['images'][img['file_name']] = {
+                'shard': shard_name,
+                'offset': shard.tell(),
+                'length': len(data),
+                'mtime': stat.st_mtime_ns,
+                'bytes': stat.st_size,
+                'width': width,
+                'height': height,
+                'ratio': ratio,
+                'pad': list(pad),
+            }
+            shard.write(data)
+    if shard is not None:
+        shard.close()
+
+    # Labels follow the current annotations, without touching the images
+    relabelled = 0
+    for img in found:
+        entry = index['images'].get(img['file_name'])
+        if entry is None:
+            continue
+        labels = _make_labels(anns_per_image[img['id']], entry, target)
+        if 'labels' in entry and entry['labels'] != labels:
+            relabelled += 1
+        entry['labels'] = labels
+    print("Updated the labels of {} images, removed {} images.".format(relabelled, len(removed)))
+
+    stale = _compact(index, out_dir, max_shard_bytes, max_dead_fraction)
+
+    with open(index_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(index_file + '.tmp', index_file)
+    for name in stale:
+        path = os.path.join(out_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    print("Indexed {} images in {} shards in {}.".format(len(index['images']), len(index['shards']), out_dir))
+
+
+class ImageShards:
+    """
+    Reads letterboxed images and their labels from a shard cache.
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, 'index.json'), 'r') as f:
+            self.index = json.load(f)
+        self.file_names = sorted(self.index['images'])
+        self._files = dict()
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def get(self, file_name):
+        """
+        Returns the letterboxed BGR image and its labels as (n, 5) array of
+        class, cx, cy, w, h.
+        """
+        entry = self.index['images'][file_name]
+        f = self._files.get(entry['shard'])
+        if f is None:
+            f = self._files[entry['shard']] = open(os.path.join(self.out_dir, entry['shard']), 'rb')
+        f.seek(entry['offset'])
+        data = np.frombuffer(f.read(entry['length']), dtype=np.uint8)
+        labels = np.array(entry['labels'], dtype=np.float32).reshape(-1, 5)
+        return cv.imdecode(data, cv.IMREAD_COLOR), labels
+
+
+if __name__ == "__main__":
+    for split in ("train", "val"):
+        make_image_shards("../annotations/instances_{}_traffic_extended.json".format(split),
+                          ["../images/{}2017/".format(split), "../images/{}TrafficLISA/".format(split)],
+                          "../images/shards_{}_traffic_extended_640/".format(split))
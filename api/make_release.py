@@ -0,0 +1,249 @@
+# ========================================================================= #
+# Packages the datasets for release.                                        #
+#                                                                           #
+# 01_coco_refined, 02_coco_traffic and 03_coco_traffic_extended contain     #
+# their train and val annotation files, optionally with image folders.      #
+# Files are planned into zip shards of at most max_shard_bytes input, in    #
+# sorted order, so the plan is the same on every run. Shards are written    #
+# in parallel processes. JPEG and PNG files are stored as they are, other   #
+# files are deflated.                                                       #
+#                                                                           #
+# Each finished shard records its files with their SHA-256 in a part file   #
+# as soon as it is written. A rerun keeps shards whose part file matches    #
+# the plan, so an interrupted run resumes with the missing shards. Shards   #
+# and parts of an earlier plan are removed. The parts are combined into     #
+# <release>_manifest.json, which verify checks an unpacked release against. #
+# ========================================================================= #
+
+import os
+import re
+import json
+import hashlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from instrument import timed
+
+RELEASES = {
+    '01_coco_refined': ['instances_train2017refined.json', 'instances_val2017refined.json'],
+    '02_coco_traffic': ['instances_train_traffic.json', 'instances_val_traffic.json'],
+    '03_coco_traffic_extended': ['instances_train_traffic_extended.json', 'instances_val_traffic_extended.json'],
+}
+
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png')  # Already compressed
+_CHUNK = 1 << 20
+
+
+def _hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def collect_files(ann_files, ann_dir, img_dirs=()):
+    """
+    Returns the sorted list of (archive name, path, bytes, mtime) of a release.
+    Annotation files go to annotations/, images to images/<folder name>/.
+    """
+    entries = []
+    for filename in ann_files:
+        path = os.path.join(ann_dir, filename)
+        stat = os.stat(path)
+        entries.append(('annotations/' + filename, path, stat.st_size, stat.st_mtime_ns))
+    for img_dir in img_dirs:
+        folder = os.path.basename(os.path.normpath(img_dir))
+        with os.scandir(img_dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append(('images/{}/{}'.format(folder, entry.name), entry.path, stat.st_size, stat.st_mtime_ns))
+    entries.sort()
+    return entries
+
+
+def plan_shards(entries, max_shard_bytes):
+    """
+    Splits the entries into consecutive shards of at most max_shard_bytes.
+    A single larger file gets a shard of its own.
+    """
+    shards = [[]]
+    size = 0
+    for entry in entries:
+        if shards[-1] and size + entry[2] > max_shard_bytes:
+            shards.append([])
+            size = 0
+        shards[-1].append(entry)
+        size += entry[2]
+    return [s for s in shards if s]
+
+
+def _plan_key(entries):
+    # Identifies the content of a shard by names, sizes and modification times
+    return hashlib.sha256(json.dumps([[e[0], e[2], e[3]] for e in entries]).encode()).hexdigest()
+
+
+def _write_shard(shard_path, entries):
+    # Worker: writes one shard and returns its part of the manifest
+    files = []
+    with zipfile.ZipFile(shard_path + '.tmp', 'w', allowZip64=True) as zf:
+        for arcname, path, size, _ in entries:
+            stored = arcname.lower().endswith(STORED_EXTENSIONS)
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            sha = hashlib.sha256()
+            with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=size > 0x7fffffff) as dst:
+                for chunk in iter(lambda: src.read(_CHUNK), b''):
+                    sha.update(chunk)
+                    dst.write(chunk)
+            files.append({'path': arcname, 'bytes': size, 'sha256': sha.hexdigest()})
+    os.replace(shard_path + '.tmp', shard_path)
+    return {'file': os.path.basename(shard_path), 'bytes': os.path.getsize(shard_path),
+            'sha256': _hash_file(shard_path), 'files': files}
+
+
+def _remove_stale(name, out_dir, parts_dir, shard_names):
+    # Removes the shards and parts of the release which are not in the plan
+    pattern = re.compile(r'^{}(\.part\d+)?\.zip(\.tmp)?$'.format(re.escape(name)))
+    current = set(shard_names)
+    removed = 0
+    for folder, suffix in ((out_dir, ''), (parts_dir, '.json')):
+        for filename in os.listdir(folder):
+            shard_name = filename[:-len(suffix)] if suffix and filename.endswith(suffix) else filename
+            if pattern.match(shard_name) and not (shard_name in current and filename == shard_name + suffix):
+                os.remove(os.path.join(folder, filename))
+                removed += 1
+    if removed:
+        print("Removed {} shard and part files of an earlier plan.".format(removed))
+
+
+def _load_part(part_file, shard_path, key):
+    # Returns the part of a finished shard, None if it has to be written
+    if not os.path.isfile(part_file) or not os.path.isfile(shard_path):
+        return None
+    with open(part_file, 'r') as f:
+        part = json.load(f)
+    if part.get('plan') != key or part.get('bytes') != os.path.getsize(shard_path):
+        return None
+    return part
+
+
+@timed()
+def make_release(name, out_dir, ann_dir="../annotations/", ann_files=None, img_dirs=(),
+                 max_shard_bytes=2 << 30, num_workers=None):
+    """
+    Writes the shards and the manifest of a release.
+
+    Inputs:
+    name            - Release name, e.g. 02_coco_traffic.
+    out_dir         - Output folder.
+    ann_dir         - Folder of the annotation files.
+    ann_files       - Annotation files, defaults to RELEASES[name].
+    img_dirs        - Image folders to include.
+    max_shard_bytes - Input bytes per shard.
+    num_workers     - Number of processes writing shards.
+
+    Returns:
+    manifest_file   - Path of the manifest.
+    """
+    if ann_files is None:
+        ann_files = RELEASES[name]
+    os.makedirs(out_dir, exist_ok=True)
+    parts_dir = os.path.join(out_dir, '.{}_parts'.format(name))
+    os.makedirs(parts_dir, exist_ok=True)
+
+    shards = plan_shards(collect_files(ann_files, ann_dir, img_dirs), max_shard_bytes)
+    if len(shards) == 1:
+        shard_names = [name + '.zip']
+    else:
+        shard_names = ['{}.part{:03d}.zip'.format(name, i + 1) for i in range(len(shards))]
+
+    _remove_stale(name, out_dir, parts_dir, shard_names)
+
+    parts = [None] * len(shards)
+    todo = []
+    for i, (shard_name, entries) in enumerate(zip(shard_names, shards)):
+        key = _plan_key(entries)
+        parts[i] = _load_part(os.path.join(parts_dir, shard_name + '.json'), os.path.join(out_dir, shard_name), key)
+        if parts[i] is None:
+            todo.append((i, key))
+    print("{}: {} shards, {} done, {} to write.".format(name, len(shards), len(shards) - len(todo), len(todo)))
+
+    if todo:
+        failed = []
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(_write_shard, os.path.join(out_dir, shard_names[i]), shards[i]): (i, key)
+                       for i, key in todo}
+            # Each part is saved as soon as its shard is done, so a failure
+            # does not lose the shards which were finished
+            for future in as_completed(futures):
+                i, key = futures[future]
+                try:
+                    part = future.result()
+                except Exception as e:
+                    print("Failed to write {}: {}".format(shard_names[i], e))
+                    failed.append(e)
+                    continue
+                part['plan'] = key
+                part_file = os.path.join(parts_dir, shard_names[i] + '.json')
+                with open(part_file + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(part, f)
+                os.replace(part_file + '.tmp', part_file)
+                parts[i] = part
+                print("Wrote {} ({} files, {:.1f} MB).".format(part['file'], len(part['files']), part['bytes'] / 1e6))
+        if failed:
+            print("{} of {} shards failed, rerun to write them.".format(len(failed), len(todo)))
+            raise failed[0]
+
+    manifest = {
+        'release': name,
+        'shards': [{k: part[k] for k in ('file', 'bytes', 'sha256')} for part in parts],
+        'files': [dict(f, shard=part['file']) for part in parts for f in part['files']],
+    }
+    manifest_file = os.path.join(out_dir, name + '_manifest.json')
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    print("Wrote manifest {} with {} files.".format(manifest_file, len(manifest['files'])))
+    return manifest_file
+
+
+@timed()
+def verify_release(manifest_file, root, num_workers=8):
+    """
+    Checks an unpacked release in root against its manifest. Files are
+    hashed in parallel threads.
+
+    Returns:
+    missing, mismatched - Lists of paths.
+    """
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    def check(entry):
+        path = os.path.join(root, entry['path'])
+        if not os.path.isfile(path):
+            return 'missing'
+        if os.path.getsize(path) != entry['bytes'] or _hash_file(path) != entry['sha256']:
+            return 'mismatched'
+        return None
+
+    missing = []
+    mismatched = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for entry, result in zip(manifest['files'], executor.map(check, manifest['files'])):
+            if result == 'missing':
+                missing.append(entry['path'])
+            elif result == 'mismatched':
+                mismatched.append(entry['path'])
+
+    print("Verified {} files of {}: {} missing, {} mismatched.".format(
+        len(manifest['files']), manifest['release'], len(missing), len(mismatched)))
+    for path in (missing + mismatched)[:10]:
+        print("  {}".format(path))
+    return missing, mismatched
+
+
+if __name__ == "__main__":
+    for release in RELEASES:
+        make_release(release, "../release/")
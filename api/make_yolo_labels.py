@@ -7,15 +7,23 @@
 # Allows for any image id datatype, not only integers.                      #
 # ========================================================================= #
 
-import numpy as np
-import random
 import json
 import csv
-from shutil import copyfile
 import os
 from collections import defaultdict
+from image_meta import probe_directory
+from class_subsets import class_map
+from instrument import timed
+
+# Set category_id mapping
+# To accomodate our 15 classes, the category_ids are remapped before writing them to the labels for yolo.
+# Traffic_light has been replaced by the three new categories traffic_light_red (92), traffic_light_green (93), and traffic_light_na (94)
+# The mapping is the dense "yolo" subset in class_subsets.py.
+COCO_TO_YOLO = {str(k): str(v) for k, v in class_map('yolo').items()}
+
 
 class Dataset:
+    @timed()
     def __init__(self, path, filename):
         
         self.filename = filename
@@ -86,16 +94,29 @@ def box_coco_to_yolo(bbox_coco, img):
     return bbox_yolo
 
 
-def run(path, dataset_name):
-    # Set category_id mapping
-    # To accomodate our 15 classes, the category_ids are remapped before writing them to the labels for yolo.
-    # Traffic_light has been replaced by the three new categories traffic_light_red (92), traffic_light_green (93), and traffic_light_na (94)
-    coco_to_yolo = {'1':'0', '2':'1', '3':'2', '4':'3', '6':'4', '7':'5', '8':'6', '11': '7', '13':'8', '17':'9', '18':'10', '92':'11', '93':'12', '94':'13'}
-
+def run(path, dataset_name, img_dir=None, labels_dir='../labels/'):
+    """
+    Writes the yolo labels for the annotation file instances_<dataset_name>.json.
+    If img_dir is given, boxes are normalized with the image sizes read from
+    the file headers in img_dir instead of the sizes in the annotation file.
+    Labels are written to <labels_dir>/<dataset_name>/.
+    """
     # Initialize COCO api for instance annotations
     filename = "instances_" + dataset_name
     data = Dataset(path, filename)
     img_ids = data.get_image_ids()
+    img_sizes = dict()
+    if img_dir is not None:
+        img_sizes = probe_directory(img_dir, cache_file=os.path.join(img_dir, ".image_sizes.json"))
+
+    write_labels(data, img_ids, img_sizes, dataset_name, labels_dir)
+
+
+@timed()
+def write_labels(data, img_ids, img_sizes, dataset_name, labels_dir='../labels/'):
+    # Writes one label file per image. img_sizes overrides the image sizes
+    # of the annotation file, {file name: (width, height)}.
+    coco_to_yolo = COCO_TO_YOLO
 
     # One file with filename = image_id containg all annotations
     for img_id in img_ids:
@@ -117,11 +138,14 @@ def run(path, dataset_name):
 
         #img = coco.loadImgs(imgId)
         img = data.get_image(img_id)
+        if img['file_name'] in img_sizes:
+            width, height = img_sizes[img['file_name']]
+            img = dict(img, width=width, height=height)
 
         # For each annotation:
         for ann in anns:
-            
-            if str(ann['category_id']) != "10":
+        
+            if str(ann['category_id']) in coco_to_yolo:
                 categoryId.append(coco_to_yolo[str(ann['category_id'])])
 
                 bbox_yolo = box_coco_to_yolo(ann['bbox'], img)
@@ -131,15 +155,15 @@ def run(path, dataset_name):
                 boxW.append(bbox_yolo[3])
 
         assert(len(categoryId) == len(boxX) == len(boxY) == len(boxH) == len(boxW))
-        
+    
         # Write file
-        file_path = '../labels/' + dataset_name + '/'
+        file_path = labels_dir + dataset_name + '/'
         rows = zip(categoryId, boxX, boxY, boxH, boxW)
-        
+    
         with open(file_path+filename, "w") as f:
             writer = csv.writer(f, delimiter=" ")
             for row in rows:
-                writer.writerow(row)  
+                writer.writerow(row)
 
 if __name__=="__main__":
     path = "../annotations/"
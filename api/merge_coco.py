@@ -0,0 +1,339 @@
+# ========================================================================= #
+# Merges any number of COCO annotation files into one.                      #
+#                                                                           #
+# Licenses are united by content and categories by name, so the same       #
+# license or category in several inputs appears once in the output. Ids    #
+# are never invented for them: one id used for different records raises    #
+# an error. Image and annotation ids are either kept (collisions raise an   #
+# error), reassigned as dense integers or prefixed with a namespace per     #
+# input. Annotations without an image in their input are dropped.          #
+#                                                                           #
+# Each input file is parsed once. Its images and annotations are spooled    #
+# to temporary files while its licenses and categories are collected, and   #
+# are then streamed to the output. If ijson is installed the inputs are     #
+# parsed incrementally as well, otherwise at most one input file is held    #
+# in memory.                                                                #
+# ========================================================================= #
+
+import json
+import pickle
+import tempfile
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+REMAP_MODES = ("keep", "dense", "namespace")
+OBJECT_KEYS = ('info',)  # Top level keys holding one object instead of a list
+_NO_IMAGE = object()
+
+
+def iter_section(source, key):
+    """
+    Iterates over the records of one section, e.g. 'images', of a COCO
+    annotation file. source is either a path or an already loaded dataset.
+    """
+    if isinstance(source, dict):
+        yield from source.get(key) or []
+        return
+
+    if ijson is not None:
+        with open(source, 'rb') as f:
+            yield from ijson.items(f, key + '.item', use_float=True)
+        return
+
+    with open(source, 'r') as f:
+        records = json.load(f).get(key) or []
+    yield from records
+
+
+def iter_records(source, keys):
+    """
+    Iterates over (key, record) of several sections in one pass over the
+    file, in the order in which they appear in it. Keys in OBJECT_KEYS,
+    e.g. 'info', yield their object once instead of records.
+    """
+    if isinstance(source, dict):
+        for key in keys:
+            if key in OBJECT_KEYS:
+                if key in source:
+                    yield key, source[key]
+                continue
+            for record in source.get(key) or []:
+                yield key, record
+        return
+
+    if ijson is None:
+        with open(source, 'r') as f:
+            dataset = json.load(f)
+        yield from iter_records(dataset, keys)
+        return
+
+    prefixes = {(key if key in OBJECT_KEYS else key + '.item'): key for key in keys}
+    with open(source, 'rb') as f:
+        builder = None
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is None:
+                if prefix in prefixes:
+                    key = prefixes[prefix]
+                    if event in ('start_map', 'start_array'):
+                        builder = ijson.common.ObjectBuilder()
+                        builder.event(event, value)
+                        depth = 1
+                    elif event not in ('map_key', 'end_map', 'end_array'):
+                        yield key, value
+                continue
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if depth == 0:
+                    yield key, builder.value
+                    builder = None
+
+
+def load_info(source):
+    # Returns the info section of a source
+    if isinstance(source, dict):
+        return source.get('info')
+    if ijson is not None:
+        with open(source, 'rb') as f:
+            for info in ijson.items(f, 'info', use_float=True):
+                return info
+        return None
+    with open(source, 'r') as f:
+        return json.load(f).get('info')
+
+
+def _content_key(record):
+    # Identifies a license by everything but its id
+    return json.dumps({k: v for k, v in record.items() if k != 'id'}, sort_keys=True)
+
+
+def _match_key(key, record):
+    # Categories match by name, licenses by content
+    if key == 'categories' and 'name' in record:
+        return record['name']
+    return _content_key(record)
+
+
+def unite_records(record_lists, key):
+    """
+    Unites the licenses (by content) or categories (by name) of all sources.
+    A record matching an earlier one takes its id, other records keep their
+    id. A new record whose id is already used by a different record raises
+    a ValueError, so semantic ids such as the traffic light categories are
+    never changed.
+
+    Inputs:
+    record_lists - One list of licenses or categories per source.
+    key          - 'licenses' or 'categories'.
+
+    Returns:
+    records      - List of united records.
+    id_maps      - One dictionary old id -> new id per source.
+    """
+    records = []
+    by_match = dict()
+    used_ids = dict()
+    id_maps = []
+
+    for i, record_list in enumerate(record_lists):
+        id_map = dict()
+        for record in record_list:
+            match = _match_key(key, record)
+            if match not in by_match:
+                if record['id'] in used_ids:
+                    raise ValueError("{} id {} of source {} is used by a different record in an earlier source: {} / {}"
+                                     .format(key, record['id'], i, record, records[used_ids[record['id']]]))
+                used_ids[record['id']] = len(records)
+                by_match[match] = record['id']
+                records.append(record)
+            id_map[record['id']] = by_match[match]
+        id_maps.append(id_map)
+
+    return records, id_maps
+
+
+class _IdMapper:
+    # Assigns new ids to the records of all sources according to the remap mode
+    def __init__(self, mode, namespaces, kind):
+        if mode not in REMAP_MODES:
+            raise ValueError("Unknown remap mode {}. Use one of {}.".format(mode, REMAP_MODES))
+        self.mode = mode
+        self.namespaces = namespaces
+        self.kind = kind
+        self.next_id = 1
+        self.seen = set()
+
+    def new_id(self, source_index, old_id):
+        if self.mode == "dense":
+            new_id = self.next_id
+            self.next_id += 1
+            return new_id
+        if self.mode == "namespace":
+            return "{}_{}".format(self.namespaces[source_index], old_id)
+        if old_id in self.seen:
+            raise ValueError("Duplicate {} id {} in source {}. Use remap='dense' or 'namespace'."
+                             .format(self.kind, old_id, source_index))
+        self.seen.add(old_id)
+        return old_id
+
+
+class _Spool:
+    # Records pickled in batches to a temporary file, read back once
+    def __init__(self, batch_size=10000):
+        self.file = tempfile.TemporaryFile()
+        self.batch = []
+        self.batch_size = batch_size
+
+    def append(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            pickle.dump(self.batch, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+
+    def __iter__(self):
+        self._flush()
+        self.file.seek(0)
+        try:
+            while True:
+                try:
+                    batch = pickle.load(self.file)
+                except EOFError:
+                    break
+                yield from batch
+        finally:
+            self.file.close()
+
+
+def _read_source(source):
+    # Reads a source in one pass. Returns its info, licenses and categories
+    # and its images and annotations, spooled if the source is a file.
+    if isinstance(source, dict):
+        header = {key: source.get(key) or [] for key in ('licenses', 'categories')}
+        header['info'] = source.get('info')
+        return header, {key: source.get(key) or [] for key in ('images', 'annotations')}
+
+    header = {'info': None, 'licenses': [], 'categories': []}
+    spools = {'images': _Spool(), 'annotations': _Spool()}
+    for key, record in iter_records(source, ('info', 'licenses', 'categories', 'images', 'annotations')):
+        if key in spools:
+            spools[key].append(record)
+        elif key == 'info':
+            header['info'] = record
+        else:
+            header[key].append(record)
+    return header, spools
+
+
+def iter_merged(sources, remap="keep", namespaces=None):
+    """
+    Merges the given sources. Each source file is parsed once, here.
+
+    Inputs:
+    sources    - List of paths to COCO annotation files or loaded datasets.
+    remap      - "keep" keeps all ids and raises on collisions,
+                 "dense" reassigns integer ids starting at 1,
+                 "namespace" prefixes the ids with the namespace of the source.
+    namespaces - One prefix per source for remap="namespace". Defaults to
+                 the source index.
+
+    Returns:
+    header     - Dictionary with info, licenses and categories.
+    images     - Generator over the merged images.
+    anns       - Generator over the merged annotations. Must be consumed
+                 after images. Annotations whose image is not in their
+                 source are dropped.
+    """
+    if namespaces is None:
+        namespaces = [str(i) for i in range(len(sources))]
+    assert len(namespaces) == len(sources)
+
+    image_ids = _IdMapper(remap, namespaces, 'image')
+    ann_ids = _IdMapper(remap, namespaces, 'annotation')
+    parts = [_read_source(source) for source in sources]
+
+    licenses, license_maps = unite_records([part[0]['licenses'] for part in parts], 'licenses')
+    categories, category_maps = unite_records([part[0]['categories'] for part in parts], 'categories')
+    header = {'info': parts[0][0]['info'], 'licenses': licenses, 'categories': categories}
+
+    # Old image id -> new image id, per source
+    image_maps = [dict() for _ in sources]
+
+    def images():
+        for i, (_, records) in enumerate(parts):
+            for img in records['images']:
+                new_id = image_ids.new_id(i, img['id'])
+                image_maps[i][img['id']] = new_id
+                img = dict(img, id=new_id)
+                if 'license' in img:
+                    img['license'] = license_maps[i].get(img['license'], img['license'])
+                yield img
+
+    def anns():
+        orphans = 0
+        for i, (_, records) in enumerate(parts):
+            for ann in records['annotations']:
+                img_id = image_maps[i].get(ann['image_id'], _NO_IMAGE)
+                if img_id is _NO_IMAGE:
+                    orphans += 1
+                    continue
+                yield dict(ann, id=ann_ids.new_id(i, ann['id']), image_id=img_id,
+                           category_id=category_maps[i].get(ann['category_id'], ann['category_id']))
+            image_maps[i] = None
+        if orphans:
+            print("Dropped {} annotations without image.".format(orphans))
+
+    return header, images(), anns()
+
+
+def merge_coco(sources, remap="keep", namespaces=None):
+    """
+    Merges the sources into one dataset in memory. See iter_merged.
+    """
+    header, images, anns = iter_merged(sources, remap, namespaces)
+    dataset = dict(header)
+    dataset['images'] = list(images)
+    dataset['annotations'] = list(anns)
+
+    return dataset
+
+
+def _write_records(f, records):
+    # Writes a JSON array record by record and returns the number of records
+    count = 0
+    f.write('[')
+    for record in records:
+        if count:
+            f.write(',\n')
+        f.write(json.dumps(record, ensure_ascii=False))
+        count += 1
+    f.write(']')
+    return count
+
+
+def merge_coco_files(sources, path_out, remap="keep", namespaces=None):
+    """
+    Merges the sources and streams the result to path_out. See iter_merged.
+    """
+    header, images, anns = iter_merged(sources, remap, namespaces)
+
+    with open(path_out, 'w', encoding='utf-8') as f:
+        f.write('{"info": ' + json.dumps(header['info'], ensure_ascii=False))
+        f.write(',\n"licenses": ' + json.dumps(header['licenses'], ensure_ascii=False))
+        f.write(',\n"categories": ' + json.dumps(header['categories'], ensure_ascii=False))
+        f.write(',\n"images": ')
+        num_images = _write_records(f, images)
+        f.write(',\n"annotations": ')
+        num_anns = _write_records(f, anns)
+        f.write('}\n')
+
+    print("Merged {} files into {} with {} images and {} annotations.".format(
+        len(sources), path_out, num_images, num_anns))
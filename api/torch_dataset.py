@@ -0,0 +1,253 @@
+# ========================================================================= #
+# PyTorch dataset for training on COCO Traffic and COCO Traffic Extended.   #
+#                                                                           #
+# The annotation file is parsed once into flat arrays (file names, image    #
+# sizes, per-image offsets, boxes and class ids), which are cached as .npy  #
+# files next to the annotation file. Each DataLoader worker opens them      #
+# memory-mapped, so all workers share the same pages instead of holding     #
+# their own copy of the parsed JSON. Image ids of any type are supported,   #
+# samples are addressed by their row.                                       #
+#                                                                           #
+# Class ids follow COCO_TO_YOLO in make_yolo_labels.py. Traffic lights that #
+# kept class 10 are skipped, like in the yolo labels.                       #
+# ========================================================================= #
+
+import os
+import json
+import time
+
+import numpy as np
+import cv2 as cv
+import torch
+from torch.utils.data import Dataset, Sampler, DataLoader
+
+from make_yolo_labels import COCO_TO_YOLO
+
+# cv.imread flags for decoding at 1/2, 1/4 and 1/8 of the size
+_REDUCED_FLAGS = {1: cv.IMREAD_COLOR, 2: cv.IMREAD_REDUCED_COLOR_2,
+                  4: cv.IMREAD_REDUCED_COLOR_4, 8: cv.IMREAD_REDUCED_COLOR_8}
+
+_ARRAYS = ('file_names', 'image_ids', 'sizes', 'offsets', 'boxes', 'labels')
+
+
+def _cache_prefix(ann_file, cache_dir):
+    name = os.path.splitext(os.path.basename(ann_file))[0]
+    return os.path.join(cache_dir or os.path.dirname(os.path.abspath(ann_file)), name + '_arrays')
+
+
+def build_arrays(ann_file, cache_dir=None):
+    """
+    Parses a COCO annotation file into flat arrays and saves them as .npy.
+    Nothing is done if the cache is newer than the annotation file.
+
+    Returns:
+    prefix - Path prefix of the cached arrays.
+    """
+    prefix = _cache_prefix(ann_file, cache_dir)
+    meta_file = prefix + '_meta.json'
+    mtime = os.stat(ann_file).st_mtime_ns
+    if os.path.isfile(meta_file):
+        with open(meta_file, 'r') as f:
+            if json.load(f).get('mtime') == mtime:
+                return prefix
+
+    with open(ann_file, 'r') as f:
+        dataset = json.load(f)
+
+    images = dataset['images']
+    rows = {img['id']: i for i, img in enumerate(images)}
+    class_map = {int(k): int(v) for k, v in COCO_TO_YOLO.items()}
+    anns = [ann for ann in dataset['annotations']
+            if ann['category_id'] in class_map and ann['image_id'] in rows]
+
+    ann_rows = np.array([rows[ann['image_id']] for ann in anns], dtype=np.int64)
+    order = np.argsort(ann_rows, kind='stable')
+    boxes = np.array([ann['bbox'] for ann in anns], dtype=np.float32).reshape(-1, 4)[order]
+    labels = np.array([class_map[ann['category_id']] for ann in anns], dtype=np.int16)[order]
+    offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ann_rows, minlength=len(images)), out=offsets[1:])
+
+    arrays = {
+        'file_names': np.array([img['file_name'] for img in images], dtype=str),
+        'image_ids': np.array([str(img['id']) for img in images], dtype=str),
+        'sizes': np.array([[img['width'], img['height']] for img in images], dtype=np.int32).reshape(-1, 2),
+        'offsets': offsets,
+        'boxes': boxes,
+        'labels': labels,
+    }
+    for key, array in arrays.items():
+        np.save(prefix + '_' + key + '.npy', array)
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.abspath(ann_file), 'mtime': mtime}, f)
+
+    print("Cached {} images and {} annotations of {} in {}_*.npy".format(
+        len(images), len(anns), ann_file, prefix))
+    return prefix
+
+
+class CocoTrafficDataset(Dataset):
+    """
+    Detection dataset over a COCO Traffic annotation file.
+
+    Inputs:
+    ann_file  - COCO annotation file.
+    img_dirs  - Image folder or list of folders, searched in order, e.g.
+                train2017 and the LISA images for COCO Traffic Extended.
+    reduce    - Decode images at 1/reduce of their size (1, 2, 4 or 8).
+                Boxes are scaled to match.
+    transform - Optional callable (image, target) -> (image, target).
+
+    Items are (image, target) with a uint8 RGB tensor (3, H, W) and a dict
+    with boxes (N, 4) as x1, y1, x2, y2 in pixels, labels (N,), the row
+    as image_id and the original size as (height, width).
+    """
+    def __init__(self, ann_file, img_dirs, cache_dir=None, reduce=1, transform=None):
+        if reduce not in _REDUCED_FLAGS:
+            raise ValueError("reduce must be one of {}.".format(sorted(_REDUCED_FLAGS)))
+        self.prefix = build_arrays(ann_file, cache_dir)
+        self.img_dirs = [img_dirs] if isinstance(img_dirs, str) else list(img_dirs)
+        self.reduce = reduce
+        self.transform = transform
+        self._arrays = None
+        self._length = len(self.arrays['sizes'])
+
+    @property
+    def arrays(self):
+        # Opened on first use in each process, so workers map the files themselves
+        if self._arrays is None:
+            self._arrays = {key: np.load(self.prefix + '_' + key + '.npy', mmap_mode='r') for key in _ARRAYS}
+        return self._arrays
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __len__(self):
+        return self._length
+
+    def aspect_ratios(self):
+        # Width / height of every image
+        sizes = np.asarray(self.arrays['sizes'], dtype=np.float32)
+        return sizes[:, 0] / sizes[:, 1]
+
+    def image_path(self, index):
+        file_name = str(self.arrays['file_names'][index])
+        for img_dir in self.img_dirs:
+            path = os.path.join(img_dir, file_name)
+            if os.path.isfile(path):
+                return path
+        raise FileNotFoundError("Image {} not found in {}.".format(file_name, self.img_dirs))
+
+    def __getitem__(self, index):
+        arrays = self.arrays
+        image = cv.imread(self.image_path(index), _REDUCED_FLAGS[self.reduce])
+        if image is None:
+            raise IOError("Unable to decode image {}.".format(self.image_path(index)))
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+
+        width, height = (int(x) for x in arrays['sizes'][index])
+        scale = np.array([image.shape[1] / width, image.shape[0] / height] * 2, dtype=np.float32)
+
+        start, end = arrays['offsets'][index], arrays['offsets'][index + 1]
+        boxes = np.array(arrays['boxes'][start:end], dtype=np.float32)
+        boxes[:, 2:] += boxes[:, :2]
+        boxes *= scale
+
+        target = {
+            'boxes': torch.from_numpy(boxes),
+            'labels': torch.from_numpy(np.array(arrays['labels'][start:end], dtype=np.int64)),
+            'image_id': index,
+            'orig_size': (height, width),
+        }
+        image = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        if self.transform is not None:
+            image, target = self.transform(image, target)
+
+        return image, target
+
+
+class AspectRatioBatchSampler(Sampler):
+    """
+    Yields batches of indices whose images fall into the same aspect ratio
+    bucket, so that batches need little padding. Call set_epoch for a new
+    order in each epoch.
+    """
+    def __init__(self, aspect_ratios, batch_size, boundaries=(0.75, 1.0, 1.34),
+                 shuffle=True, drop_last=False, seed=1881):
+        self.groups = np.digitize(np.asarray(aspect_ratios), boundaries)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _batches(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        batches = []
+        for group in np.unique(self.groups):
+            indices = np.flatnonzero(self.groups == group)
+            if self.shuffle:
+                rng.shuffle(indices)
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start:start + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        return len(self._batches())
+
+
+def collate(batch):
+    # Keeps images of different sizes as lists
+    images, targets = zip(*batch)
+    return list(images), list(targets)
+
+
+def make_loader(dataset, batch_size=16, num_workers=4, shuffle=True, **kwargs):
+    """
+    Returns a DataLoader with aspect ratio bucketed batches.
+    """
+    sampler = AspectRatioBatchSampler(dataset.aspect_ratios(), batch_size, shuffle=shuffle)
+    return DataLoader(dataset, batch_sampler=sampler, num_workers=num_workers, collate_fn=collate,
+                      persistent_workers=num_workers > 0, **kwargs)
+
+
+def benchmark(dataset, workers=(0, 2, 4, 8), batch_size=16, num_batches=50):
+    """
+    Prints the loading throughput in images/sec for each number of workers.
+    """
+    results = dict()
+    for num_workers in workers:
+        loader = make_loader(dataset, batch_size, num_workers)
+        count = 0
+        start = None
+        for i, (images, _) in enumerate(loader):
+            if i == 0:
+                start = time.perf_counter()  # Exclude worker startup
+                continue
+            count += len(images)
+            if i >= num_batches:
+                break
+        elapsed = time.perf_counter() - start if start is not None else 0
+        results[num_workers] = count / elapsed if elapsed > 0 else 0.0
+        print("{} workers: {:.1f} images/sec".format(num_workers, results[num_workers]))
+        del loader
+    return results
+
+
+if __name__ == "__main__":
+    annFile = "../annotations/instances_train_traffic_extended.json"
+    imgDirs = ["../images/train2017/", "../images/trainTrafficLISA/"]
+    for reduce in (1, 2):
+        print("Decoding at 1/{} size".format(reduce))
+        benchmark(CocoTrafficDataset(annFile, imgDirs, reduce=reduce))
@@ -0,0 +1,185 @@
+# ========================================================================= #
+# Checks the integrity of a COCO annotation file.                           #
+#                                                                           #
+# Errors:                                                                   #
+# - Duplicate image or annotation ids                                       #
+# - Annotations of unknown images or categories                             #
+# - Boxes with non-positive size or outside of the image                    #
+# - Missing or wrong area                                                   #
+# - Image files which are missing, cannot be decoded or differ in size      #
+#                                                                           #
+# Warnings:                                                                 #
+# - Images without annotations                                              #
+#                                                                           #
+# The annotation checks run as vectorized passes over NumPy arrays, the     #
+# file checks on a thread pool.                                             #
+# ========================================================================= #
+
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_meta import get_image_size
+
+
+def _duplicates(ids):
+    # Returns the ids which occur more than once
+    if len(set(ids)) == len(ids):
+        return []
+    return [i for i, n in Counter(ids).items() if n > 1]
+
+
+def _add(report, check, severity, ids):
+    # Adds a check result to the report
+    report[check] = {'severity': severity, 'count': len(ids), 'examples': list(ids[:10])}
+
+
+def _is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def _load_image(path):
+    # Returns (width, height) of a decoded image, None if it cannot be read.
+    # Falls back to the file header if OpenCV is not installed.
+    try:
+        import cv2 as cv
+    except ImportError:
+        return get_image_size(path)
+    image = cv.imread(path)
+    if image is None:
+        return None
+    return image.shape[1], image.shape[0]
+
+
+def check_files(images, img_dir, decode=True, num_workers=16):
+    """
+    Checks that the image files exist, decode and match the size in the
+    annotation file. With decode=False only the file header is read.
+
+    Returns:
+    missing, broken, size_mismatch - Lists of image ids.
+    """
+    def check(img):
+        path = os.path.join(img_dir, img['file_name'])
+        if not os.path.isfile(path):
+            return 'missing'
+        try:
+            size = _load_image(path) if decode else get_image_size(path)
+        except (OSError, ValueError):
+            size = None
+        if size is None:
+            return 'broken'
+        if 'width' in img and 'height' in img and tuple(size) != (img['width'], img['height']):
+            return 'size_mismatch'
+        return None
+
+    results = {'missing': [], 'broken': [], 'size_mismatch': []}
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for img, result in zip(images, executor.map(check, images)):
+            if result is not None:
+                results[result].append(img['id'])
+
+    return results['missing'], results['broken'], results['size_mismatch']
+
+
+def validate(dataset, img_dir=None, decode=True, num_workers=16, tol=1.0):
+    """
+    Checks a COCO dataset.
+
+    Inputs:
+    dataset     - COCO annotation file object.
+    img_dir     - Folder with the images. The file checks are skipped if None.
+    decode      - Fully decode each image instead of reading its header.
+    num_workers - Number of threads for the file checks.
+    tol         - Tolerance in pixels for boxes outside the image.
+
+    Returns:
+    report      - Dictionary check -> {severity, count, examples}.
+    """
+    report = dict()
+    images = dataset['images']
+    anns = dataset['annotations']
+
+    # Ids
+    img_ids = [img['id'] for img in images]
+    ann_ids = [ann['id'] for ann in anns]
+    _add(report, 'duplicate_image_ids', 'error', _duplicates(img_ids))
+    _add(report, 'duplicate_annotation_ids', 'error', _duplicates(ann_ids))
+
+    # Annotation -> image row, -1 for unknown images
+    img_rows = {img_id: i for i, img_id in enumerate(img_ids)}
+    ann_img = np.array([img_rows.get(ann['image_id'], -1) for ann in anns], dtype=np.int64)
+    ann_ids = np.array(ann_ids, dtype=object)
+    orphan = ann_img < 0
+    _add(report, 'orphan_annotations', 'error', ann_ids[orphan])
+
+    has_anns = np.zeros(len(images), dtype=bool)
+    has_anns[ann_img[~orphan]] = True
+    _add(report, 'images_without_annotations', 'warning', np.array(img_ids, dtype=object)[~has_anns])
+
+    # Categories
+    known = set(cat['id'] for cat in dataset['categories'])
+    unknown = np.array([ann['category_id'] not in known for ann in anns], dtype=bool)
+    _add(report, 'unknown_categories', 'error', ann_ids[unknown])
+
+    # Boxes
+    nan_box = [np.nan] * 4
+    boxes = np.array([b if isinstance(b, (list, tuple)) and len(b) == 4 and all(map(_is_number, b)) else nan_box
+                      for b in (ann.get('bbox') for ann in anns)], dtype=np.float64).reshape(-1, 4)
+    x, y, w, h = boxes.T
+    bad_size = ~((w > 0) & (h > 0))
+    _add(report, 'invalid_boxes', 'error', ann_ids[bad_size])
+
+    img_w = np.array([img.get('width', np.nan) for img in images] + [np.nan], dtype=np.float64)
+    img_h = np.array([img.get('height', np.nan) for img in images] + [np.nan], dtype=np.float64)
+    aw, ah = img_w[ann_img], img_h[ann_img]  # Row -1 is nan
+    outside = (x < -tol) | (y < -tol) | (x + w > aw + tol) | (y + h > ah + tol)
+    _add(report, 'boxes_outside_image', 'error', ann_ids[outside & ~bad_size])
+
+    # Area. Without segmentation it is the box area, otherwise at most the box area.
+    area = np.array([a if _is_number(a) else np.nan for a in (ann.get('area') for ann in anns)], dtype=np.float64)
+    no_seg = np.array([not ann.get('segmentation') or ann.get('segmentation') == [[]] for ann in anns], dtype=bool)
+    missing_area = np.isnan(area)
+    box_area = w * h
+    wrong_area = ~missing_area & ~bad_size & (
+        (area <= 0) |
+        (area > box_area * 1.001 + tol) |
+        (no_seg & (np.abs(area - box_area) > box_area * 1e-3 + tol)))
+    _add(report, 'missing_area', 'error', ann_ids[missing_area])
+    _add(report, 'wrong_area', 'error', ann_ids[wrong_area])
+
+    # Files
+    if img_dir is not None:
+        missing, broken, size_mismatch = check_files(images, img_dir, decode, num_workers)
+        _add(report, 'missing_files', 'error', missing)
+        _add(report, 'broken_files', 'error', broken)
+        _add(report, 'size_mismatch', 'error', size_mismatch)
+
+    return report
+
+
+def print_report(report, name=""):
+    """
+    Prints the failed checks of a report.
+    """
+    failed = {k: v for k, v in report.items() if v['count'] > 0}
+    print("Validation {}: {} checks, {} failed.".format(name, len(report), len(failed)))
+    for check, result in failed.items():
+        print("  {} {}: {} e.g. {}".format(result['severity'].upper(), check, result['count'], result['examples'][:5]))
+
+
+def num_errors(report):
+    return sum(v['count'] for v in report.values() if v['severity'] == 'error')
+
+
+def check_dataset(dataset, name="", img_dir=None, decode=True):
+    """
+    Validates a dataset, prints the report and raises a ValueError on errors.
+    """
+    report = validate(dataset, img_dir, decode)
+    print_report(report, name)
+    if num_errors(report) > 0:
+        raise ValueError("Dataset {} failed validation with {} errors.".format(name, num_errors(report)))
+    return report
@@ -0,0 +1,332 @@
+# ========================================================================= #
+# Command line interface for the COCO Traffic tools.                        #
+#                                                                           #
+# Usage: python cocotraffic.py <command> [options]                          #
+#                                                                           #
+# atlas        - Crops the traffic lights into a memory-mapped atlas        #
+#                (tools/cropAtlas)                                          #
+# build        - Builds COCO Refined, COCO Traffic and COCO Traffic         #
+#                Extended (api/make_datasets.py)                            #
+# diff         - Compares two annotation files record by record             #
+#                (api/diff_coco.py)                                         #
+# export-yolo  - Writes yolov5 labels (api/make_yolo_labels.py)             #
+# export-shards - Packs letterboxed images into shards for training         #
+#                (api/make_image_shards.py)                                 #
+# light-state  - Trains the traffic light state model on an atlas           #
+#                (tools/cropAtlas)                                          #
+# lisa-import  - Converts the makesense.ai LISA labels and appends them     #
+#                (tools/makesense)                                          #
+# prelabel     - Predicts COCO boxes with DETR (tools/preLabeller)          #
+# query        - Selects boxes or images by their attributes                #
+#                (api/box_query.py)                                         #
+# relabel      - Relabels traffic lights (tools/dataLabeller)               #
+# release      - Packs the release archives with a manifest of hashes       #
+#                (api/make_release.py)                                      #
+# stats        - Prints image and annotation counts of annotation files     #
+# store        - Imports annotation files into an SQLite store and exports  #
+#                them (api/coco_store.py)                                   #
+# validate     - Checks annotation files and their images                   #
+# verify-release - Checks an unpacked release against its manifest          #
+#                                                                           #
+# The tool modules, and with them torch, cv2 and pandas, are only imported  #
+# by the command that needs them. --trace records the time and memory of    #
+# each stage, see api/instrument.py.                                        #
+# ========================================================================= #
+
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _use(*folders):
+    # Makes the modules in the given repository folders importable
+    for folder in folders:
+        path = os.path.join(ROOT, folder)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def _dir(path):
+    # The tools join folder paths by concatenation
+    return os.path.join(path, '')
+
+
+def cmd_atlas(args):
+    _use("tools/cropAtlas")
+    from make_crop_atlas import make_crop_atlas
+    make_crop_atlas(args.ann_file, args.images, args.out, categories=args.categories, size=args.size,
+                    pad=args.pad, num_workers=args.workers)
+
+
+def cmd_build(args):
+    _use("api")
+    from make_datasets import build_datasets
+    build_datasets(_dir(args.annotations), save=args.save, validate=args.validate, num_workers=args.workers)
+
+
+def cmd_diff(args):
+    _use("api")
+    from diff_coco import diff_coco, print_diff, num_differences
+    import json
+    report = diff_coco(args.file_a, args.file_b)
+    print_diff(report, limit=args.limit)
+    if args.out is not None:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+    if num_differences(report) > 0:
+        sys.exit(1)
+
+
+def cmd_export_yolo(args):
+    _use("api")
+    from make_yolo_labels import run
+    run(_dir(args.annotations), args.dataset, img_dir=args.images, labels_dir=_dir(args.labels))
+
+
+def cmd_export_shards(args):
+    _use("api")
+    from make_image_shards import make_image_shards
+    make_image_shards(args.ann_file, args.images, args.out, target=args.size, quality=args.quality,
+                      num_workers=args.workers)
+
+
+def cmd_light_state(args):
+    _use("tools/cropAtlas")
+    from light_state import train_from_atlas
+    train_from_atlas(args.atlas, args.model, val_split=args.val_split)
+
+
+def cmd_lisa_import(args):
+    _use("api", "tools/makesense")
+    from append_LISA_to_coco_splits import import_lisa
+    import_lisa(args.files, _dir(args.makesense_dir), _dir(args.annotations), _dir(args.images),
+                lisa_source=args.lisa_source, save=args.save, dedup_distance=args.dedup_distance,
+                dedup_policy=args.dedup_policy)
+
+
+def cmd_prelabel(args):
+    _use("tools/preLabeller")
+    from make_annotations import read_list_to_annotate, auto_annotate, save_annotations
+    save_annotations(auto_annotate(read_list_to_annotate(args.filename)), args.out)
+
+
+def cmd_relabel(args):
+    _use("tools/dataLabeller")
+    from dataLabeller import run
+    run(args.data_dir, args.data_type, cat_show=tuple(args.categories), grid_mode=args.grid,
+        accept_above=args.accept_above, query=args.query, use_store=args.store)
+
+
+def cmd_query(args):
+    _use("api")
+    from make_datasets import load_anns, save_dataset
+    from box_query import BoxIndex, subset_dataset
+    dataset = load_anns("", args.file)
+    ann_ids, image_ids = BoxIndex(dataset).query(args.query)
+    print("{} annotations in {} images match.".format(len(ann_ids), len(image_ids)))
+    if args.list:
+        for x in sorted(image_ids if args.list == "images" else ann_ids, key=str):
+            print(x)
+    if args.out is not None:
+        save_dataset(subset_dataset(dataset, ann_ids), args.out, path="")
+
+
+def cmd_release(args):
+    _use("api")
+    from make_release import RELEASES, make_release
+    for name in args.releases:
+        if name not in RELEASES:
+            sys.exit("Unknown release {}, expected one of {}.".format(name, ", ".join(RELEASES)))
+    for name in args.releases or list(RELEASES):
+        make_release(name, args.out, ann_dir=_dir(args.annotations), img_dirs=args.images,
+                     max_shard_bytes=args.max_shard_mb << 20, num_workers=args.workers)
+
+
+def cmd_stats(args):
+    _use("api")
+    from make_datasets import print_stats
+    import json
+    for filename in args.files:
+        with open(filename, 'r') as f:
+            print(filename)
+            print_stats(json.load(f))
+
+
+def cmd_store(args):
+    _use("api")
+    from coco_store import CocoStore
+    # Opening a store creates the database, which export must not do
+    if args.action == "export" and not os.path.isfile(args.database):
+        sys.exit("Store {} not found, import a COCO file first.".format(args.database))
+    store = CocoStore(args.database)
+    if args.action == "import":
+        store.import_coco(args.file)
+    else:
+        store.export(args.file)
+    store.close()
+
+
+def cmd_validate(args):
+    _use("api")
+    from make_datasets import load_anns
+    from validate import validate, print_report, num_errors
+    errors = 0
+    for filename in args.files:
+        report = validate(load_anns("", filename), args.images, decode=not args.header_only, num_workers=args.workers)
+        print_report(report, filename)
+        errors += num_errors(report)
+    if errors > 0:
+        sys.exit(1)
+
+
+def cmd_verify_release(args):
+    _use("api")
+    from make_release import verify_release
+    missing, mismatched = verify_release(args.manifest, args.root, num_workers=args.workers)
+    if missing or mismatched:
+        sys.exit(1)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="cocotraffic", description="COCO Traffic dataset tools.")
+    parser.add_argument("--trace", default=None, help="Write per-stage timing and memory records to this .json file")
+    parser.add_argument("--chrome-trace", default=None, help="Also write a Chrome trace file (requires --trace)")
+    commands = parser.add_subparsers(dest="command", metavar="<command>")
+    commands.required = True
+
+    p = commands.add_parser("atlas", help="Crop the traffic lights of an annotation file into an atlas")
+    p.add_argument("ann_file", help="COCO annotation file")
+    p.add_argument("--images", default=os.path.join(ROOT, "images", "Traffic"), help="Folder of the images")
+    p.add_argument("--out", default=os.path.join(ROOT, "annotations", "crops_Traffic"),
+                   help="Output path without extension, writes <out>.npy and <out>_index.json")
+    p.add_argument("--categories", type=int, nargs="+", default=[10, 92, 93, 94], help="Category ids to crop")
+    p.add_argument("--size", type=int, default=64, help="Side length of the crops in pixels")
+    p.add_argument("--pad", type=float, default=0.25, help="Padding around the box as fraction of its longer side")
+    p.add_argument("--workers", type=int, default=8, help="Number of threads decoding the images")
+    p.set_defaults(func=cmd_atlas)
+
+    p = commands.add_parser("build", help="Build the COCO Traffic datasets")
+    p.add_argument("--annotations", default=os.path.join(ROOT, "annotations"), help="Annotations folder")
+    p.add_argument("--save", action="store_true", help="Save the datasets to the annotations folder")
+    p.add_argument("--no-validate", dest="validate", action="store_false", help="Skip the validation of the datasets")
+    p.add_argument("--workers", type=int, default=None, help="Number of processes loading the input files")
+    p.set_defaults(func=cmd_build)
+
+    p = commands.add_parser("diff", help="Compare two annotation files record by record")
+    p.add_argument("file_a", help="Original COCO annotation file")
+    p.add_argument("file_b", help="Changed COCO annotation file")
+    p.add_argument("--limit", type=int, default=10, help="Number of examples printed per list")
+    p.add_argument("--out", default=None, help="Save the full report to this .json file")
+    p.set_defaults(func=cmd_diff)
+
+    p = commands.add_parser("export-yolo", help="Write yolov5 labels for an annotation file")
+    p.add_argument("dataset", help="Dataset name, reads instances_<dataset>.json")
+    p.add_argument("--annotations", default=os.path.join(ROOT, "annotations"), help="Annotations folder")
+    p.add_argument("--labels", default=os.path.join(ROOT, "labels"), help="Output folder for the labels")
+    p.add_argument("--images", default=None, help="Image folder to read the image sizes from")
+    p.set_defaults(func=cmd_export_yolo)
+
+    p = commands.add_parser("export-shards", help="Pack letterboxed images and yolov5 labels into shards")
+    p.add_argument("ann_file", help="COCO annotation file of the split")
+    p.add_argument("out", help="Output folder for the shards and index.json")
+    p.add_argument("--images", nargs="+", required=True, help="Image folders, searched in order")
+    p.add_argument("--size", type=int, default=640, help="Side length of the letterboxed images")
+    p.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    p.add_argument("--workers", type=int, default=None, help="Number of processes")
+    p.set_defaults(func=cmd_export_shards)
+
+    p = commands.add_parser("light-state", help="Train the traffic light state model on the crops of an atlas")
+    p.add_argument("--atlas", default=os.path.join(ROOT, "annotations", "crops_Traffic"),
+                   help="Atlas path without extension, see atlas")
+    p.add_argument("--model", default=os.path.join(ROOT, "annotations", "light_state.npz"), help="Output .npz file")
+    p.add_argument("--val-split", type=float, default=0.2, help="Fraction of the crops held out for validation")
+    p.set_defaults(func=cmd_light_state)
+
+    p = commands.add_parser("lisa-import", help="Append the makesense.ai LISA labels to COCO Traffic")
+    p.add_argument("files", nargs="+", help="makesense.ai .csv files")
+    p.add_argument("--makesense-dir", default=".", help="Folder with the .csv files")
+    p.add_argument("--annotations", default=os.path.join(ROOT, "annotations"), help="Annotations folder")
+    p.add_argument("--images", default=os.path.join(ROOT, "images", "TrafficLISA"), help="Folder of the LISA images")
+    p.add_argument("--lisa-source", default=None, help="LISA dataset folder to collect the images from")
+    p.add_argument("--save", action="store_true", help="Also save the LISA train and val files")
+    p.add_argument("--dedup-distance", type=int, default=None,
+                   help="Drop near-duplicate frames within this Hamming distance of 64 bit hashes, e.g. 6")
+    p.add_argument("--dedup-policy", default="middle", choices=["first", "middle", "most_boxes", "sharpest"],
+                   help="Frame kept per cluster of near-duplicates")
+    p.set_defaults(func=cmd_lisa_import)
+
+    p = commands.add_parser("prelabel", help="Predict COCO boxes with DETR")
+    p.add_argument("filename", help="File with one image path per line")
+    p.add_argument("--out", default="annotations.csv", help="Output .csv file")
+    p.set_defaults(func=cmd_prelabel)
+
+    p = commands.add_parser("query", help="Select boxes or images by their attributes")
+    p.add_argument("file", help="COCO annotation file")
+    p.add_argument("query", help="Terms like 'category=92 width<8 clip=night*' or 'count>5', see api/box_query.py")
+    p.add_argument("--list", choices=["annotations", "images"], default=None, help="Print the matching ids")
+    p.add_argument("--out", default=None, help="Save the matching annotations and their images to this file")
+    p.set_defaults(func=cmd_query)
+
+    p = commands.add_parser("relabel", help="Relabel traffic lights")
+    p.add_argument("--data-dir", default=ROOT, help="Folder with annotations/ and images/")
+    p.add_argument("--data-type", default="Traffic", help="Reads annotations/instances_<data-type>.json")
+    p.add_argument("--categories", type=int, nargs="+", default=[10, 92, 93, 94], help="Category ids to review")
+    p.add_argument("--grid", action="store_true", help="Review a grid of crops")
+    p.add_argument("--accept-above", type=float, default=None, help="Accept proposed labels with this confidence")
+    p.add_argument("--query", default=None, help="Only review boxes matching this query, e.g. 'width<8'")
+    p.add_argument("--store", action="store_true", help="Save the labels to an SQLite store instead of the .json file")
+    p.set_defaults(func=cmd_relabel)
+
+    p = commands.add_parser("release", help="Pack the release archives into zip shards with a manifest")
+    p.add_argument("releases", nargs="*",
+                   help="01_coco_refined, 02_coco_traffic and / or 03_coco_traffic_extended, defaults to all")
+    p.add_argument("--annotations", default=os.path.join(ROOT, "annotations"), help="Annotations folder")
+    p.add_argument("--images", nargs="+", default=[], help="Image folders to include")
+    p.add_argument("--out", default=os.path.join(ROOT, "release"), help="Output folder for the shards and manifests")
+    p.add_argument("--max-shard-mb", type=int, default=2048, help="Input megabytes per shard")
+    p.add_argument("--workers", type=int, default=None, help="Number of processes writing shards")
+    p.set_defaults(func=cmd_release)
+
+    p = commands.add_parser("stats", help="Print counts of annotation files")
+    p.add_argument("files", nargs="+", help="COCO annotation files")
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser("store", help="Import a COCO file into an SQLite store or export it")
+    p.add_argument("action", choices=["import", "export"], help="import file into database or export database to file")
+    p.add_argument("database", help="SQLite database file")
+    p.add_argument("file", help="COCO annotation file")
+    p.set_defaults(func=cmd_store)
+
+    p = commands.add_parser("validate", help="Check annotation files and their images")
+    p.add_argument("files", nargs="+", help="COCO annotation files")
+    p.add_argument("--images", default=None, help="Image folder, enables the file checks")
+    p.add_argument("--header-only", action="store_true", help="Read the image headers instead of decoding the images")
+    p.add_argument("--workers", type=int, default=16, help="Number of threads for the file checks")
+    p.set_defaults(func=cmd_validate)
+
+    p = commands.add_parser("verify-release", help="Check an unpacked release against its manifest")
+    p.add_argument("manifest", help="<release>_manifest.json")
+    p.add_argument("root", help="Folder the release was unpacked to")
+    p.add_argument("--workers", type=int, default=8, help="Number of threads hashing the files")
+    p.set_defaults(func=cmd_verify_release)
+
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.trace is None:
+        args.func(args)
+        return
+
+    _use("api")
+    from instrument import enable, stage
+    enable(args.trace, args.chrome_trace)
+    with stage(args.command):
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Makes cocotraffic.py and the api and tool modules importable, as the scripts
+# do through sys.path
+import os
+import sys
+import json
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in (".", "api", "tools/dataLabeller", "tools/makesense", "tools/cropAtlas"):
+    path = os.path.normpath(os.path.join(ROOT, folder))
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from class_subsets import CATEGORIES  # noqa: E402
+
+
+@pytest.fixture
+def make_coco():
+    """
+    Returns a function which builds a small COCO dataset. Images are given
+    as ids or dictionaries, annotations as dictionaries. Missing fields get
+    defaults: file name <id>.jpg, 100x100 pixels, annotation ids 1, 2, ...,
+    category 92, a 10x10 box and its area. Categories default to those of
+    COCO Traffic.
+    """
+    def build(images=(), annotations=(), categories=None, licenses=()):
+        imgs = []
+        for img in images:
+            img = dict(img) if isinstance(img, dict) else {'id': img}
+            img.setdefault('file_name', '{}.jpg'.format(img['id']))
+            img.setdefault('width', 100)
+            img.setdefault('height', 100)
+            imgs.append(img)
+        anns = []
+        for i, ann in enumerate(annotations):
+            ann = dict(ann)
+            ann.setdefault('id', i + 1)
+            ann.setdefault('category_id', 92)
+            ann.setdefault('bbox', [0, 0, 10, 10])
+            if 'area' not in ann:
+                ann['area'] = ann['bbox'][2] * ann['bbox'][3]
+            anns.append(ann)
+        return {
+            'info': {'description': 'test'},
+            'licenses': [dict(lic) for lic in licenses],
+            'categories': [dict(cat) for cat in (CATEGORIES if categories is None else categories)],
+            'images': imgs,
+            'annotations': anns,
+        }
+    return build
+
+
+@pytest.fixture
+def write_json(tmp_path):
+    """
+    Returns a function which writes an object to a .json file in tmp_path
+    and returns its path.
+    """
+    def write(obj, name="anns.json"):
+        path = str(tmp_path / name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f)
+        return path
+    return write
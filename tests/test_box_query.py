@@ -0,0 +1,58 @@
+import pytest
+
+from box_query import BoxIndex, parse_query, subset_dataset
+
+
+@pytest.fixture
+def dataset(make_coco):
+    # A COCO image, two LISA images with string ids and an orphan annotation
+    return make_coco([
+        {'id': 1, 'file_name': '000000000001.jpg'},
+        {'id': 'lisa_1', 'file_name': 'nightClip3--00001.jpg', 'height': 50},
+        {'id': 'lisa_2', 'file_name': 'dayClip1--00001.jpg', 'height': 50},
+    ], [
+        {'image_id': 1, 'category_id': 10, 'bbox': [0, 0, 20, 40]},
+        {'image_id': 'lisa_1', 'bbox': [10, 10, 4, 8]},
+        {'image_id': 'lisa_1', 'bbox': [50, 10, 6, 12]},
+        {'image_id': 'lisa_2', 'category_id': 93},
+        {'image_id': 'missing', 'bbox': [0, 0, 1, 1]},
+    ])
+
+
+def test_parse_query():
+    assert parse_query("category=92,93 and width<8") == [('category', '=', [92.0, 93.0]), ('width', '<', 8.0)]
+    with pytest.raises(ValueError):
+        parse_query("colour=red")
+    with pytest.raises(ValueError):
+        parse_query("clip>a")
+
+
+def test_orphan_annotations_are_skipped(dataset):
+    assert len(BoxIndex(dataset)) == 4
+
+
+def test_range_and_category(dataset):
+    ann_ids, img_ids = BoxIndex(dataset).query("category=92 width<6")
+    assert ann_ids == {2}
+    assert img_ids == {'lisa_1'}
+
+
+def test_source_and_clip_by_file_name(dataset):
+    index = BoxIndex(dataset)
+    assert index.query("source=lisa")[0] == {2, 3, 4}
+    assert index.query("source=coco")[0] == {1}
+    assert index.query("clip=night*")[0] == {2, 3}
+    assert index.query("clip!=dayClip1")[0] == {1, 2, 3}
+
+
+def test_count_only_returns_images_with_matches(dataset):
+    index = BoxIndex(dataset)
+    assert index.query("count<2")[1] == {1, 'lisa_2'}
+    assert index.query("category=92 count=2") == ({2, 3}, {'lisa_1'})
+    assert index.query("category=94 count<1") == (set(), set())
+
+
+def test_subset_dataset(dataset):
+    subset = subset_dataset(dataset, ann_ids={2})
+    assert [img['id'] for img in subset['images']] == ['lisa_1']
+    assert [ann['id'] for ann in subset['annotations']] == [2]
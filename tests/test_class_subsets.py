@@ -0,0 +1,63 @@
+import pytest
+
+from class_subsets import CATEGORIES, class_map, derive_subset, lookup_table
+from make_yolo_labels import COCO_TO_YOLO
+
+
+@pytest.fixture
+def dataset(make_coco):
+    # Image 3 only has a car, image 4 nothing. Annotations of image 1 and 2 interleave.
+    return make_coco([1, 2, 3, 4], [
+        {'image_id': 2, 'category_id': 92},
+        {'image_id': 1, 'category_id': 10},
+        {'image_id': 3, 'category_id': 3},
+        {'image_id': 2, 'category_id': 94},
+        {'image_id': 1, 'category_id': 93},
+        {'image_id': 9, 'category_id': 92},
+    ])
+
+
+def test_class_maps():
+    assert class_map('traffic_lights_refined') == {92: 92, 93: 93, 94: 94}
+    assert class_map({'classes': ['traffic_light_green', 'car'], 'ids': 'dense'}) == {93: 0, 3: 1}
+    assert {str(k): str(v) for k, v in class_map('yolo').items()} == COCO_TO_YOLO
+    with pytest.raises(KeyError):
+        class_map('unknown')
+    with pytest.raises(KeyError):
+        class_map({'classes': ['tram']})
+    with pytest.raises(ValueError):
+        class_map({'classes': ['car'], 'ids': 'sparse'})
+
+
+def test_lookup_table():
+    assert lookup_table({2: 0, 5: 1}).tolist() == [-1, -1, 0, -1, -1, 1]
+    assert len(lookup_table({2: 0}, size=10)) == 10
+
+
+def test_keep_ids_groups_annotations_by_image(dataset):
+    subset = derive_subset(dataset, 'traffic_lights')
+    assert [img['id'] for img in subset['images']] == [2, 1]
+    assert [(ann['image_id'], ann['category_id']) for ann in subset['annotations']] == [
+        (2, 92), (2, 94), (1, 10), (1, 93)]
+    assert [cat['id'] for cat in subset['categories']] == [10, 92, 93, 94]
+    assert subset['annotations'][0] is dataset['annotations'][0]  # Unchanged records are shared
+
+
+def test_dense_ids_and_dataset_is_not_modified(dataset):
+    subset = derive_subset(dataset, {'classes': ['traffic_light_na', 'traffic_light_red'], 'ids': 'dense'})
+    assert [(ann['id'], ann['category_id']) for ann in subset['annotations']] == [(1, 1), (4, 0)]
+    assert subset['categories'] == [dict(CATEGORIES[14], id=0), dict(CATEGORIES[12], id=1)]
+    assert [ann['category_id'] for ann in dataset['annotations']] == [92, 10, 3, 94, 93, 92]
+
+
+def test_keep_empty_images_and_categories(dataset):
+    subset = derive_subset(dataset, 'traffic_lights_refined', keep_empty_images=True, keep_categories=True)
+    assert [img['id'] for img in subset['images']] == [2, 1, 3, 4]
+    assert subset['categories'] is dataset['categories']
+    with pytest.raises(ValueError):
+        derive_subset(dataset, 'yolo', keep_categories=True)
+
+
+def test_empty_dataset(make_coco):
+    subset = derive_subset(make_coco(), 'traffic')
+    assert subset['images'] == [] and subset['annotations'] == []
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import cocotraffic
+from coco_store import CocoStore
+
+
+@pytest.fixture
+def dataset(make_coco):
+    # Images and annotations out of id order, LISA style string ids for image 'b'
+    return make_coco([3, 1, 'b'], [
+        {'id': 5, 'image_id': 1, 'category_id': 10, 'segmentation': [[0, 0, 1, 0, 1, 1]]},
+        {'id': 2, 'image_id': 3},
+        {'id': '7l', 'image_id': 'b', 'category_id': 10},
+    ], licenses=[{'id': 1, 'name': 'cc', 'url': 'x'}])
+
+
+@pytest.fixture
+def store(dataset, tmp_path):
+    store = CocoStore(str(tmp_path / "anns.sqlite"))
+    store.import_coco(dataset)
+    yield store
+    store.close()
+
+
+def test_round_trip_keeps_records_and_key_order(store, dataset, tmp_path, write_json):
+    assert store.to_dataset() == dataset
+    assert list(store.to_dataset()) == list(dataset)
+    filename = str(tmp_path / "export.json")
+    store.export(filename)
+    with open(filename) as f:
+        assert json.load(f) == dataset
+
+    # Files are imported in the key order of COCO
+    other = CocoStore(str(tmp_path / "file.sqlite"))
+    other.import_coco(write_json(dataset))
+    assert list(other.to_dataset()) == ['info', 'licenses', 'images', 'annotations', 'categories']
+    other.close()
+
+
+def test_queries(store):
+    assert [ann['id'] for ann in store.annotations(image_id='b')] == ['7l']
+    assert [ann['id'] for ann in store.annotations(category_ids=[10])] == [5, '7l']
+    assert [img['file_name'] for img in store.images(['b', 3])] == ['b.jpg', '3.jpg']
+    assert sorted(store.image_ids([10]), key=str) == [1, 'b']
+    assert store.counts() == {'licenses': 1, 'categories': 15, 'images': 3, 'annotations': 3}
+
+
+def test_update_categories(store, dataset):
+    assert store.update_categories([(2, 93), ('7l', 94), (99, 92)]) == 2
+    assert [ann['category_id'] for ann in store.annotations()] == [10, 93, 94]
+    assert store.image_ids([94]) == ['b']
+
+
+def test_upsert_categories_keeps_the_order(store, dataset):
+    store.upsert_categories([{'id': 1, 'name': 'person', 'supercategory': 'human'}, {'id': 200, 'name': 'new'}])
+    categories = store.categories()
+    assert [cat['id'] for cat in categories] == [cat['id'] for cat in dataset['categories']] + [200]
+    assert categories[0]['supercategory'] == 'human'
+
+
+def test_import_replaces_the_content(store, make_coco):
+    store.import_coco(make_coco([1]))
+    assert store.counts()['images'] == 1 and store.counts()['annotations'] == 0
+
+
+def test_empty_store_raises(tmp_path):
+    store = CocoStore(str(tmp_path / "empty.sqlite"))
+    assert store.is_empty()
+    with pytest.raises(ValueError):
+        store.to_dataset()
+    with pytest.raises(ValueError):
+        store.export(str(tmp_path / "export.json"))
+    assert not (tmp_path / "export.json.tmp").exists()
+    store.close()
+
+
+def test_store_command_does_not_create_a_database_for_export(tmp_path):
+    database = str(tmp_path / "missing.sqlite")
+    with pytest.raises(SystemExit):
+        cocotraffic.main(["store", "export", database, str(tmp_path / "export.json")])
+    assert not (tmp_path / "missing.sqlite").exists()
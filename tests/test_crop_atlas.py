@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import cv2 as cv
+
+import cocotraffic
+from make_crop_atlas import CropAtlas, crop_box
+
+
+def test_crop_box_pads_outside_the_image_with_black():
+    image = np.full((20, 20, 3), 255, dtype=np.uint8)
+    crop = crop_box(image, [0, 0, 10, 10], size=16, pad=0.5)
+    assert crop.shape == (16, 16, 3)
+    assert crop[0, 0].tolist() == [0, 0, 0]
+    assert crop[-1, -1].tolist() == [255, 255, 255]
+
+
+def test_atlas_and_light_state_commands(make_coco, write_json, tmp_path):
+    img_dir = tmp_path / "images"
+    img_dir.mkdir()
+    colours = {92: (0, 0, 255), 93: (0, 255, 0), 94: (80, 80, 80)}
+    anns = []
+    for i in range(30):
+        category_id = 92 + i % 3
+        image = np.zeros((40, 40, 3), dtype=np.uint8)
+        cv.rectangle(image, (10, 10), (20, 30), colours[category_id], -1)
+        cv.imwrite(str(img_dir / "{}.jpg".format(i)), image)
+        anns.append({'image_id': i, 'category_id': category_id, 'bbox': [10, 10, 10, 20]})
+    anns.append({'image_id': 0, 'category_id': 3})  # Not a traffic light
+    ann_file = write_json(make_coco(range(30), anns))
+    atlas_path = str(tmp_path / "crops")
+
+    cocotraffic.main(["atlas", ann_file, "--images", str(img_dir), "--out", atlas_path, "--size", "32",
+                      "--workers", "2"])
+    atlas = CropAtlas(atlas_path)
+    assert len(atlas) == 30
+    assert atlas.get(1).shape == (32, 32, 3)
+    assert 31 not in atlas
+
+    model_file = str(tmp_path / "light_state.npz")
+    cocotraffic.main(["light-state", "--atlas", atlas_path, "--model", model_file])
+    assert os.path.isfile(model_file)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from dedup_lisa import cluster_clip, hamming, perceptual_hashes
+
+
+def test_hamming():
+    hashes = np.array([0, 1, 3, 0xFFFFFFFFFFFFFFFF], dtype=np.uint64)
+    assert hamming(np.uint64(0), hashes).tolist() == [0, 1, 2, 64]
+
+
+def test_cluster_clip_joins_nearest_representative():
+    # 0 and 1 are 1 bit apart, 0xFF00 is far from both and 0xFF01 near it
+    hashes = np.array([0x0, 0x1, 0xFF00, 0x3, 0xFF01], dtype=np.uint64)
+    assert cluster_clip(hashes, max_distance=2).tolist() == [0, 0, 1, 0, 1]
+    assert cluster_clip(hashes, max_distance=0).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_cluster_clip_empty():
+    assert len(cluster_clip(np.array([], dtype=np.uint64), 6)) == 0
+
+
+@pytest.mark.parametrize("method", ["dct", "average"])
+def test_similar_frames_hash_close(method):
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, (32, 32)).astype(np.float32)
+    noisy = np.clip(frame + rng.normal(0, 2, frame.shape), 0, 255)
+    other = rng.randint(0, 256, (32, 32)).astype(np.float32)
+    hashes = perceptual_hashes(np.stack([frame, noisy, other]), method)
+    distances = hamming(hashes[0], hashes)
+    assert hashes.dtype == np.uint64
+    assert distances[1] <= 6 < distances[2]
+
+
+def test_unknown_hash_method_raises():
+    with pytest.raises(ValueError):
+        perceptual_hashes(np.zeros((1, 32, 32)), "wavelet")
@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+from diff_coco import category_changes, diff_coco, num_differences
+
+
+@pytest.fixture
+def dataset(make_coco):
+    return make_coco([1], [
+        {'image_id': 1, 'bbox': [0, 0, 2, 2], 'attributes': {'a': 1, 'b': 2}},
+        {'image_id': 1, 'category_id': 10, 'bbox': [1, 1, 2, 2], 'score': -1},
+    ])
+
+
+def test_identical_datasets(dataset):
+    report = diff_coco(dataset, copy.deepcopy(dataset))
+    assert num_differences(report) == 0
+    assert report['annotations']['unchanged'] == 2
+    assert report['categories']['unchanged'] == 15
+
+
+def test_added_removed_and_changed(dataset):
+    new = copy.deepcopy(dataset)
+    new['annotations'][0]['category_id'] = 93
+    new['annotations'][0]['bbox'] = [0, 0, 3, 2]
+    del new['annotations'][1]
+    new['images'].append({'id': 2, 'file_name': '2.jpg', 'width': 10, 'height': 10})
+    report = diff_coco(dataset, new)
+
+    assert report['images']['added'] == [2]
+    assert report['annotations']['removed'] == [2]
+    fields = report['annotations']['changed'][0]['fields']
+    assert sorted(fields) == ['bbox', 'category_id']
+    assert fields['bbox']['delta'] == [0, 0, 1, 0]
+    assert category_changes(report) == {(92, 93): 1}
+
+
+def test_values_with_equal_hash_differ(dataset):
+    # hash(-1) == hash(-2) in CPython
+    new = copy.deepcopy(dataset)
+    new['annotations'][1]['score'] = -2
+    report = diff_coco(dataset, new)
+    assert report['annotations']['changed'] == [{'id': 2, 'fields': {'score': None}}]
+
+
+def test_key_order_of_dictionaries_is_ignored(dataset):
+    new = copy.deepcopy(dataset)
+    new['annotations'][0]['attributes'] = {'b': 2, 'a': 1}
+    assert num_differences(diff_coco(dataset, new)) == 0
+
+
+def test_added_field(dataset):
+    new = copy.deepcopy(dataset)
+    new['images'][0]['license'] = 1
+    report = diff_coco(dataset, new)
+    assert report['images']['changed'] == [{'id': 1, 'fields': {'license': None}}]
+
+
+def test_changed_segmentation(dataset):
+    dataset['annotations'][0]['segmentation'] = [[0, 0, 2, 0, 2, 2]]
+    new = copy.deepcopy(dataset)
+    new['annotations'][0]['segmentation'] = [[0, 0, 2, 0, 2, 3]]
+    report = diff_coco(dataset, new)
+    assert report['annotations']['changed'] == [{'id': 1, 'fields': {'segmentation': None}}]
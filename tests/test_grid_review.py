@@ -0,0 +1,67 @@
+import numpy as np
+
+from grid_review import GridReview, scripted_keys
+
+
+def make_queue(n):
+    return [{'id': i, 'image_id': i // 2, 'category_id': 10} for i in range(n)]
+
+
+def review(queue, keys, **kwargs):
+    applied = []
+    shown = []
+
+    def apply_fn(ann, category_id):
+        applied.append((ann['id'], category_id))
+        ann['category_id'] = category_id
+
+    grid = GridReview(queue, lambda ann: np.zeros((8, 8, 3), dtype=np.uint8), apply_fn, rows=2, cols=3, tile=16,
+                      show_fn=shown.append, key_fn=scripted_keys(keys), **kwargs)
+    return grid, grid.run(), applied, shown
+
+
+def test_label_keys_relabel_consecutive_tiles_on_commit():
+    queue = make_queue(10)
+    grid, pos, applied, shown = review(queue, "rgn\n")
+    assert applied == [(0, 92), (1, 93), (2, 94)]
+    assert pos == 6
+    assert shown[0].shape == (32, 48, 3)
+
+
+def test_navigation_moves_the_selection_within_the_page():
+    queue = make_queue(10)
+    grid, _, applied, _ = review(queue, "dsr" + "aaaaw" + "g" + "q")
+    assert applied == [(0, 93), (4, 92)]
+
+
+def test_undo_reverts_the_last_label_and_its_selection():
+    queue = make_queue(10)
+    grid, _, applied, _ = review(queue, "rrg" "uu" "n" "q")
+    assert applied == [(0, 92), (1, 94)]
+
+
+def test_undo_restores_an_overwritten_label():
+    queue = make_queue(10)
+    grid, _, applied, _ = review(queue, "r" "a" "g" "u" "q")
+    assert applied == [(0, 92)]
+
+
+def test_pages_commit_separately_and_can_go_back():
+    queue = make_queue(10)
+    grid, pos, applied, _ = review(queue, "r\ng" "b" "n" "q")
+    assert applied == [(0, 92), (6, 93), (0, 94)]
+    assert pos == 0
+
+
+def test_running_out_of_keys_leaves_the_page_uncommitted():
+    queue = make_queue(10)
+    grid, pos, applied, _ = review(queue, "rr")
+    assert applied == []
+    assert pos == 0
+    assert grid.pending == {0: 92, 1: 92}
+
+
+def test_start_resumes_at_the_page_of_the_position():
+    queue = make_queue(10)
+    grid, pos, applied, _ = review(queue, "rq", start=7)
+    assert applied == [(6, 92)]
@@ -0,0 +1,56 @@
+import os
+import json
+
+import numpy as np
+import cv2 as cv
+import pytest
+
+import image_meta
+from image_meta import get_image_size, probe_directory, probe_images
+
+
+@pytest.fixture
+def img_dir(tmp_path):
+    # A baseline and a progressive JPEG, a PNG, a broken file and a text file
+    image = np.zeros((30, 40, 3), dtype=np.uint8)
+    cv.imwrite(str(tmp_path / "a.jpg"), image)
+    cv.imwrite(str(tmp_path / "b.jpg"), image[:20], [cv.IMWRITE_JPEG_PROGRESSIVE, 1])
+    cv.imwrite(str(tmp_path / "c.png"), image[:, :10])
+    (tmp_path / "d.jpg").write_bytes(b'\xff\xd8\xff')
+    (tmp_path / "notes.txt").write_text("no image")
+    return tmp_path
+
+
+def test_header_sizes(img_dir):
+    assert get_image_size(str(img_dir / "a.jpg")) == (40, 30)
+    assert get_image_size(str(img_dir / "b.jpg")) == (40, 20)
+    assert get_image_size(str(img_dir / "c.png")) == (10, 30)
+    with pytest.raises(ValueError):
+        get_image_size(str(img_dir / "notes.txt"))
+
+
+def test_probe_directory_skips_unreadable_files(img_dir):
+    assert probe_directory(str(img_dir)) == {'a.jpg': (40, 30), 'b.jpg': (40, 20), 'c.png': (10, 30)}
+
+
+def test_probe_directory_without_folder(tmp_path):
+    assert probe_directory(str(tmp_path / "missing")) == {}
+
+
+def test_cache_is_reused_until_the_file_changes(img_dir, monkeypatch):
+    cache_file = str(img_dir / "sizes.json")
+    paths = [str(img_dir / "a.jpg"), str(img_dir / "c.png")]
+    probe_images(paths, cache_file=cache_file)
+    with open(cache_file) as f:
+        assert len(json.load(f)) == 2
+
+    probed = []
+    monkeypatch.setattr(image_meta, 'get_image_size', lambda path: probed.append(path) or (1, 1))
+    assert probe_images(paths, cache_file=cache_file) == {paths[0]: (40, 30), paths[1]: (10, 30)}
+    assert probed == []
+
+    cv.imwrite(paths[0], np.zeros((5, 5, 3), dtype=np.uint8))
+    os.utime(paths[0], ns=(1, 1))
+    sizes = probe_images(paths, cache_file=cache_file)
+    assert probed == [paths[0]]
+    assert sizes[paths[0]] == (1, 1)
@@ -0,0 +1,89 @@
+import copy
+import json
+
+import pytest
+from pycocotools.coco import COCO
+
+from dataLabeller import compact_journal, discard_journal, open_journal, replay_journal, set_category
+from coco_store import CocoStore
+
+
+def load_coco(dataset):
+    coco = COCO()
+    coco.dataset = copy.deepcopy(dataset)
+    coco.createIndex()
+    return coco
+
+
+@pytest.fixture
+def dataset(make_coco):
+    return make_coco([1, 2], [{'image_id': 1, 'category_id': 10}, {'image_id': 2, 'category_id': 10}])
+
+
+@pytest.fixture
+def session(dataset, tmp_path):
+    # Loaded annotations and an open journal with two label changes, the
+    # second annotation changed twice
+    coco = load_coco(dataset)
+    base = str(tmp_path / "instances_relabelled")
+    journal = open_journal(base + "Journal")
+    set_category(journal, coco.anns[1], 92)
+    set_category(journal, coco.anns[2], 93)
+    set_category(journal, coco.anns[2], 94)
+    yield coco, journal, base
+    journal.close()
+
+
+def categories(coco):
+    return [ann['category_id'] for ann in coco.dataset['annotations']]
+
+
+def test_set_category_appends_entries(session):
+    coco, journal, base = session
+    assert categories(coco) == [92, 94]
+    with open(base + "Journal.jsonl") as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry[:3] for entry in entries] == [[1, 10, 92], [2, 10, 93], [2, 93, 94]]
+
+
+def test_replay_restores_the_changes(session, dataset):
+    _, journal, base = session
+    with open(base + "Journal.jsonl", 'a') as f:
+        f.write('[1, 92, 9')  # Torn last line of a crash
+    coco = load_coco(dataset)
+    assert replay_journal(base + "Journal", coco) == 3
+    assert categories(coco) == [92, 94]
+
+
+def test_replay_without_journal(dataset, tmp_path):
+    assert replay_journal(str(tmp_path / "none"), load_coco(dataset)) == 0
+
+
+def test_compact_saves_the_file_and_empties_the_journal(session, dataset):
+    coco, journal, base = session
+    compact_journal(journal, coco.dataset, base, coco.dataset['annotations'], coco.dataset['categories'])
+    with open(base + ".json") as f:
+        saved = json.load(f)
+    assert [ann['category_id'] for ann in saved['annotations']] == [92, 94]
+    assert saved['images'] == dataset['images']
+    assert replay_journal(base + "Journal", load_coco(dataset)) == 0
+
+    # The journal stays usable after compaction
+    set_category(journal, coco.anns[1], 10)
+    assert replay_journal(base + "Journal", load_coco(dataset)) == 1
+
+
+def test_compact_into_store_writes_the_changed_annotations(session, dataset):
+    coco, journal, base = session
+    store = CocoStore(base + ".sqlite")
+    store.import_coco(dataset)
+    compact_journal(journal, coco.dataset, base, coco.dataset['annotations'], coco.dataset['categories'], store)
+    assert [ann['category_id'] for ann in store.annotations()] == [92, 94]
+    assert replay_journal(base + "Journal", load_coco(dataset)) == 0
+    store.close()
+
+
+def test_discard_empties_the_journal(session, dataset):
+    _, journal, base = session
+    discard_journal(journal)
+    assert replay_journal(base + "Journal", load_coco(dataset)) == 0
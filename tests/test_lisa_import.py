@@ -0,0 +1,49 @@
+import json
+
+import cocotraffic
+from append_LISA_to_coco_splits import load_LISA_annotations
+
+CLIPS = ("dayClip1", "dayClip2", "dayClip3", "nightClip1", "nightClip2")
+
+
+def write_csv(path, clips, label="traffic_light_red"):
+    # makesense.ai export: label, x, y, w, h, name, image width, image height
+    with open(path, 'w') as f:
+        for clip in clips:
+            for frame in range(4):
+                f.write("{},100,200,10,20,{}--{:05d}.jpg,1280,960\n".format(label, clip, frame))
+
+
+def test_load_concatenates_the_files(tmp_path):
+    write_csv(tmp_path / "p1.csv", CLIPS[:2])
+    write_csv(tmp_path / "p2.csv", CLIPS[2:], label="traffic_light_green")
+    df = load_LISA_annotations(["p1.csv", "p2.csv"], str(tmp_path) + "/")
+    assert len(df) == 20
+    assert list(df.index) == list(range(20))
+    assert list(df.columns) == ["label", "x", "y", "w", "h", "name", "size_w", "size_h"]
+    assert df['label'].value_counts().to_dict() == {'traffic_light_green': 12, 'traffic_light_red': 8}
+
+
+def test_lisa_import_command(make_coco, write_json, tmp_path):
+    write_csv(tmp_path / "p1.csv", CLIPS[:3])
+    write_csv(tmp_path / "p2.csv", CLIPS[3:], label="traffic_light_green")
+    ann_dir = tmp_path / "annotations"
+    (ann_dir / "before_lisa").mkdir(parents=True)
+    for split, img_id in (("train", 1), ("val", 2)):
+        coco = make_coco([img_id], [{'image_id': img_id}])
+        write_json(coco, "annotations/before_lisa/instances_{}Traffic.json".format(split))
+
+    cocotraffic.main(["lisa-import", "p1.csv", "p2.csv", "--makesense-dir", str(tmp_path),
+                      "--annotations", str(ann_dir), "--images", str(tmp_path / "images"), "--save"])
+
+    names = {}
+    for split in ("train", "val"):
+        with open(ann_dir / "instances_{}Traffic.json".format(split)) as f:
+            merged = json.load(f)
+        with open(ann_dir / "instances_{}TrafficLISA.json".format(split)) as f:
+            lisa = json.load(f)
+        assert len(merged['images']) == len(lisa['images']) + 1
+        assert len(merged['annotations']) == len(lisa['annotations']) + 1
+        names[split] = set(img['file_name'].split('--')[0] for img in lisa['images'])
+    assert len(names['train']) == 4 and len(names['val']) == 1
+    assert not names['train'] & names['val']
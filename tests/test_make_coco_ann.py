@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from append_LISA_to_coco_splits import make_coco_ann
+
+
+@pytest.fixture
+def df_ann():
+    # Two boxes in the first frame, one in the second, with a shuffled index
+    return pd.DataFrame({
+        'label': ['traffic_light_red', 'traffic_light_green', 'traffic_light_na'],
+        'x': [1.0, 10.0, 5.0], 'y': [2.0, 20.0, 5.0], 'w': [3.0, 4.0, 2.0], 'h': [6.0, 8.0, 2.0],
+        'name': ['dayClip1--00001.jpg', 'dayClip1--00001.jpg', 'nightClip2--00007.jpg'],
+    }, index=[7, 3, 5])
+
+
+def test_images_and_annotations(df_ann):
+    coco = make_coco_ann(df_ann, "test", image_sizes={'nightClip2--00007.jpg': (640, 480)})
+
+    assert [(img['id'], img['file_name'], img['width'], img['height']) for img in coco['images']] == [
+        ('dayClip1--00001', 'dayClip1--00001.jpg', 1280, 960),
+        ('nightClip2--00007', 'nightClip2--00007.jpg', 640, 480)]
+    anns = coco['annotations']
+    assert [ann['id'] for ann in anns] == ['1l', '2l', '3l']
+    assert [ann['image_id'] for ann in anns] == ['dayClip1--00001', 'dayClip1--00001', 'nightClip2--00007']
+    assert [ann['category_id'] for ann in anns] == [92, 93, 94]
+    assert anns[1]['bbox'] == [10.0, 20.0, 4.0, 8.0]
+    assert [ann['area'] for ann in anns] == [18.0, 32.0, 4.0]
+    assert all(type(ann['category_id']) is int and type(ann['area']) is float for ann in anns)
+    assert len(coco['categories']) == 15
+
+
+def test_input_is_not_modified(df_ann):
+    before = df_ann.copy()
+    make_coco_ann(df_ann, "test")
+    pd.testing.assert_frame_equal(df_ann, before)
+
+
+def test_unknown_label_raises(df_ann):
+    df_ann.loc[3, 'label'] = 'traffic_light_blue'
+    with pytest.raises(KeyError):
+        make_coco_ann(df_ann, "test")
+
+
+def test_save(df_ann, tmp_path):
+    make_coco_ann(df_ann, "instances_test", save=True, ann_dir=str(tmp_path) + "/")
+    assert (tmp_path / "instances_test.json").is_file()
@@ -0,0 +1,63 @@
+import json
+import os
+
+import numpy as np
+import cv2 as cv
+
+from make_image_shards import ImageShards, letterbox, make_image_shards
+
+
+def write_image(path, width, height, value):
+    cv.imwrite(str(path), np.random.RandomState(value).randint(0, 256, (height, width, 3)).astype(np.uint8))
+
+
+def load_index(out_dir):
+    with open(os.path.join(out_dir, 'index.json')) as f:
+        return json.load(f)
+
+
+def test_letterbox():
+    image, ratio, pad = letterbox(np.zeros((50, 100, 3), dtype=np.uint8), 64)
+    assert image.shape == (64, 64, 3)
+    assert ratio == 0.64
+    assert pad == (0, 16)
+
+
+def test_rerun_relabels_prunes_and_compacts(make_coco, write_json, tmp_path):
+    img_dir, out_dir = tmp_path / "images", str(tmp_path / "shards")
+    img_dir.mkdir()
+    images = [{'id': i, 'width': 200, 'height': 100} for i in range(3)]
+    for i in range(3):
+        write_image(img_dir / "{}.jpg".format(i), 200, 100, i)
+
+    boxes = [{'image_id': i, 'bbox': [10, 10, 20, 20]} for i in range(3)]
+    ann_file = write_json(make_coco(images, boxes))
+    make_image_shards(ann_file, str(img_dir), out_dir, target=64, num_workers=1)
+    index = load_index(out_dir)
+    assert index['shards'] == ['shard_00000.bin']
+    assert index['images']['0.jpg']['labels'][0][0] == 11
+
+    # New labels and one image less: no image is processed again
+    write_json(make_coco(images[:2], [dict(ann, category_id=93) for ann in boxes[:2]]))
+    make_image_shards(ann_file, str(img_dir), out_dir, target=64, num_workers=1)
+    index = load_index(out_dir)
+    assert sorted(index['images']) == ['0.jpg', '1.jpg']
+    assert index['shards'] == ['shard_00000.bin']
+    assert all(entry['labels'][0][0] == 12 for entry in index['images'].values())
+
+    # A changed image goes into a new shard, the old one is mostly dead and compacted
+    write_image(img_dir / "1.jpg", 100, 200, 7)
+    os.utime(img_dir / "1.jpg", ns=(1, 1))
+    make_image_shards(ann_file, str(img_dir), out_dir, target=64, num_workers=1)
+    index = load_index(out_dir)
+    assert 'shard_00000.bin' not in index['shards']
+    assert not os.path.exists(os.path.join(out_dir, 'shard_00000.bin'))
+    assert sorted(os.listdir(out_dir)) == sorted(index['shards'] + ['index.json'])
+
+    shards = ImageShards(out_dir)
+    assert len(shards) == 2
+    for name in shards.file_names:
+        image, labels = shards.get(name)
+        assert image.shape == (64, 64, 3)
+        assert labels.shape == (1, 5)
+    assert index['images']['1.jpg']['width'] == 100
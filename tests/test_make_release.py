@@ -0,0 +1,97 @@
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import make_release as release_module
+from make_release import collect_files, make_release, plan_shards, verify_release
+
+
+def write_files(ann_dir, sizes):
+    ann_dir.mkdir(exist_ok=True)
+    names = []
+    for i, size in enumerate(sizes):
+        names.append("{}.json".format(i))
+        (ann_dir / names[-1]).write_bytes(bytes([i]) * size)
+    return names
+
+
+def test_plan_shards():
+    entries = [('a', 'a', 4, 0), ('b', 'b', 4, 0), ('c', 'c', 10, 0), ('d', 'd', 1, 0)]
+    plan = plan_shards(entries, 8)
+    assert [[e[0] for e in shard] for shard in plan] == [['a', 'b'], ['c'], ['d']]
+    assert plan_shards([], 8) == []
+
+
+def test_release_writes_shards_and_manifest(tmp_path):
+    names = write_files(tmp_path / "ann", [100, 100, 100])
+    out_dir = str(tmp_path / "out")
+    manifest_file = make_release('test', out_dir, ann_dir=str(tmp_path / "ann"), ann_files=names,
+                                 max_shard_bytes=200, num_workers=1)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    assert [s['file'] for s in manifest['shards']] == ['test.part001.zip', 'test.part002.zip']
+    assert [f['path'] for f in manifest['files']] == ['annotations/0.json', 'annotations/1.json', 'annotations/2.json']
+
+    root = tmp_path / "unpacked"
+    for shard in manifest['shards']:
+        with zipfile.ZipFile(os.path.join(out_dir, shard['file'])) as zf:
+            zf.extractall(root)
+    assert verify_release(manifest_file, str(root), num_workers=1) == ([], [])
+    (root / "annotations" / "1.json").write_bytes(b'changed')
+    assert verify_release(manifest_file, str(root), num_workers=1) == ([], ['annotations/1.json'])
+
+
+_write_shard = release_module._write_shard
+
+
+def _fail_second_shard(shard_path, entries):
+    if shard_path.endswith('part002.zip'):
+        raise OSError("disk full")
+    return _write_shard(shard_path, entries)
+
+
+def test_rerun_resumes_failed_shards(tmp_path, monkeypatch):
+    names = write_files(tmp_path / "ann", [100, 100, 100])
+    out_dir = str(tmp_path / "out")
+    kwargs = dict(ann_dir=str(tmp_path / "ann"), ann_files=names, max_shard_bytes=100, num_workers=2)
+
+    # Threads instead of processes, so the workers see the patched writer
+    monkeypatch.setattr(release_module, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(release_module, '_write_shard', _fail_second_shard)
+    with pytest.raises(OSError):
+        make_release('test', out_dir, **kwargs)
+    parts_dir = os.path.join(out_dir, '.test_parts')
+    assert sorted(os.listdir(parts_dir)) == ['test.part001.zip.json', 'test.part003.zip.json']
+
+    written = []
+    monkeypatch.setattr(release_module, '_write_shard',
+                        lambda shard_path, entries: written.append(os.path.basename(shard_path))
+                        or _write_shard(shard_path, entries))
+    make_release('test', out_dir, **kwargs)
+    assert written == ['test.part002.zip']
+
+
+def test_new_plan_removes_stale_shards(tmp_path):
+    names = write_files(tmp_path / "ann", [100, 100, 100])
+    out_dir = str(tmp_path / "out")
+    kwargs = dict(ann_dir=str(tmp_path / "ann"), ann_files=names, num_workers=1)
+    make_release('test', out_dir, max_shard_bytes=100, **kwargs)
+    (tmp_path / "out" / "other.zip").write_bytes(b'')
+
+    make_release('test', out_dir, max_shard_bytes=1000, **kwargs)
+    assert sorted(os.listdir(out_dir)) == ['.test_parts', 'other.zip', 'test.zip', 'test_manifest.json']
+    assert os.listdir(os.path.join(out_dir, '.test_parts')) == ['test.zip.json']
+
+
+def test_collect_files_is_sorted(tmp_path):
+    names = write_files(tmp_path / "ann", [1, 2])
+    img_dir = tmp_path / "img"
+    img_dir.mkdir()
+    (img_dir / "b.jpg").write_bytes(b'b')
+    (img_dir / "a.jpg").write_bytes(b'a')
+    (img_dir / ".hidden").write_bytes(b'')
+    entries = collect_files(names[::-1], str(tmp_path / "ann"), [str(img_dir)])
+    assert [e[0] for e in entries] == ['annotations/0.json', 'annotations/1.json', 'images/img/a.jpg', 'images/img/b.jpg']
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import merge_coco as merge_module
+from merge_coco import REMAP_MODES, merge_coco, merge_coco_files, unite_records
+
+LICENSE = {'id': 1, 'name': 'cc', 'url': 'x'}
+
+
+@pytest.fixture
+def make_source(make_coco):
+    # One annotation per image, optionally with an annotation of no image
+    def build(img_ids, ann_ids, categories=None, orphan=None):
+        anns = [{'id': a, 'image_id': i} for a, i in zip(ann_ids, img_ids)]
+        if orphan is not None:
+            anns.append({'id': orphan, 'image_id': -1})
+        return make_coco([{'id': i, 'license': 1} for i in img_ids], anns, categories, [LICENSE])
+    return build
+
+
+def test_keep_raises_on_colliding_image_ids(make_source):
+    with pytest.raises(ValueError):
+        merge_coco([make_source([1, 2], [1, 2]), make_source([2], [3])])
+
+
+def test_dense_renumbers_and_follows_image_ids(make_source):
+    merged = merge_coco([make_source([5, 6], [1, 2]), make_source([5], [1])], remap="dense")
+    assert [img['id'] for img in merged['images']] == [1, 2, 3]
+    assert [ann['id'] for ann in merged['annotations']] == [1, 2, 3]
+    assert [ann['image_id'] for ann in merged['annotations']] == [1, 2, 3]
+
+
+def test_namespace_prefixes_ids(make_source):
+    merged = merge_coco([make_source([1], [1]), make_source([1], [1])], remap="namespace",
+                        namespaces=['coco', 'lisa'])
+    assert [img['id'] for img in merged['images']] == ['coco_1', 'lisa_1']
+    assert [ann['image_id'] for ann in merged['annotations']] == ['coco_1', 'lisa_1']
+
+
+@pytest.mark.parametrize("remap", REMAP_MODES)
+def test_orphans_are_dropped_in_every_mode(make_source, remap):
+    merged = merge_coco([make_source([1], [1], orphan=7), make_source([2], [2])], remap=remap)
+    assert len(merged['images']) == 2
+    assert len(merged['annotations']) == 2
+
+
+def test_categories_united_by_name_and_licenses_by_content(make_source):
+    merged = merge_coco([make_source([1], [1]), make_source([2], [2])])
+    assert len(merged['categories']) == 15
+    assert merged['licenses'] == [LICENSE]
+
+
+def test_same_category_with_other_id_is_mapped(make_source):
+    other = make_source([2], [2], categories=[{'id': 5, 'name': 'traffic_light_red'}])
+    other['annotations'][0]['category_id'] = 5
+    merged = merge_coco([make_source([1], [1]), other])
+    assert len(merged['categories']) == 15
+    assert [ann['category_id'] for ann in merged['annotations']] == [92, 92]
+
+
+def test_category_id_used_by_another_name_raises(make_source):
+    other = make_source([2], [2], categories=[{'id': 92, 'name': 'red'}])
+    with pytest.raises(ValueError):
+        merge_coco([make_source([1], [1]), other])
+
+
+def test_unite_licenses_maps_equal_content():
+    records, id_maps = unite_records([[LICENSE], [dict(LICENSE, id=4)]], 'licenses')
+    assert records == [LICENSE]
+    assert id_maps == [{1: 1}, {4: 1}]
+
+
+@pytest.mark.parametrize("use_ijson", [False, True])
+def test_merge_files_matches_in_memory_merge(make_source, write_json, tmp_path, monkeypatch, use_ijson):
+    if not use_ijson:
+        monkeypatch.setattr(merge_module, 'ijson', None)
+    elif merge_module.ijson is None:
+        pytest.skip("ijson is not installed")
+    datasets = [make_source([1, 2], [1, 2], orphan=3), make_source([1], [1])]
+    paths = [write_json(dataset, "{}.json".format(i)) for i, dataset in enumerate(datasets)]
+
+    merge_coco_files(paths, str(tmp_path / "out.json"), remap="dense")
+    with open(tmp_path / "out.json") as f:
+        merged = json.load(f)
+    assert merged == merge_coco(datasets, remap="dense")
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from append_LISA_to_coco_splits import get_clip_names, split_anns
+
+
+def make_anns(frames_per_clip=5):
+    rows = []
+    for clip in ("dayClip1", "dayClip2", "dayClip3", "nightClip1", "nightClip2"):
+        for frame in range(frames_per_clip):
+            name = "{}--{:05d}.jpg".format(clip, frame)
+            rows += [{'name': name, 'label': 'go'}, {'name': name, 'label': 'stop'}]
+    return pd.DataFrame(rows)
+
+
+def test_clip_names():
+    names = pd.Series(["dayClip3--00012.jpg", "nightClip1--00001.jpg"])
+    assert list(get_clip_names(names)) == ["dayClip3", "nightClip1"]
+
+
+def test_clip_split_keeps_clips_together():
+    df = make_anns()
+    train, val = split_anns(df, split=0.6, group_by="clip")
+    train_clips = set(get_clip_names(train['name']))
+    val_clips = set(get_clip_names(val['name']))
+    assert train_clips and val_clips
+    assert not train_clips & val_clips
+    assert len(train) + len(val) == len(df)
+    assert len(train_clips) == 3
+
+
+def test_image_split_keeps_rows_of_an_image_together():
+    df = make_anns()
+    train, val = split_anns(df, split=0.8)
+    assert not set(train['name']) & set(val['name'])
+    assert train['name'].nunique() == 20
+    assert len(train) + len(val) == len(df)
+
+
+def test_split_is_reproducible():
+    df = make_anns()
+    first, _ = split_anns(df, group_by="clip")
+    second, _ = split_anns(df, group_by="clip")
+    assert first.equals(second)
+
+
+def test_unknown_group_by_raises():
+    with pytest.raises(ValueError):
+        split_anns(make_anns(), group_by="frame")
@@ -0,0 +1,79 @@
+import numpy as np
+import cv2 as cv
+import pytest
+
+from validate import check_dataset, num_errors, validate
+from make_datasets import fill_missing_area
+
+
+@pytest.fixture
+def dataset(make_coco):
+    return make_coco([1, 2, 3], [{'image_id': 1}, {'image_id': 2, 'bbox': [50, 50, 20, 10]}])
+
+
+def failed(report):
+    return {check: result['examples'] for check, result in report.items() if result['count'] > 0}
+
+
+def test_valid_dataset(dataset):
+    report = validate(dataset)
+    assert num_errors(report) == 0
+    assert failed(report) == {'images_without_annotations': [3]}
+
+
+def test_annotation_errors(dataset, make_coco):
+    anns = dataset['annotations']
+    anns += make_coco([], [
+        {'id': 3, 'image_id': 9},                            # Unknown image
+        {'id': 4, 'image_id': 1, 'category_id': 5},          # Unknown category
+        {'id': 5, 'image_id': 1, 'bbox': [0, 0, 0, 10]},     # Empty box
+        {'id': 6, 'image_id': 1, 'bbox': [95, 95, 10, 10]},  # Outside of the image
+        {'id': 7, 'image_id': 1, 'area': 50},                # Wrong area without segmentation
+        {'id': 8, 'image_id': 1, 'bbox': 'x', 'area': 1},    # Malformed box
+    ])['annotations']
+    anns.append({'id': 1, 'image_id': 2, 'category_id': 92, 'bbox': [0, 0, 10, 10], 'area': ''})
+    dataset['images'].append({'id': 1, 'file_name': 'dup.jpg', 'width': 100, 'height': 100})
+
+    assert failed(validate(dataset)) == {
+        'duplicate_image_ids': [1],
+        'duplicate_annotation_ids': [1],
+        'orphan_annotations': [3],
+        'unknown_categories': [4],
+        'invalid_boxes': [5, 8],
+        'boxes_outside_image': [6],
+        'missing_area': [1],
+        'wrong_area': [7],
+        'images_without_annotations': [1, 3],  # The first of the duplicate images
+    }
+
+
+def test_area_below_the_box_area_with_segmentation(dataset):
+    dataset['annotations'][0]['segmentation'] = [[0, 0, 10, 0, 0, 10]]
+    dataset['annotations'][0]['area'] = 50
+    assert num_errors(validate(dataset)) == 0
+
+
+def test_file_checks(dataset, tmp_path):
+    cv.imwrite(str(tmp_path / "1.jpg"), np.zeros((100, 100, 3), dtype=np.uint8))
+    cv.imwrite(str(tmp_path / "2.jpg"), np.zeros((50, 100, 3), dtype=np.uint8))
+    (tmp_path / "3.jpg").write_bytes(b'not an image')
+    for decode in (True, False):
+        report = validate(dataset, str(tmp_path), decode=decode, num_workers=2)
+        assert failed(report)['size_mismatch'] == [2]
+        assert failed(report)['broken_files'] == [3]
+    (tmp_path / "3.jpg").unlink()
+    assert failed(validate(dataset, str(tmp_path)))['missing_files'] == [3]
+
+
+def test_check_dataset_raises_on_errors(dataset):
+    check_dataset(dataset, "ok")
+    dataset['annotations'][0]['category_id'] = 5
+    with pytest.raises(ValueError):
+        check_dataset(dataset, "broken")
+
+
+def test_fill_missing_area(dataset):
+    dataset['annotations'][0]['area'] = ''
+    assert fill_missing_area(dataset, "legacy") == 1
+    assert dataset['annotations'][0]['area'] == 100
+    assert num_errors(validate(dataset)) == 0
@@ -0,0 +1,176 @@
+# =================================================================== #
+# Proposes the state of traffic lights (red, green, na) from their    #
+# crops with a colour heuristic.                                      #
+#                                                                     #
+# Features are HSV hue histograms of the bright, saturated pixels and #
+# the brightness of the top, middle and bottom third of a crop. All   #
+# features are computed with NumPy over whole batches of crops. A     #
+# softmax regression trained on relabelled crops maps them to a label #
+# and a confidence.                                                   #
+#                                                                     #
+# Input:                                                              #
+# Crop atlas from make_crop_atlas.py                                  #
+#                                                                     #
+# Output:                                                             #
+# Model weights as .npz                                               #
+# =================================================================== #
+
+import numpy as np
+
+from make_crop_atlas import CropAtlas
+
+CLASSES = np.array([92, 93, 94])  # traffic_light_red, traffic_light_green, traffic_light_na
+NUM_HUE_BINS = 12
+
+
+def bgr_to_hsv(crops):
+    """
+    Converts a batch of BGR uint8 crops to HSV.
+    Hue is in [0, 360), saturation and value in [0, 1].
+    """
+    x = crops.astype(np.float32) / 255
+    b, g, r = x[..., 0], x[..., 1], x[..., 2]
+    v = x.max(axis=-1)
+    c = v - x.min(axis=-1)
+    s = np.where(v > 0, c / np.maximum(v, 1e-6), 0)
+
+    c_safe = np.maximum(c, 1e-6)
+    h = np.where(v == r, ((g - b) / c_safe) % 6,
+        np.where(v == g, (b - r) / c_safe + 2, (r - g) / c_safe + 4))
+    h = np.where(c > 0, h * 60, 0)
+
+    return h, s, v
+
+
+def crop_features(crops, sat_min=0.35, val_min=0.5):
+    """
+    Computes the colour features of a batch of crops.
+
+    Inputs:
+    crops    - uint8 array (N, size, size, 3) in BGR.
+    sat_min  - Minimum saturation of a lit pixel.
+    val_min  - Minimum value of a lit pixel.
+
+    Returns:
+    features - float32 array (N, NUM_HUE_BINS + 4).
+    """
+    h, s, v = bgr_to_hsv(crops)
+    lit = (s >= sat_min) & (v >= val_min)
+    bins = np.minimum((h * NUM_HUE_BINS / 360).astype(np.int32), NUM_HUE_BINS - 1)
+
+    features = [(lit & (bins == k)).mean(axis=(1, 2)) for k in range(NUM_HUE_BINS)]
+    features.append(lit.mean(axis=(1, 2)))
+
+    # Red lights are on top and green lights at the bottom of a vertical light
+    thirds = np.array_split(np.arange(v.shape[1]), 3)
+    for rows in thirds:
+        features.append(v[:, rows].mean(axis=(1, 2)))
+
+    return np.stack(features, axis=1).astype(np.float32)
+
+
+class LightStateClassifier:
+    """
+    Softmax regression on crop_features.
+    """
+    def __init__(self):
+        self.mean = None
+        self.std = None
+        self.weights = None
+
+    def _scores(self, features):
+        z = (features - self.mean) / self.std
+        scores = z @ self.weights[:-1] + self.weights[-1]
+        scores -= scores.max(axis=1, keepdims=True)
+        p = np.exp(scores)
+        return p / p.sum(axis=1, keepdims=True)
+
+    def fit(self, crops, category_ids, epochs=500, lr=0.5, l2=1e-3):
+        """
+        Trains the model on crops labelled 92, 93 or 94.
+        """
+        features = crop_features(crops)
+        targets = np.searchsorted(CLASSES, category_ids)
+        self.mean = features.mean(axis=0)
+        self.std = features.std(axis=0) + 1e-6
+        self.weights = np.zeros((features.shape[1] + 1, len(CLASSES)), dtype=np.float32)
+
+        z = (features - self.mean) / self.std
+        onehot = np.eye(len(CLASSES), dtype=np.float32)[targets]
+        for _ in range(epochs):
+            grad = self._scores(features) - onehot
+            self.weights[:-1] -= lr * (z.T @ grad / len(z) + l2 * self.weights[:-1])
+            self.weights[-1] -= lr * grad.mean(axis=0)
+
+        return self
+
+    def predict(self, crops, batch_size=2048):
+        """
+        Returns the proposed category id and its probability for each crop.
+        """
+        labels = []
+        confidence = []
+        for start in range(0, len(crops), batch_size):
+            p = self._scores(crop_features(np.asarray(crops[start:start+batch_size])))
+            labels.append(CLASSES[p.argmax(axis=1)])
+            confidence.append(p.max(axis=1))
+        if not labels:
+            return np.zeros(0, dtype=CLASSES.dtype), np.zeros(0, dtype=np.float32)
+        return np.concatenate(labels), np.concatenate(confidence)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, std=self.std, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        model = cls()
+        data = np.load(path)
+        model.mean, model.std, model.weights = data['mean'], data['std'], data['weights']
+        return model
+
+
+def propose_labels(model, atlas, ann_ids):
+    """
+    Proposes labels for the annotations in the atlas.
+
+    Returns:
+    proposals - Dictionary annotation id -> (category id, confidence).
+    """
+    ann_ids = [ann_id for ann_id in ann_ids if ann_id in atlas]
+    rows = np.array([atlas.ann_id_to_row[ann_id] for ann_id in ann_ids], dtype=np.int64)
+    order = np.argsort(rows)  # Read the memory map in file order
+    labels, confidence = model.predict(atlas.crops[rows[order]])
+
+    proposals = dict()
+    for i, j in enumerate(order):
+        proposals[ann_ids[j]] = (int(labels[i]), float(confidence[i]))
+    return proposals
+
+
+def train_from_atlas(atlas_path, model_path, val_split=0.2):
+    """
+    Trains a model on the relabelled crops of an atlas and saves it.
+    """
+    atlas = CropAtlas(atlas_path)
+    category_ids = np.array(atlas.category_ids)
+    rows = np.flatnonzero(np.isin(category_ids, CLASSES))
+
+    rng = np.random.RandomState(1881)
+    rng.shuffle(rows)
+    num_val = int(len(rows) * val_split)
+    rows_val, rows_train = np.sort(rows[:num_val]), np.sort(rows[num_val:])
+
+    model = LightStateClassifier().fit(atlas.crops[rows_train], category_ids[rows_train])
+    for name, split_rows in (("train", rows_train), ("val", rows_val)):
+        labels, _ = model.predict(atlas.crops[split_rows])
+        print("Accuracy {}: {:.3f} ({} crops)".format(name, (labels == category_ids[split_rows]).mean(), len(split_rows)))
+
+    model.save(model_path)
+    print("Saved model to {}.".format(model_path))
+
+
+if __name__ == "__main__":
+    dataType = "Traffic"
+    atlasPath = "../../annotations/crops_{}".format(dataType)
+    modelPath = "../../annotations/light_state.npz"
+    train_from_atlas(atlasPath, modelPath)
@@ -0,0 +1,142 @@
+# =================================================================== #
+# Builds an atlas of fixed size crops around the traffic lights of a  #
+# COCO annotation file.                                               #
+#                                                                     #
+# Input:                                                              #
+# COCO annotation file and the folder with its images.                #
+#                                                                     #
+# Output:                                                             #
+# <name>.npy        - uint8 array (N, size, size, 3), BGR crops        #
+# <name>_index.json - Annotation id, image id and category per crop   #
+#                                                                     #
+# The .npy file is opened memory-mapped, so single crops are read     #
+# without loading the atlas.                                          #
+# =================================================================== #
+
+import os
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2 as cv
+
+TRAFFIC_LIGHT_CATEGORIES = [10, 92, 93, 94]
+
+
+def crop_box(image, bbox, size, pad):
+    """
+    Crops a square around a COCO box and resizes it to size x size.
+    The square is the longer box side plus pad times that side on every
+    side. Parts outside of the image are filled with black.
+    """
+    x, y, w, h = bbox
+    side = max(w, h) * (1 + 2 * pad)
+    side = max(int(round(side)), 1)
+    x0 = int(round(x + 0.5 * w - 0.5 * side))
+    y0 = int(round(y + 0.5 * h - 0.5 * side))
+
+    img_h, img_w = image.shape[:2]
+    crop = np.zeros((side, side, 3), dtype=np.uint8)
+    sx0, sy0 = max(x0, 0), max(y0, 0)
+    sx1, sy1 = min(x0 + side, img_w), min(y0 + side, img_h)
+    if sx1 > sx0 and sy1 > sy0:
+        crop[sy0-y0:sy1-y0, sx0-x0:sx1-x0] = image[sy0:sy1, sx0:sx1]
+
+    return cv.resize(crop, (size, size), interpolation=cv.INTER_AREA)
+
+
+def make_crop_atlas(ann_file, img_dir, atlas_path, categories=TRAFFIC_LIGHT_CATEGORIES,
+                    size=64, pad=0.25, num_workers=8):
+    """
+    Extracts crops for all annotations of the given categories in parallel
+    and stores them in a memory-mapped atlas.
+
+    Inputs:
+    ann_file    - Path to the COCO annotation file.
+    img_dir     - Folder with the images.
+    atlas_path  - Output path without extension.
+    categories  - Category ids to crop.
+    size        - Side length of the crops in pixels.
+    pad         - Padding around the box as fraction of the longer side.
+    num_workers - Number of threads.
+    """
+    with open(ann_file, 'r') as f:
+        dataset = json.load(f)
+
+    images = {img['id']: img for img in dataset['images']}
+    anns = [ann for ann in dataset['annotations'] if ann['category_id'] in categories]
+    del dataset
+
+    # Rows of the atlas per image, so each image is decoded once
+    rows_per_image = defaultdict(list)
+    for row, ann in enumerate(anns):
+        rows_per_image[ann['image_id']].append(row)
+
+    crops = np.lib.format.open_memmap(atlas_path + '.npy', mode='w+', dtype=np.uint8,
+                                      shape=(len(anns), size, size, 3))
+
+    def process(img_id):
+        image = cv.imread(os.path.join(img_dir, images[img_id]['file_name']))
+        if image is None:
+            return img_id
+        for row in rows_per_image[img_id]:
+            crops[row] = crop_box(image, anns[row]['bbox'], size, pad)
+        return None
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        missing = [img_id for img_id in executor.map(process, rows_per_image) if img_id is not None]
+    crops.flush()
+    del crops
+
+    index = {
+        'size': size,
+        'pad': pad,
+        'ann_ids': [ann['id'] for ann in anns],
+        'image_ids': [ann['image_id'] for ann in anns],
+        'category_ids': [ann['category_id'] for ann in anns]
+    }
+    with open(atlas_path + '_index.json', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+    print("Saved {} crops from {} images to {}.npy.".format(len(anns), len(rows_per_image), atlas_path))
+    if missing:
+        print("Unable to read {} images, their crops are black, e.g. {}".format(len(missing), missing[:5]))
+
+
+class CropAtlas:
+    """
+    Read access to an atlas written by make_crop_atlas.
+    """
+    def __init__(self, atlas_path):
+        self.crops = np.load(atlas_path + '.npy', mmap_mode='r')
+        with open(atlas_path + '_index.json', 'r') as f:
+            index = json.load(f)
+        self.size = index['size']
+        self.ann_ids = index['ann_ids']
+        self.image_ids = index['image_ids']
+        self.category_ids = index['category_ids']
+        self.ann_id_to_row = {ann_id: row for row, ann_id in enumerate(self.ann_ids)}
+
+    def __len__(self):
+        return len(self.ann_ids)
+
+    def __contains__(self, ann_id):
+        return ann_id in self.ann_id_to_row
+
+    def get(self, ann_id):
+        # Returns the crop of an annotation as (size, size, 3) uint8 array
+        return self.crops[self.ann_id_to_row[ann_id]]
+
+    def get_many(self, ann_ids):
+        # Returns the crops of several annotations as (n, size, size, 3) array
+        rows = [self.ann_id_to_row[ann_id] for ann_id in ann_ids]
+        return self.crops[rows]
+
+
+if __name__ == "__main__":
+    dataType = "Traffic"
+    annFile = "../../annotations/instances_{}.json".format(dataType)
+    imgDir = "../../images/{}/".format(dataType)
+    atlasPath = "../../annotations/crops_{}".format(dataType)
+    make_crop_atlas(annFile, imgDir, atlasPath)
@@ -1,10 +1,21 @@
 from pycocotools.coco import COCO
 import numpy as np
-import skimage.io as io
-import matplotlib.pyplot as plt
-import pylab
 import json
+import os
+import time
 import cv2 as cv
+import atexit
+import sys
+from image_cache import ImagePrefetcher
+from grid_review import GridReview
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../cropAtlas"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../api"))
+from make_crop_atlas import CropAtlas, crop_box
+from light_state import LightStateClassifier, propose_labels
+from instrument import timed
+from box_query import BoxIndex
+from coco_store import CocoStore
 
 # Import annotations (check)
 # Create loop to loop through images (check)
@@ -17,6 +28,7 @@ import cv2 as cv
 # Import tags (check)
 # Print progress (check)
 
+@timed()
 def load_ann(filepath, saveFile):
     try:
         coco = COCO(saveFile + ".json")
@@ -29,6 +41,21 @@ def load_ann(filepath, saveFile):
             return coco
         except IOError:
             raise Exception("Could not find original file")
+
+
+@timed()
+def load_store(filepath, saveFile):
+    # Opens the annotation store <saveFile>.sqlite. A new store is filled from
+    # the previous session if there is one, otherwise from the original file.
+    store = CocoStore(saveFile + ".sqlite")
+    if store.is_empty():
+        store.import_coco(saveFile + ".json" if os.path.isfile(saveFile + ".json") else filepath)
+    else:
+        print("Previous session found. Reloading relabelled annotations from the store")
+    coco = COCO()
+    coco.dataset = store.to_dataset()
+    coco.createIndex()
+    return coco, store
     
 
 
@@ -50,7 +77,7 @@ def save_point(target_filepath, imgId):
     with open(target_filepath + ".json", 'w') as f:
         json.dump(imgId, f)
 
-def load_point(filepath, anns):
+def load_point(filepath, img_to_pos):
     try:
         with open(filepath + ".json", 'r') as f:
             imgId = str(json.load(f)).rstrip()
@@ -62,14 +89,38 @@ def load_point(filepath, anns):
         print("Previous session completed going through all annotations. Starting from beginning")
         return 0
     
-    for i in range(len(anns)):
-        if str(imgId) == str(anns[i]['image_id']):
-            return i
+    if imgId in img_to_pos:
+        return img_to_pos[imgId]
 
     print("Unable to find matching image id in annotations. Starting from beginning")
     return 0
 
 
+@timed()
+def build_review_queue(coco, cat_show, ann_ids=None):
+    # Returns the annotations with categories in cat_show grouped by image in
+    # the order of the images in the file, and a map from image id (as string)
+    # to the position of its first annotation in the queue.
+    # ann_ids restricts the queue further, e.g. to the result of a box query.
+    target_imgs = set()
+    for cat_id in cat_show:
+        target_imgs.update(coco.catToImgs.get(cat_id, []))
+
+    queue = []
+    img_to_pos = dict()
+    for img_id in coco.imgs:
+        if img_id not in target_imgs:
+            continue
+        anns = [ann for ann in coco.imgToAnns[img_id] if ann['category_id'] in cat_show
+                and (ann_ids is None or ann['id'] in ann_ids)]
+        if not anns:
+            continue
+        img_to_pos[str(img_id)] = len(queue)
+        queue += anns
+
+    return queue, img_to_pos
+
+
 def box_xywh_to_xyxy(x):
     # Converts bounding boxes to (x1, y1, x2, y2) coordinates of top left and bottom right corners
     x_c, y_c, w, h = x
@@ -80,32 +131,162 @@ def box_xywh_to_xyxy(x):
     return box
 
 
-def save_dataset(original_filepath, target_filepath, anns, cats):
-
-    # Load dataset val to get structure
-    orig_file = json.load(open(original_filepath, 'r'))
-
-    # Make final dictionary
-    dataset = dict.fromkeys(orig_file.keys())
-    dataset['info'] = orig_file['info']
-    dataset['licenses'] = orig_file['licenses']
+@timed()
+def save_dataset(base_dataset, target_filepath, anns, cats):
+    # Writes the full annotation file. info, licenses and images are taken from
+    # the dataset loaded at startup. The file is replaced atomically.
+    dataset = dict.fromkeys(base_dataset.keys())
+    dataset['info'] = base_dataset.get('info')
+    dataset['licenses'] = base_dataset.get('licenses')
     dataset['categories'] = cats
     dataset['annotations'] = anns
-    dataset['images'] = orig_file['images']
+    dataset['images'] = base_dataset['images']
 
-    with open(target_filepath + '.json', 'w', encoding='utf-8') as f:
-        json.dump(dataset, f, ensure_ascii=False, indent=4)
+    with open(target_filepath + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, ensure_ascii=False)
+    os.replace(target_filepath + '.json.tmp', target_filepath + '.json')
 
     print('Saved dataset {}.json to disk!'.format(target_filepath))
 
 
-if __name__ == "__main__":
-    cat_show = [10, 92, 93, 94]  # Categories ids that you want shown and relabelled
-    #cat_show = [10]  # Categories ids that you want shown and relabelled
+def open_journal(filepath):
+    # Opens the edit journal for appending
+    return open(filepath + ".jsonl", 'a', encoding='utf-8')
+
 
-    # COCO dataset path
-    dataDir = ".."
-    dataType = "Traffic"
+def set_category(journal, ann, category_id):
+    # Changes the category of an annotation and records the change in the journal.
+    # Entries are [annotation id, old category, new category, timestamp].
+    entry = [ann['id'], ann['category_id'], category_id, time.time()]
+    journal.write(json.dumps(entry) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+    ann['category_id'] = category_id
+
+
+@timed()
+def replay_journal(filepath, coco):
+    # Applies the changes in the journal to the loaded annotations
+    try:
+        f = open(filepath + ".jsonl", 'r')
+    except IOError:
+        return 0
+
+    count = 0
+    with f:
+        for line in f:
+            try:
+                ann_id, _, category_id, _ = json.loads(line)
+            except ValueError:
+                print("Skipping incomplete journal entry.")
+                continue
+            if ann_id in coco.anns:
+                coco.anns[ann_id]['category_id'] = category_id
+                count += 1
+    if count > 0:
+        print("Replayed {} label changes from the journal.".format(count))
+    return count
+
+
+def compact_journal(journal, base_dataset, target_filepath, anns, cats, store=None):
+    # Folds the journal into the annotation file and empties the journal.
+    # With a store only the changed annotations are written, in one transaction.
+    if store is None:
+        save_dataset(base_dataset, target_filepath, anns, cats)
+    else:
+        journal.flush()
+        changes = dict()
+        with open(journal.name, 'r') as f:
+            for line in f:
+                try:
+                    ann_id, _, category_id, _ = json.loads(line)
+                except ValueError:
+                    continue
+                changes[ann_id] = category_id
+        store.upsert_categories(cats)
+        count = store.update_categories(changes.items())
+        print('Saved {} label changes to {}.'.format(count, store.path))
+    journal.truncate(0)
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def discard_journal(journal):
+    # Empties the journal when the user declines to save, so the labels of
+    # this session are not replayed on the next start
+    journal.truncate(0)
+    journal.flush()
+    os.fsync(journal.fileno())
+    print("Discarded the unsaved labels.")
+
+
+def image_path(img_dir, img_id):
+    # Path of the image file for an image id
+    return img_dir + (str(img_id)+'.jpg').zfill(16)
+
+
+def load_atlas(atlas_path):
+    # Loads the crop atlas if it exists, see tools/cropAtlas
+    if not os.path.isfile(atlas_path + '.npy'):
+        return None
+    atlas = CropAtlas(atlas_path)
+    print("Loaded {} traffic light crops from {}.npy".format(len(atlas), atlas_path))
+    return atlas
+
+
+def order_by_confidence(queue, proposals, apply_fn, accept_above=None):
+    # Sorts the images of the queue so that those with the least confident
+    # proposal come first. The annotations of an image stay together and in
+    # order, so the progress file can resume at an image.
+    # Traffic lights still labelled 10 whose proposal is at least accept_above
+    # are labelled through apply_fn and removed from the queue.
+    # Returns the new queue and its image id to position map.
+    accepted = 0
+    groups = dict()  # Image id -> [lowest confidence, annotations], in queue order
+    for ann in queue:
+        label, conf = proposals.get(ann['id'], (None, -1.0))
+        if accept_above is not None and ann['category_id'] == 10 and label is not None and conf >= accept_above:
+            apply_fn(ann, label)
+            accepted += 1
+            continue
+        group = groups.setdefault(ann['image_id'], [conf, []])
+        group[0] = min(group[0], conf)
+        group[1].append(ann)
+    if accept_above is not None:
+        print("Accepted {} proposed labels with confidence >= {}.".format(accepted, accept_above))
+
+    queue = []
+    img_to_pos = dict()
+    for img_id, (_, anns) in sorted(groups.items(), key=lambda x: x[1][0]):
+        img_to_pos[str(img_id)] = len(queue)
+        queue += anns
+    return queue, img_to_pos
+
+
+def neighbour_images(queue, pos, num_next=8, num_prev=2):
+    # Returns the ids of the next num_next and previous num_prev images
+    # in the review queue, nearest first.
+    img_ids = []
+    for step, num in ((1, num_next), (-1, num_prev)):
+        found = []
+        i = pos + step
+        while 0 <= i < len(queue) and len(found) < num:
+            img_id = queue[i]['image_id']
+            if img_id not in found and img_id != queue[pos]['image_id']:
+                found.append(img_id)
+            i += step
+        img_ids += found
+    return img_ids
+
+
+def run(dataDir="..", dataType="Traffic", cat_show=(10, 92, 93, 94), grid_mode=False, accept_above=None, query=None,
+        use_store=False):
+    # Relabels <dataDir>/annotations/instances_<dataType>.json with the images in <dataDir>/images/<dataType>/
+    # cat_show      - Categories ids that you want shown and relabelled, e.g. (10,)
+    # grid_mode     - Review a grid of crops with single keypresses instead of one annotation at a time
+    # accept_above  - Accept proposed labels with at least this confidence without review, e.g. 0.95
+    # query         - Only review the annotations matching a box query, e.g. "width<8 source=lisa", see api/box_query.py
+    # use_store     - Keep the relabelled annotations in <saveFile>.sqlite instead of rewriting <saveFile>.json on save
 
     # Annotations file  
     annDir = "annotations"
@@ -113,8 +294,11 @@ if __name__ == "__main__":
 
     # Save file
     saveFile = dataDir + '/' + annDir + '/instances_' + dataType + 'Relabelled'
+    journalFile = saveFile + 'Journal'
     tagFile = dataDir + '/' + annDir + "/labelTool/" + '/instances_' + dataType + 'Tagged'
     progressFile = dataDir + '/' + annDir + "/labelTool/" + '/instances_' + dataType + 'LastSave'
+    atlasPath = dataDir + '/' + annDir + '/crops_' + dataType
+    modelFile = dataDir + '/' + annDir + '/light_state.npz'
 
     # Images folder
     imgDir = dataDir + '/images/' + dataType + '/'
@@ -122,7 +306,13 @@ if __name__ == "__main__":
     # Import from annotations file
     
 
-    coco=load_ann(annFile, saveFile)
+    store = None
+    if use_store:
+        coco, store = load_store(annFile, saveFile)
+    else:
+        coco=load_ann(annFile, saveFile)
+    replay_journal(journalFile, coco)
+    journal = open_journal(journalFile)
 
     cats = coco.loadCats(coco.getCatIds())
 
@@ -139,29 +329,53 @@ if __name__ == "__main__":
     nms = [cat['name'] for cat in cats]
     catId_to_catName = {cats[x]['id']: cats[x]['name'] for x in range(len(cats))}
 
-    # Load image Ids
-    catIds = coco.getCatIds(catNms=nms)
-    imgIdsAll = coco.getImgIds()
-    imgIds = imgIdsAll
-    print('Number of images: ' + str(len(imgIds)))
-
-    # Load annotations
-    annIds = coco.getAnnIds(imgIds)
-    anns = coco.loadAnns(annIds)
-    print('Number of annotations: ' + str(len(anns)))
+    # Build the queue of annotations to review
+    print('Number of images: ' + str(len(coco.imgs)))
+    print('Number of annotations: ' + str(len(coco.anns)))
+    ann_ids = None
+    if query is not None:
+        ann_ids, _ = BoxIndex(coco.dataset).query(query)
+        print('Query "{}" matched {} annotations.'.format(query, len(ann_ids)))
+    anns, img_to_pos = build_review_queue(coco, cat_show, ann_ids)
+    print('Number of annotations to review: {} in {} images'.format(len(anns), len(img_to_pos)))
+
+    # Review the least confident proposals first, see tools/cropAtlas/light_state.py
+    atlas = load_atlas(atlasPath)  # Enlarged crop of the current traffic light, optional
+    if atlas is not None and os.path.isfile(modelFile):
+        proposals = propose_labels(LightStateClassifier.load(modelFile), atlas, [ann['id'] for ann in anns])
+        anns, img_to_pos = order_by_confidence(anns, proposals, lambda ann, category_id: set_category(journal, ann, category_id), accept_above)
+        print('Sorted {} annotations by confidence of the proposed label.'.format(len(anns)))
 
     # Initialize variables
-    annId_i = load_point(progressFile, anns)
+    annId_i = load_point(progressFile, img_to_pos)
     go_backwards = False
     ann_counter = 0  # To tell user how many annotations are left
     save_flag = False
     tagged_images = load_tagged(tagFile)  # (Set) of saved tagged images
+    prefetcher = ImagePrefetcher(capacity=32, num_workers=4)  # Decodes upcoming images in the background
+    atexit.register(prefetcher.report)
+
+    if grid_mode:
+        def get_crop(ann):
+            if atlas is not None and ann['id'] in atlas:
+                return atlas.get(ann['id'])
+            prefetcher.prefetch([(ann['image_id'], image_path(imgDir, ann['image_id']))])
+            image = prefetcher.get(ann['image_id'], image_path(imgDir, ann['image_id']))
+            return None if image is None else crop_box(image, ann['bbox'], 96, 0.25)
+
+        grid = GridReview(anns, get_crop, lambda ann, category_id: set_category(journal, ann, category_id), start=annId_i)
+        annId_i = grid.run()
+        cv.destroyAllWindows()
+        save_tagged(tagFile, tagged_images)
+        save_point(progressFile, anns[annId_i]['image_id'] if annId_i < len(anns) else -1)
+        compact_journal(journal, coco.dataset, saveFile, coco.dataset['annotations'], cats, store)
+        exit()
 
     print("The available commands are as follows: (save), (q) quit, (z) back, (tag) tag image, () skip, (1)(r) label red, (2)(g) label green, (3)(n) label na, (0)(-) label back to traffic light")
     print("Type help to repeat these commands")
     
     # Main loop
-    while annId_i < len(annIds):
+    while annId_i < len(anns):
 
         if annId_i < 0:
             print("You have reached the beginning")
@@ -176,9 +390,10 @@ if __name__ == "__main__":
             ann_counter += 1
             print()
 
-            image = cv.imread(imgDir + (str(imgId)+'.jpg').zfill(16))
+            prefetcher.prefetch([(i, image_path(imgDir, i)) for i in neighbour_images(anns, annId_i)])
+            image = prefetcher.get(imgId, image_path(imgDir, imgId))
             if image is None:
-                raise Exception("Error: Cannot find image {}".format(imgDir + (str(imgId)+'.jpg').zfill(16)))
+                raise Exception("Error: Cannot find image {}".format(image_path(imgDir, imgId)))
             
             # Give progress status
             if ann_counter >= 10:
@@ -195,6 +410,8 @@ if __name__ == "__main__":
             offset = 2  # offset bounding boxes to better see object inside
             image_bboxed = cv.rectangle(image, (box[0]-offset, box[1]-offset), (box[2]+offset, box[3]+offset), (252, 3, 219), 2)
             cv.imshow((str(imgId)+'.jpg'), image)
+            if atlas is not None and ann['id'] in atlas:
+                cv.imshow("crop", cv.resize(np.asarray(atlas.get(ann['id'])), (256, 256), interpolation=cv.INTER_NEAREST))
             if cv.waitKey(1) == ord("q"):
                 break
             
@@ -209,7 +426,7 @@ if __name__ == "__main__":
                     if save_flag == False:
                         inp = str(input("You haven't saved. Are you sure? (y/n)\n")).rstrip().lower()
                         if inp in ['yes', 'y']:
-                            print("Labels not saved")
+                            discard_journal(journal)
                             exit()
                     else:
                         exit()
@@ -219,26 +436,26 @@ if __name__ == "__main__":
                 elif inp == "save":
                     save_tagged(tagFile, tagged_images)
                     save_point(progressFile, imgId)
-                    save_dataset(annFile, saveFile, anns, cats)
+                    compact_journal(journal, coco.dataset, saveFile, coco.dataset['annotations'], cats, store)
                     save_flag = True
                 elif inp == "tag":
                     tagged_images.add((str(imgId)+'.jpg').zfill(16))
                     print("Added tagged image. Make sure to save to save the tag.")
                 elif (inp == "r") or (inp == "1"):
                     print("Changed category id to traffic_light_red")
-                    anns[annId_i]['category_id'] = 92
+                    set_category(journal, anns[annId_i], 92)
                     break
                 elif (inp == "g") or (inp == "2"):
                     print("Changed category id to traffic_light_green")
-                    anns[annId_i]['category_id'] = 93
+                    set_category(journal, anns[annId_i], 93)
                     break
                 elif (inp == "n") or (inp == "3"):
                     print("Changed category id to traffic_light_na")
-                    anns[annId_i]['category_id'] = 94
+                    set_category(journal, anns[annId_i], 94)
                     break
                 elif (inp == "-") or (inp == "0"):
                     print("Changed category id back to traffic light")
-                    anns[annId_i]['category_id'] = 10
+                    set_category(journal, anns[annId_i], 10)
                     break
                 else:
                     print("Invalid command")
@@ -261,12 +478,14 @@ if __name__ == "__main__":
         if inp in ['yes', 'y']:
             save_tagged(tagFile, tagged_images)
             save_point(progressFile, -1)
-            save_dataset(annFile, saveFile, anns, cats)
+            compact_journal(journal, coco.dataset, saveFile, coco.dataset['annotations'], cats, store)
             exit()
         elif inp in ['no', 'n']:
             inp = str(input("Are you sure?(y/n)\n")).rstrip().lower()
             if inp in ['yes', 'y']:
-                print("Labels not saved")
+                discard_journal(journal)
                 exit()
 
 
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,164 @@
+import numpy as np
+import cv2 as cv
+
+# Single keypresses to category ids
+GRID_LABEL_KEYS = {'r': 92, '1': 92, 'g': 93, '2': 93, 'n': 94, '3': 94, '-': 10, '0': 10}
+
+# Tile border colours (BGR) per category id
+GRID_COLOURS = {10: (255, 255, 255), 92: (0, 0, 255), 93: (0, 200, 0), 94: (160, 160, 160)}
+
+GRID_HELP = "Grid commands: (r)(1) red, (g)(2) green, (n)(3) na, (-)(0) traffic light, " \
+            "(a)(d)(w)(s) move, (space) skip, (u) undo, (enter)(c) commit page, (b) previous page, (q) commit and quit"
+
+
+def scripted_keys(keys):
+    """
+    Returns a key_fn which plays back the given keys, e.g. "rrg\nq", and
+    then None. Used to drive GridReview without a display.
+    """
+    keys = iter(keys)
+    return lambda: next(keys, None)
+
+
+class GridReview:
+    """
+    Shows a page of traffic light crops as a grid in a single window.
+    Label keys change the selected tile and move on to the next one.
+    Changes of a page are kept as pending and applied at once through
+    apply_fn(ann, category_id) when the page is committed.
+
+    get_crop(ann) returns a BGR crop for an annotation. show_fn and key_fn
+    default to OpenCV and can be replaced to drive the grid headless.
+    """
+    def __init__(self, queue, get_crop, apply_fn, rows=4, cols=6, tile=96, start=0,
+                 show_fn=None, key_fn=None):
+        self.queue = queue
+        self.get_crop = get_crop
+        self.apply_fn = apply_fn
+        self.rows = rows
+        self.cols = cols
+        self.tile = tile
+        self.page_size = rows * cols
+        self.page_start = start - start % self.page_size
+        self.selected = 0
+        self.pending = dict()  # Queue position -> new category id
+        self.history = []  # (queue position, previous pending id or None, selected tile) per label key
+        self.show_fn = show_fn if show_fn is not None else self._show
+        self.key_fn = key_fn if key_fn is not None else self._key
+
+    @staticmethod
+    def _show(canvas):
+        cv.imshow("grid", canvas)
+
+    @staticmethod
+    def _key():
+        key = cv.waitKey(0) & 0xFF
+        return '\n' if key in (10, 13) else chr(key)
+
+    def page(self):
+        # Queue positions on the current page
+        return list(range(self.page_start, min(self.page_start + self.page_size, len(self.queue))))
+
+    def category(self, pos):
+        return self.pending.get(pos, self.queue[pos]['category_id'])
+
+    def render(self):
+        """
+        Returns the current page as BGR image.
+        """
+        t = self.tile
+        canvas = np.zeros((self.rows * t, self.cols * t, 3), dtype=np.uint8)
+        for i, pos in enumerate(self.page()):
+            y, x = (i // self.cols) * t, (i % self.cols) * t
+            crop = self.get_crop(self.queue[pos])
+            if crop is not None:
+                canvas[y:y+t, x:x+t] = cv.resize(np.asarray(crop), (t, t), interpolation=cv.INTER_NEAREST)
+            colour = GRID_COLOURS.get(self.category(pos), (255, 0, 255))
+            cv.rectangle(canvas, (x, y), (x + t - 1, y + t - 1), colour, 2)
+            if i == self.selected:
+                cv.rectangle(canvas, (x + 4, y + 4), (x + t - 5, y + t - 5), (0, 255, 255), 2)
+            if pos in self.pending:
+                cv.putText(canvas, "*", (x + 4, y + 16), cv.FONT_HERSHEY_SIMPLEX, 0.5, colour, 1)
+        return canvas
+
+    def commit(self):
+        """
+        Applies the pending changes of the page and returns their number.
+        """
+        count = 0
+        for pos, category_id in sorted(self.pending.items()):
+            if self.queue[pos]['category_id'] != category_id:
+                self.apply_fn(self.queue[pos], category_id)
+                count += 1
+        self.pending.clear()
+        self.history.clear()
+        return count
+
+    def undo(self):
+        """
+        Reverts the last label change of the page and selects its tile again.
+        """
+        if not self.history:
+            return
+        pos, previous, self.selected = self.history.pop()
+        if previous is None:
+            del self.pending[pos]
+        else:
+            self.pending[pos] = previous
+
+    def move(self, step):
+        self.selected = min(max(self.selected + step, 0), len(self.page()) - 1)
+
+    def turn_page(self, step):
+        # Commits the page and moves step pages forward or back.
+        # Returns False once the end of the queue is reached.
+        count = self.commit()
+        print("Committed {} label changes on page {}.".format(count, self.page_start // self.page_size + 1))
+        self.page_start = max(self.page_start + step * self.page_size, 0)
+        self.selected = 0
+        return self.page_start < len(self.queue)
+
+    def handle_key(self, key):
+        """
+        Handles a single key. Returns False when the review should stop.
+        """
+        if key in GRID_LABEL_KEYS:
+            pos = self.page()[self.selected]
+            self.history.append((pos, self.pending.get(pos), self.selected))
+            self.pending[pos] = GRID_LABEL_KEYS[key]
+            if self.selected < len(self.page()) - 1:
+                self.selected += 1
+        elif key == 'u':
+            self.undo()
+        elif key == ' ' or key == 'd':
+            self.move(1)
+        elif key == 'a':
+            self.move(-1)
+        elif key == 's':
+            self.move(self.cols)
+        elif key == 'w':
+            self.move(-self.cols)
+        elif key in ('\n', 'c'):
+            return self.turn_page(1)
+        elif key == 'b':
+            self.turn_page(-1)
+        elif key == 'q':
+            self.commit()
+            return False
+        elif key == 'h':
+            print(GRID_HELP)
+        return True
+
+    def run(self):
+        """
+        Runs the review until q is pressed or the queue is done.
+        If key_fn returns None the review stops without committing the page.
+        Returns the queue position of the current page.
+        """
+        print(GRID_HELP)
+        while self.page_start < len(self.queue):
+            self.show_fn(self.render())
+            key = self.key_fn()
+            if key is None or not self.handle_key(key):
+                break
+        return self.page_start
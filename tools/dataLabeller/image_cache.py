@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+
+class ImagePrefetcher:
+    """
+    Decodes images on worker threads into a bounded LRU cache keyed by image id.
+
+    Call prefetch() with the images around the current position and get()
+    for the image to show. get() returns a copy, so drawing on it does not
+    change the cached image.
+    """
+    def __init__(self, capacity=32, num_workers=4, load_fn=cv.imread):
+        self.capacity = capacity
+        self.load_fn = load_fn
+        self.cache = OrderedDict()
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, key, image):
+        # Adds an image and evicts the least recently used ones
+        with self.lock:
+            self.pending.pop(key, None)
+            if image is None:
+                return
+            self.cache[key] = image
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    def _load(self, key, path):
+        image = self.load_fn(path)
+        self._store(key, image)
+        return image
+
+    def prefetch(self, items):
+        """
+        Schedules decoding of the given (image id, path) pairs.
+        """
+        with self.lock:
+            for key, path in items:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                elif key not in self.pending:
+                    self.pending[key] = self.executor.submit(self._load, key, path)
+
+    def get(self, key, path):
+        """
+        Returns a copy of the decoded image, or None if it cannot be read.
+        """
+        with self.lock:
+            image = self.cache.get(key)
+            if image is not None:
+                self.cache.move_to_end(key)
+            future = self.pending.get(key)
+
+        if image is not None:
+            self.hits += 1
+        elif future is not None:
+            # Already being decoded, wait for the worker
+            self.hits += 1
+            image = future.result()
+        else:
+            self.misses += 1
+            image = self._load(key, path)
+
+        return None if image is None else image.copy()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def report(self):
+        print("Image cache: {} hits, {} misses, hit rate {:.1%}".format(self.hits, self.misses, self.hit_rate()))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -5,10 +5,22 @@
 # =================================================================== #
 
 import pandas as pd
+import numpy as np
 import os
 from shutil import copyfile
-import random
 import json
+import sys
+import gc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../api"))
+from image_meta import probe_directory
+from merge_coco import merge_coco_files
+from instrument import timed
+from validate import check_dataset
+from class_subsets import CATEGORIES, CATEGORY_IDS
+from dedup_lisa import dedup_frames, print_report
 
 
 def get_diff(l1, l2):
@@ -20,19 +32,14 @@ def get_diff(l1, l2):
     return diff
 
 
-def load_LISA_annotations(makesense_annotation_files):
+@timed()
+def load_LISA_annotations(makesense_annotation_files, makesense_path="./relabelled/"):
     """
     Loads all makesense.ai .csv files into a single pandas dataframe.
     """
-    makesense_path = "./relabelled/"
     cols = ["label", "x", "y", "w", "h", "name", "size_w", "size_h"]
-    makesense_anns = pd.DataFrame(columns=cols)
-
-    for file in makesense_annotation_files:
-        anns_part = pd.read_csv(makesense_path+file, names=cols)
-        makesense_anns = makesense_anns.append(anns_part)
-
-    makesense_anns.reset_index(inplace=True)
+    makesense_anns = pd.concat([pd.read_csv(makesense_path+file, names=cols)
+                                for file in makesense_annotation_files], ignore_index=True)
 
     return makesense_anns
 
@@ -53,58 +60,170 @@ def filter_lisa_anns(anns):
     return image_names
     
  
-def copy_images_from_lisa(img_filenames, path_source):
+def build_lisa_index(path_source, index_file=None):
     """
-    Copies the images in the given list from the dataset folders
-    as downloaded into a single  folder.
+    Walks the LISA dataset tree once and maps every image filename to its
+    absolute path. If index_file is given the index is saved there as .json
+    and reused on later runs for the same dataset folder.
+
+    Inputs:
+    path_source - Root folder of the LISA dataset as downloaded.
+    index_file  - Optional path of the persisted index.
+
+    Returns:
+    index       - Dictionary filename -> absolute path.
     """
-    count = 0
-    for filename in img_filenames:
-    
-        if filename.find("Clip") != -1:
-            folder_name = filename.split('--')[0].replace("Clip", "Train")
-            folder_name = "".join(filter(lambda x: not x.isdigit(), folder_name))
-            # Format: nightTrain/nightTrain/nightClip2/frames/nightClip2--...
-            path = path_source + folder_name + "/" + folder_name + "/" + filename.split('--')[0] +"/frames/"
-        else:
-            folder_name = filename.split('--')[0]
-            path = path_source + folder_name + "/" + folder_name + "/frames/"
-       
-        try:
-            copyfile(path+filename, "../images/TrafficLISA/"+filename)
-            count +=1
-        except FileNotFoundError:
-            print('Folder {} does not exist. Please create it and try again.'.format(path))
-            return
-    assert(count == len(img_filenames))
-
-    print('Copied {} images to {}'.format(count, path+"relabel"))
-
-
-def split_anns(df_anns, split=0.8, copy_files=False):
+    root = os.path.abspath(path_source)
+
+    if index_file is not None and os.path.isfile(index_file):
+        with open(index_file, 'r') as f:
+            saved = json.load(f)
+        if saved.get('root') == root:
+            print("Loaded index of {} LISA images from {}.".format(len(saved['files']), index_file))
+            return saved['files']
+
+    index = dict()
+    folders = [root]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    index[entry.name] = entry.path
+    print("Indexed {} LISA images in {}.".format(len(index), root))
+
+    if index_file is not None:
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump({'root': root, 'files': index}, f)
+
+    return index
+
+
+def _transfer_file(src, dst, mode):
+    # Copies, hardlinks or symlinks a single file
+    if mode == "copy":
+        copyfile(src, dst)
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(src, dst)
+    else:
+        raise ValueError("Unknown mode {}. Use copy, hardlink or symlink.".format(mode))
+
+
+@timed()
+def copy_images_from_lisa(img_filenames, path_source, path_out="../images/TrafficLISA/",
+                          mode="copy", num_workers=8, index_file="./lisa_index.json"):
+    """
+    Collects the images in the given list from the dataset folders
+    as downloaded into a single folder.
+
+    Inputs:
+    img_filenames - List of image filenames to collect.
+    path_source   - Root folder of the LISA dataset.
+    path_out      - Output folder.
+    mode          - "copy", "hardlink" or "symlink".
+    num_workers   - Number of threads used for the file operations.
+    index_file    - Path of the persisted filename index, None to disable.
+
+    Returns:
+    missing       - List of filenames which could not be collected.
+    """
+    if mode not in ("copy", "hardlink", "symlink"):
+        raise ValueError("Unknown mode {}. Use copy, hardlink or symlink.".format(mode))
+
+    index = build_lisa_index(path_source, index_file)
+    os.makedirs(path_out, exist_ok=True)
+
+    missing = [filename for filename in img_filenames if filename not in index]
+    jobs = [filename for filename in img_filenames if filename in index]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_transfer_file, index[filename], os.path.join(path_out, filename), mode): filename
+                   for filename in jobs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except OSError as e:
+                failed.append((futures[future], str(e)))
+
+    count = len(jobs) - len(failed)
+    print('Collected {} / {} images in {} ({}).'.format(count, len(img_filenames), path_out, mode))
+    if missing:
+        print('{} images not found in {}, e.g. {}'.format(len(missing), path_source, missing[:5]))
+    if failed:
+        print('{} images failed, e.g. {}'.format(len(failed), failed[:5]))
+
+    return missing + [filename for filename, _ in failed]
+
+
+def get_clip_names(names):
+    """
+    Returns the clip or sequence of each LISA image name,
+    e.g. dayClip3 for dayClip3--00012.jpg.
+    """
+    return names.str.split('--', n=1).str[0]
+
+
+@timed()
+def split_anns(df_anns, split=0.8, copy_files=False, group_by="image"):
     """
     Splits the data into train and val. Data is given as a dataframe.
     Copies the image files into folders if copy_file=True.
+
+    With group_by="image" images are assigned to train or val at random.
+    With group_by="clip" whole dayClip/nightClip sequences are assigned, so
+    that near identical frames of a clip do not end up in both splits.
+    The rows are reordered once by fold, train and val are slices of that frame.
     """
-    
-    # Get all images and sample them
-    img_files = list(set(df_anns['name']))  
-    num_train = int(len(img_files) * split)
-    num_val = len(img_files) - num_train
-    
-    # Sample
-    random.seed(1867)
-    imgs_train = random.sample(img_files, num_train)
-    imgs_val = get_diff(img_files, imgs_train)  
-    assert(len(imgs_train) == num_train)
-    assert(len(imgs_val) == num_val)
-    assert(len(img_files) == (len(imgs_train) + len(imgs_val)))
-
-    # Filter dataframes
-    train = df_anns[df_anns['name'].isin(imgs_train)]
-    val = df_anns[df_anns['name'].isin(imgs_val)]
+    if group_by not in ("image", "clip"):
+        raise ValueError("Unknown group_by {}. Use image or clip.".format(group_by))
+
+    # Integer codes for images and groups
+    names = df_anns['name'].astype(str)
+    img_codes, img_files = pd.factorize(names)
+    if group_by == "clip":
+        group_codes, groups = pd.factorize(get_clip_names(names))
+    else:
+        group_codes, groups = img_codes, img_files
+
+    # Group of each image and number of images per group
+    _, first_rows = np.unique(img_codes, return_index=True)
+    img_groups = group_codes[first_rows]
+    group_sizes = np.bincount(img_groups, minlength=len(groups))
+
+    # Shuffle groups and fill train up to the split
+    num_train_target = int(len(img_files) * split)
+    rng = np.random.RandomState(1867)
+    order = rng.permutation(len(groups))
+    sizes = group_sizes[order]
+    cum_before = np.cumsum(sizes) - sizes
+    is_train_group = np.zeros(len(groups), dtype=bool)
+    is_train_group[order[(cum_before + 0.5 * sizes) < num_train_target]] = True
+
+    is_train_img = is_train_group[img_groups]
+    imgs_train = list(img_files[is_train_img])
+    imgs_val = list(img_files[~is_train_img])
+    num_train = len(imgs_train)
+    num_val = len(imgs_val)
+    assert(len(img_files) == (num_train + num_val))
+
+    # Reorder rows once, train first, and slice
+    is_train_row = is_train_group[group_codes]
+    num_train_rows = int(is_train_row.sum())
+    df_sorted = df_anns.iloc[np.argsort(~is_train_row, kind='stable')]
+    train = df_sorted.iloc[:num_train_rows]
+    val = df_sorted.iloc[num_train_rows:]
     assert(len(df_anns) == (len(train) + len(val)))
     print("Split data into {} train and {} val imags.".format(num_train, num_val))
+    if group_by == "clip":
+        print("Assigned {} clips to train and {} clips to val.".format(
+            int(is_train_group.sum()), int((~is_train_group).sum())))
 
     if copy_files is True:
         print("Copying image files to train and val folders...")
@@ -131,9 +250,27 @@ def split_anns(df_anns, split=0.8, copy_files=False):
     return train, val
 
 
-def make_coco_ann(df_ann, filename_out, save=False):
+@contextmanager
+def _paused_gc():
+    # Pauses the cyclic garbage collector while many records without
+    # reference cycles are built, its passes would otherwise dominate
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+@timed()
+def make_coco_ann(df_ann, filename_out, save=False, image_sizes=None, ann_dir="../annotations/"):
     """
-    Converts a list of lists of annotations into a COCO .json object.
+    Converts a dataframe of makesense.ai annotations into a COCO .json object.
+    The conversion works on whole columns and does not modify df_ann.
+    Image sizes are taken from image_sizes (filename -> (width, height), see
+    image_meta.probe_directory). Images without an entry get the LISA
+    default size 1280x960.
     """
     # Objects
     info = {
@@ -151,117 +288,127 @@ def make_coco_ann(df_ann, filename_out, save=False):
             "name": "Attribution-NonCommercial-ShareAlike License"
         }]
     # Categories for the traffic dataset.
-    categories = [{'supercategory': 'person', 'id': 1, 'name': 'person'},
-    {'supercategory': 'vehicle', 'id': 2, 'name': 'bicycle'},
-    {'supercategory': 'vehicle', 'id': 3, 'name': 'car'},
-    {'supercategory': 'vehicle', 'id': 4, 'name': 'motorcycle'},
-    {'supercategory': 'vehicle', 'id': 6, 'name': 'bus'},
-    {'supercategory': 'vehicle', 'id': 7, 'name': 'train'},
-    {'supercategory': 'vehicle', 'id': 8, 'name': 'truck'},
-    {'supercategory': 'outdoor', 'id': 10, 'name': 'traffic light'},
-    {'supercategory': 'outdoor', 'id': 11, 'name': 'fire hydrant'},
-    {'supercategory': 'outdoor', 'id': 13, 'name': 'stop sign'}, 
-    {'supercategory': 'animal', 'id': 17, 'name': 'cat'},
-    {'supercategory': 'animal', 'id': 18, 'name': 'dog'},
-    {'supercategory': 'outdoor', 'id': 92, 'name': 'traffic_light_red'},
-    {'supercategory': 'outdoor', 'id': 93, 'name': 'traffic_light_green'},
-    {'supercategory': 'outdoor', 'id': 94, 'name': 'traffic_light_na'}]
+    categories = [dict(cat) for cat in CATEGORIES]
 
-    # Add images
-    images = []
-    img_names = list(set(df_ann['name']))
+    # Work on a copy so the caller's dataframe and index stay untouched
+    df = df_ann.reset_index(drop=True)
+    names = df['name'].astype(str)
+    img_codes, img_names = pd.factorize(names)
+    img_names = img_names.tolist()  # Iterating the pandas array is slow
+    img_name_ids = [name.split('.')[0] for name in img_names]
+    img_ids = np.array(img_name_ids, dtype=object)[img_codes].tolist()
 
-    for img_name in img_names:
-        images.append({
+    # Add images
+    if image_sizes is None:
+        image_sizes = dict()
+    img_sizes = [image_sizes.get(name, (1280, 960)) for name in img_names]
+    images = [{
             "license": 9,
             "file_name": img_name,
             "coco_url": "",
-            "height": 960,
-            "width": 1280,
+            "height": img_size[1],
+            "width": img_size[0],
             "date_captured": "2019-09-27",
             "flickr_url": "",
-            "id": img_name.split('.')[0]
-        })
+            "id": img_id
+        } for img_name, img_id, img_size in zip(img_names, img_name_ids, img_sizes)]
  
     # Label mapping
-    label_to_ind = {"person":1, "car":3, "bus":6, "train":7, "truck":8, "traffic light":10, "fire hydrant":11,
-    "traffic_light_red":92, "traffic_light_green":93, "traffic_light_na":94}
-
-    # Add annotations
-    annotations = []
-    ann_id = 1 # Format: Number + l
-    df_ann.reset_index(inplace=True)
-
-    for i in range(len(df_ann)):
-        ann = df_ann.loc[i]
-        name = ann['name']
-        label = label_to_ind[ann['label']]
-        box = [float(ann['x']), float(ann['y']), float(ann['w']), float(ann['h'])]
-        annotations.append({'segmentation': [[]],
-        'area': '',
-        'iscrowd': 0,
-        'image_id': name.split('.')[0],
-        'bbox': box,
-        'category_id': label,
-        'id': str(ann_id) + "l"}) 
-        ann_id+=1
+    label_to_ind = CATEGORY_IDS
+
+    # Map labels to category ids through their position in the label index
+    codes = pd.Index(list(label_to_ind.keys())).get_indexer(df['label'])
+    unknown = codes < 0
+    if unknown.any():
+        raise KeyError("Unknown labels in annotations: {}".format(sorted(set(df['label'][unknown]))))
+    category_ids = np.array(list(label_to_ind.values()))[codes]
+
+    # Boxes and areas
+    boxes = df[['x', 'y', 'w', 'h']].to_numpy(dtype=np.float64)
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    # Add annotations. Several small objects per row, see _paused_gc.
+    ann_ids = (pd.RangeIndex(1, len(df) + 1).astype(str) + "l").tolist() # Format: Number + l
+    with _paused_gc():
+        annotations = [{'segmentation': [[]],
+            'area': area,
+            'iscrowd': 0,
+            'image_id': img_id,
+            'bbox': box,
+            'category_id': label,
+            'id': ann_id}
+            for img_id, box, label, area, ann_id in zip(img_ids, boxes.tolist(),
+                category_ids.tolist(), areas.tolist(), ann_ids)]
   
     coco_ann = {'info':info, 'licenses':licenses, 'images':images, 'annotations':annotations, 'categories':categories}
     
     # Save to disk
     if save is True:
-        path_ouot = "../annotations/"
-        with open(str(path_ouot+filename_out)+'.json', 'w', encoding='utf-8') as f:
-            json.dump(coco_ann, f, ensure_ascii=False, indent=4)
-
-    print('Saved dataset {} to disk!'.format(filename_out))
+        save_coco_ann(coco_ann, filename_out, ann_dir)
 
     return coco_ann
 
 
-def append_coco_anns(filename_anns_1, anns_to_append, filename_out):
+def save_coco_ann(coco_ann, filename_out, ann_dir="../annotations/"):
+    # Saves a LISA annotation file
+    with open(str(ann_dir+filename_out)+'.json', 'w', encoding='utf-8') as f:
+        json.dump(coco_ann, f, ensure_ascii=False, indent=4)
+
+    print('Saved dataset {} to disk!'.format(filename_out))
+
+
+@timed()
+def append_coco_anns(filename_anns_1, anns_to_append, filename_out, remap="keep", ann_dir="../annotations/"):
     """
     Appends the LISA annotations to given coco annotations.
+    The result is streamed to disk, see merge_coco.merge_coco_files.
     """
-    
-    # Load dataset traffic to which we want to append
-    ann_file = "../annotations/" + filename_anns_1 + ".json"
-    f = open(ann_file)
-    anns = json.load(f)
-    print("Loaded {} annotations from file {}.".format(len(anns['annotations']), filename_anns_1))
-
-    # Append LISA stuff to the traffic dataset.
-    info_out = anns['info']
-    licenses_out = anns['licenses'] + anns_to_append['licenses']
-    assert(len(licenses_out) == 9)
-    categories_out = anns_to_append['categories']
-    assert(len(categories_out) == 15)
-    images_out = anns['images'] + anns_to_append['images']
-    annotations_out = anns['annotations'] + anns_to_append['annotations']
-    print("Number of images: {}".format(len(images_out)))
-    print("Number of annotations: {}".format(len(annotations_out)))
-
-    anns_out = {'info':info_out, 'licenses':licenses_out, 'images':images_out, 
-    'annotations':annotations_out, 'categories':categories_out}
-    
-    # Save annotations
-    with open("../annotations/" + str(filename_out)+'.json', 'w', encoding='utf-8') as f:
-        json.dump(anns_out, f, ensure_ascii=False, indent=4)
+    ann_file = ann_dir + filename_anns_1 + ".json"
+    path_out = ann_dir + str(filename_out) + ".json"
+    merge_coco_files([ann_file, anns_to_append], path_out, remap=remap)
 
     print('Saved dataset {} to disk!'.format(filename_out))
 
 
-if __name__ == "__main__":
-    anns_lisa = load_LISA_annotations(["cocoTrafficLightsLISA-part1.csv", 
-                "cocoTrafficLightsLISA-part2.csv", "cocoTrafficLightsLISA-part3.csv"])
+def import_lisa(makesense_files, makesense_path="./relabelled/", ann_dir="../annotations/",
+                img_dir="../images/TrafficLISA/", lisa_source=None, save=False,
+                dedup_distance=None, dedup_policy="middle"):
+    """
+    Converts the makesense.ai LISA annotations to COCO train and val
+    files and appends them to the COCO Traffic annotations in ann_dir.
+    Collects the LISA images into img_dir first if lisa_source is given.
+    If dedup_distance is given, near-duplicate frames within this Hamming
+    distance are reduced to one per cluster (see dedup_lisa.py).
+    """
+    anns_lisa = load_LISA_annotations(makesense_files, makesense_path)
     imgs_name_list = filter_lisa_anns(anns_lisa)
-    #copy_images_from_lisa(imgs_name_list, "<path_to_the_lisa_dataset>")
+    if lisa_source is not None:
+        copy_images_from_lisa(imgs_name_list, lisa_source, path_out=img_dir)
     anns_lisa = anns_lisa[anns_lisa["name"].isin(imgs_name_list)]
+    if dedup_distance is not None:
+        imgs_name_list, report = dedup_frames(imgs_name_list, img_dir, dedup_distance, dedup_policy,
+                                              num_boxes=anns_lisa["name"].value_counts().to_dict())
+        print_report(report)
+        anns_lisa = anns_lisa[anns_lisa["name"].isin(imgs_name_list)]
     assert(len(set(anns_lisa['name'])) == len(imgs_name_list))
     
     # Split data into train and val
-    df_train, df_val = split_anns(anns_lisa, split=0.8, copy_files=False)
-    anns_train = make_coco_ann(df_train, "instances_trainTrafficLISA", save=False)
-    anns_val = make_coco_ann(df_val, "instances_valTrafficLISA", save=False)
-    append_coco_anns("./before_lisa/instances_trainTraffic", anns_train, "instances_trainTraffic")
-    append_coco_anns("./before_lisa/instances_valTraffic", anns_val, "instances_valTraffic")
+    df_train, df_val = split_anns(anns_lisa, split=0.8, copy_files=False, group_by="clip")
+    lisa_sizes = probe_directory(img_dir, cache_file=os.path.join(img_dir, ".image_sizes.json"))
+    anns_train = make_coco_ann(df_train, "instances_trainTrafficLISA", image_sizes=lisa_sizes, ann_dir=ann_dir)
+    anns_val = make_coco_ann(df_val, "instances_valTrafficLISA", image_sizes=lisa_sizes, ann_dir=ann_dir)
+
+    # Validate before anything is written. The image files are only checked if they are there.
+    check_dir = img_dir if os.path.isdir(img_dir) else None
+    check_dataset(anns_train, "trainTrafficLISA", img_dir=check_dir, decode=False)
+    check_dataset(anns_val, "valTrafficLISA", img_dir=check_dir, decode=False)
+    if save:
+        save_coco_ann(anns_train, "instances_trainTrafficLISA", ann_dir)
+        save_coco_ann(anns_val, "instances_valTrafficLISA", ann_dir)
+    append_coco_anns("./before_lisa/instances_trainTraffic", anns_train, "instances_trainTraffic", ann_dir=ann_dir)
+    append_coco_anns("./before_lisa/instances_valTraffic", anns_val, "instances_valTraffic", ann_dir=ann_dir)
+
+
+if __name__ == "__main__":
+    import_lisa(["cocoTrafficLightsLISA-part1.csv", 
+                "cocoTrafficLightsLISA-part2.csv", "cocoTrafficLightsLISA-part3.csv"])
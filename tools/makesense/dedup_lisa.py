@@ -0,0 +1,176 @@
+# =================================================================== #
+# Removes near-duplicate LISA frames.                                 #
+#                                                                     #
+# LISA images are consecutive frames of dayClip / nightClip videos.   #
+# Each frame is decoded and downscaled to 32x32 grayscale in a        #
+# process pool. Perceptual hashes are then computed for all frames    #
+# at once, either as DCT hash (sign of the low frequency DCT          #
+# coefficients against their median) or average hash.                 #
+#                                                                     #
+# Within each clip, frames are visited in order and join the nearest  #
+# cluster whose representative is within max_distance bits, else     #
+# they start a new cluster. One frame per cluster is kept:            #
+# first       - First frame of the cluster                            #
+# middle      - Middle frame of the cluster                           #
+# most_boxes  - Frame with the most annotations                       #
+# sharpest    - Frame with the highest variance of the Laplacian      #
+# =================================================================== #
+
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2 as cv
+
+POLICIES = ("first", "middle", "most_boxes", "sharpest")
+
+_SIZE = 32  # Side of the downscaled frames
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _downscale(path):
+    # Worker: returns the 32x32 grayscale frame and its sharpness, None if unreadable
+    image = cv.imread(path, cv.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    sharpness = float(cv.Laplacian(image, cv.CV_32F).var())
+    small = cv.resize(image, (_SIZE, _SIZE), interpolation=cv.INTER_AREA)
+    return small, sharpness
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II matrix
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+def perceptual_hashes(frames, method="dct", hash_size=8):
+    """
+    Hashes a stack of frames (N, 32, 32) into N 64 bit hashes.
+
+    Inputs:
+    frames    - uint8 or float array of downscaled grayscale frames.
+    method    - "dct" or "average".
+    hash_size - Side of the hashed block, 8 gives 64 bits.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    if method == "dct":
+        d = _dct_matrix(frames.shape[1]).astype(np.float32)
+        coeffs = (d @ frames @ d.T)[:, :hash_size, :hash_size].reshape(len(frames), -1)
+        bits = coeffs > np.median(coeffs[:, 1:], axis=1, keepdims=True)  # Without the DC term
+    elif method == "average":
+        f = frames.shape[1] // hash_size
+        blocks = frames.reshape(len(frames), hash_size, f, hash_size, f).mean(axis=(2, 4)).reshape(len(frames), -1)
+        bits = blocks > blocks.mean(axis=1, keepdims=True)
+    else:
+        raise ValueError("Unknown hash method {}.".format(method))
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def hamming(a, b):
+    # Bitwise distances between the hash a and an array of hashes b
+    x = np.bitwise_xor(np.asarray(b, dtype=np.uint64), np.uint64(a))
+    return _POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def cluster_clip(hashes, max_distance):
+    """
+    Clusters the frames of one clip in order. Returns the cluster index of
+    each frame.
+    """
+    labels = np.empty(len(hashes), dtype=np.int64)
+    reps = []
+    for i, h in enumerate(hashes):
+        if reps:
+            dist = hamming(h, hashes[reps])
+            j = int(np.argmin(dist))
+            if dist[j] <= max_distance:
+                labels[i] = j
+                continue
+        labels[i] = len(reps)
+        reps.append(i)
+    return labels
+
+
+def _pick(members, policy, num_boxes, sharpness):
+    # Index of the frame kept from a cluster, members are in frame order
+    if policy == "first":
+        return members[0]
+    if policy == "middle":
+        return members[len(members) // 2]
+    if policy == "most_boxes":
+        return max(members, key=lambda i: num_boxes[i])
+    return max(members, key=lambda i: sharpness[i])
+
+
+def dedup_frames(names, img_dir, max_distance=6, policy="middle", method="dct",
+                 num_boxes=None, num_workers=None):
+    """
+    Finds near-duplicate frames of the LISA clips.
+
+    Inputs:
+    names        - Image file names, e.g. dayClip3--00012.jpg.
+    img_dir      - Folder with the images.
+    max_distance - Largest Hamming distance of frames in one cluster (of 64 bits).
+    policy       - Which frame of a cluster is kept, see POLICIES.
+    method       - "dct" or "average" hash.
+    num_boxes    - Optional dictionary name -> number of annotations.
+    num_workers  - Number of processes decoding the frames.
+
+    Returns:
+    keep         - List of the kept names. Unreadable frames are kept.
+    report       - Dictionary with frames per clip before and after.
+    """
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy {}, expected one of {}.".format(policy, POLICIES))
+    names = sorted(names)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(_downscale, [os.path.join(img_dir, n) for n in names], chunksize=32))
+
+    readable = [i for i, r in enumerate(results) if r is not None]
+    hashes = np.zeros(len(names), dtype=np.uint64)
+    if readable:
+        hashes[readable] = perceptual_hashes(np.stack([results[i][0] for i in readable]), method)
+    sharpness = [r[1] if r is not None else 0.0 for r in results]
+    boxes = [(num_boxes or {}).get(n, 0) for n in names]
+
+    clips = defaultdict(list)
+    for i in readable:
+        clips[names[i].split('--', 1)[0]].append(i)
+
+    keep = set(i for i, r in enumerate(results) if r is None)
+    report = {'clips': dict(), 'unreadable': len(names) - len(readable)}
+    for clip, rows in sorted(clips.items()):
+        labels = cluster_clip(hashes[rows], max_distance)
+        members = defaultdict(list)
+        for row, label in zip(rows, labels):
+            members[label].append(row)
+        for m in members.values():
+            keep.add(_pick(m, policy, boxes, sharpness))
+        report['clips'][clip] = {'frames': len(rows), 'kept': len(members)}
+
+    keep = [names[i] for i in sorted(keep)]
+    report['frames'] = len(names)
+    report['kept'] = len(keep)
+    if num_boxes is not None:
+        report['boxes'] = sum(boxes)
+        report['boxes_kept'] = sum(num_boxes.get(n, 0) for n in keep)
+    return keep, report
+
+
+def print_report(report):
+    """
+    Prints how much the deduplication shrinks the data.
+    """
+    for clip, r in report['clips'].items():
+        print("  {}: {} -> {} frames".format(clip, r['frames'], r['kept']))
+    shrink = 1 - report['kept'] / report['frames'] if report['frames'] else 0
+    print("Kept {} / {} frames ({:.1%} fewer).".format(report['kept'], report['frames'], shrink))
+    if 'boxes' in report:
+        print("Kept {} / {} annotations.".format(report['boxes_kept'], report['boxes']))
+    if report['unreadable']:
+        print("Could not read {} frames, they are kept.".format(report['unreadable']))
@@ -16,6 +16,12 @@ import torch
 import torchvision.transforms as T
 from PIL import Image
 import csv
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../api"))
+from instrument import timed
 
 
 def read_list_to_annotate(filename):
@@ -67,6 +73,7 @@ def auto_annotate(img_paths):
     return annotations
 
 
+@timed()
 def predict(model, img_path, thresh= 0.6):
     """
     Predicts for a given image path
@@ -110,8 +117,8 @@ def predict(model, img_path, thresh= 0.6):
     return out
 
 
-def save_annotations(anns):
-    filename_out = 'annotations.csv'
+@timed()
+def save_annotations(anns, filename_out='annotations.csv'):
     file = open(filename_out, 'w+', newline = '')
 
     with file:
@@ -122,10 +129,10 @@ def save_annotations(anns):
 
 
 if __name__ == "__main__":
-    filename = input("Enter name of file with annotations: ")
-    if filename == "":
-        filename = 'to_annotate-test.txt'
-        print("Using default name {}".format(filename))
-    img_paths = read_list_to_annotate(filename)
+    parser = argparse.ArgumentParser(description="Pre-annotates images with DETR.")
+    parser.add_argument("filename", nargs="?", default="to_annotate-test.txt", help="File with one image path per line")
+    parser.add_argument("--out", default="annotations.csv", help="Output .csv file")
+    args = parser.parse_args()
+    img_paths = read_list_to_annotate(args.filename)
     anns = auto_annotate(img_paths)
-    save_annotations(anns)
\ No newline at end of file
+    save_annotations(anns, args.out)